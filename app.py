@@ -1,21 +1,50 @@
 import streamlit as st
 import anthropic
 import pandas as pd
+import jobs
+import outbox
+import hashlib
+import os
+import uuid
 from utils import (
     calculate,
     read_csv,
+    find_product,
+    query_dataset,
     update_used,
     call_local_store,
-    get_base64_encoded_image,
+    check_local_store_call,
+    call_local_stores,
+    run_local_store_call,
+    run_multi_vendor_quote,
+    prepare_image,
     save_audio_to_mp3,
     transcribe_audio_with_elevenlabs,
-    send_order_email,
+    queue_purchase_orders,
+    deliver_email,
+    place_order,
+    resolve_basket,
+    plan_reorders,
     get_supplier_info,
     extract_contract_from_pdf,
-    parse_contract_to_df
+    parse_contract_to_df,
+    use_sqlite
 )
 
 from utils import tool_definitions
+from tool_executor import execute_tool_blocks
+from contract_ingest import upsert_contracts
+from transcription import transcribe_batch, upload_stats, cache as transcript_cache
+from conversation import (
+    cached_system,
+    cached_tools,
+    with_cache_breakpoint,
+    usage_summary,
+    compact_messages,
+    estimate_tokens,
+    MAX_HISTORY_MESSAGES,
+    HISTORY_TOKEN_BUDGET,
+)
 
 st.title("🔩 NAIled It – Procurement Assistant for C Materials")
 st.caption("C materials are consumable, low-value items like fasteners, nails, screws, and small parts used across projects.")
@@ -30,7 +59,11 @@ else:
 # Initialize ElevenLabs
 if "ELEVENLABS_API_KEY" in st.secrets:
     from elevenlabs_tools import init_elevenlabs
-    init_elevenlabs(st.secrets["ELEVENLABS_API_KEY"])
+    init_elevenlabs(
+        st.secrets["ELEVENLABS_API_KEY"],
+        webhook_port=st.secrets.get("ELEVENLABS_WEBHOOK_PORT"),
+        webhook_secret=st.secrets.get("ELEVENLABS_WEBHOOK_SECRET"),
+    )
 else:
     st.warning("Missing ELEVENLABS_API_KEY - transcription will not work")
     
@@ -43,22 +76,32 @@ if "precheck_done" not in st.session_state:
     st.session_state.precheck_done = False
 if "precheck_in_progress" not in st.session_state:
     st.session_state.precheck_in_progress = False
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# Tools run on worker threads, which cannot read st.session_state
+SESSION_ID = st.session_state.session_id
+job_queue = jobs.get_queue()
+job_queue.register("local_store_call", run_local_store_call)
+job_queue.register("multi_vendor_quote", run_multi_vendor_quote)
+# Deliver queued order emails in the background (idempotent across reruns)
+outbox.get_outbox().start(deliver_email)
 
 # Hidden System Prompt (not shown to users)
-def order_product(product_id, quantity):
+def order_product(product_id, quantity, idempotency_key=None):
     """
     Wrapper function to handle product ordering via email.
-    Retrieves contract and supplier info, then sends order email.
+    Retrieves contract and supplier info, then queues the order email in the
+    outbox; it is delivered in the background.
     """
     try:
-        # Read contracts to get product and supplier info
-        contracts_df = pd.read_csv("contracts.csv")
-        product = contracts_df[contracts_df['product_id'] == product_id]
+        # Contract line and supplier, picked as for place_order and update_used
+        # (the line with the most quantity left)
+        product_row = resolve_basket([{"product_id": product_id, "quantity": quantity}]).iloc[0].to_dict()
         
-        if product.empty:
+        if pd.isna(product_row["contract_quantity"]):
             return f"Error: Product {product_id} not found in contracts"
         
-        product_row = product.iloc[0]
         product_name = product_row['product_name']
         unit_price = product_row['unit_price_eur']
         total_price = unit_price * quantity
@@ -66,7 +109,10 @@ def order_product(product_id, quantity):
         delivery_days = product_row['delivery_days']
         
         # Get supplier info
-        supplier_info = get_supplier_info(supplier_id)
+        if pd.notna(product_row.get('contact_email')):
+            supplier_info = product_row
+        else:
+            supplier_info = get_supplier_info(supplier_id)
         
         if "error" in supplier_info:
             return supplier_info["error"]
@@ -74,16 +120,16 @@ def order_product(product_id, quantity):
         supplier_name = supplier_info['supplier_name']
         supplier_email = supplier_info['contact_email']
         
-        # Send order email
-        result = send_order_email(
-            to_email=supplier_email,
-            supplier_name=supplier_name,
-            product_name=product_name,
-            quantity=quantity,
-            unit_price=unit_price,
-            total_price=total_price,
-            delivery_days=delivery_days
-        )
+        # Queue order email (delivered and retried by the outbox worker)
+        result = queue_purchase_orders([{
+            "supplier_email": supplier_email,
+            "supplier_name": supplier_name,
+            "product_name": product_name,
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "total_price": total_price,
+            "delivery_days": delivery_days,
+        }], idempotency_key)[0]
         
         return result
         
@@ -91,14 +137,49 @@ def order_product(product_id, quantity):
         return f"Error processing order: {e}"
 
 
+def run_tool(tool_block):
+    """Dispatches one tool_use block to its implementation and returns the result."""
+    tool_name = tool_block.name
+    tool_input = tool_block.input
+    
+    result = "Error: Unknown tool"
+    if tool_name == "calculate":
+        result = calculate(tool_input["expression"])
+    elif tool_name == "read_csv":
+        dataset = tool_input.get("dataset", "contracts") if tool_input else "contracts"
+        result = read_csv(dataset)
+    elif tool_name == "query_dataset":
+        result = query_dataset(**tool_input)
+    elif tool_name == "find_product":
+        result = find_product(tool_input["query"], tool_input.get("top_k", 5), tool_input.get("source"))
+    elif tool_name == "update_used":
+        result = update_used(tool_input["product_id"], tool_input["used_quantity"])
+    elif tool_name == "call_local_store":
+        result = call_local_store(tool_input["item_name"], tool_input["quantity"], session_id=SESSION_ID)
+    elif tool_name == "call_local_stores":
+        result = call_local_stores(tool_input["item_name"], tool_input["quantity"], tool_input.get("max_vendors", 3), session_id=SESSION_ID)
+    elif tool_name == "check_local_store_call":
+        result = check_local_store_call(tool_input["job_id"])
+    elif tool_name == "send_order_email":
+        result = order_product(tool_input["product_id"], tool_input["quantity"], idempotency_key=tool_block.id)
+    elif tool_name == "plan_reorders":
+        result = plan_reorders(tool_input.get("threshold", 0.05))
+    elif tool_name == "place_order":
+        result = place_order(tool_input["lines"], tool_input.get("record_usage", False), idempotency_key=tool_block.id)
+    return result
+
+
+TOOL_NAMES = {tool["name"] for tool in tool_definitions}
+
+
 SYSTEM_PROMPT = """
 You are an expert Procurement Assistant. Your role is to identify materials, verify contract details, monitor inventory, and manage orders using specific tools. You are professional, efficient, and precise.
 
 <workflow_steps>
 
 0. **Inventory Pre-Check** (run before answering)
-    - Call `read_csv` with dataset="inventory" to inspect current stock and storage percentages.
-    - If any item has storage < 5%, ask the user if you should place an order for that item right away.
+    - The startup message contains a reorder plan for items under 5% storage (computed with `plan_reorders`); do not re-read the inventory for it.
+    - If the plan lists items, summarize them (suggested quantity, contract vs. local store split) and ask the user if you should place the orders right away.
 
 1. **Input Analysis**
     - If the user provides text: Identify the item name and requested quantity.
@@ -106,7 +187,7 @@ You are an expert Procurement Assistant. Your role is to identify materials, ver
     - If the quantity is missing, ask the user to specify it before proceeding.
 
 2. **Inventory Check FIRST (Critical Step)**
-    - BEFORE doing anything else, call `read_csv` with dataset="inventory" to check current stock levels.
+    - BEFORE doing anything else, call `query_dataset` with dataset="inventory" and the item's product_id (or name) to check current stock levels.
     - Find the requested item and check its storage percentage.
     - **IF storage > 0.9 (90% full):**
         - STOP immediately and inform the user that inventory is at [X]% capacity
@@ -118,7 +199,7 @@ You are an expert Procurement Assistant. Your role is to identify materials, ver
         - Proceed normally to step 3
 
 3. **Database Lookup (Contracts)**
-    - Use the `read_csv` tool with dataset="contracts" to search for the identified item.
+    - Use the `find_product` tool to resolve the identified item to a product_id, then `query_dataset` with dataset="contracts" and that product_id for its contract details.
     - Retrieve: 'Unit Cost', 'Supplier Email', 'Total Contract Limit', and 'Used Amount'.
     - Check contract availability: Calculate (Total Contract Limit - Used Amount) and compare to requested quantity.
 
@@ -133,8 +214,8 @@ You are an expert Procurement Assistant. Your role is to identify materials, ver
     - Ask for explicit confirmation for this split approach
     - After confirmation:
         1. First, process the contract portion (calculate cost, prepare email, update_used)
-        2. Then, use `call_local_store` tool for the surplus quantity
-        3. Confirm both orders to the user
+        2. Then, use `call_local_store` tool for the surplus quantity (it runs in the background and returns a job ID). For large surpluses, use `call_local_stores` instead to compare quotes from several vendors
+        3. Confirm both orders to the user; the call transcript is posted to the chat when the call ends
 
     **Branch B: Sufficient Contract Quantity**
     - Use the `calculate` tool to determine the Total Price (Unit Cost * Requested Quantity).
@@ -148,12 +229,14 @@ You are an expert Procurement Assistant. Your role is to identify materials, ver
     - Once the user confirms the order (and has confirmed twice if inventory was high):
     - A) Write an email to the Supplier Email (already implemented in `order_product` function).
     - B) Use the `update_used` tool to add the order cost/amount to the 'Used' column in the CSV.
+    - For several products at once (e.g., a restock), use `place_order` with all lines instead: it checks every line against its contract, sends one purchase order per supplier, and with record_usage=true also books the quantities (no separate `update_used` calls needed).
     - C) Confirm to the user that the order has been placed and the contract record updated.
     - D) Immediately ask the user if they want to order anything else and be ready to repeat the workflow.
 
 </workflow_steps>
 
 <guidelines>
+- Prefer `query_dataset` and `find_product` over `read_csv`; only request the rows and columns you need.
 - Always use the `calculate` tool for math; do not calculate mentally.
 - Never place an order or update the CSV without explicit user confirmation.
 - For high inventory items (>90%), require TWO confirmations: one when inventory is checked, one before final order placement.
@@ -164,6 +247,10 @@ You are an expert Procurement Assistant. Your role is to identify materials, ver
 </guidelines>
 """
 
+# Static request prefix with prompt-cache breakpoints (tools, then system prompt)
+CACHED_TOOLS = cached_tools(tool_definitions)
+CACHED_SYSTEM = cached_system(SYSTEM_PROMPT)
+
 # 4. Sidebar for Image Uploads
 with st.sidebar:
     st.header("⚙️ Settings")
@@ -188,9 +275,10 @@ with st.sidebar:
         # Check if this is a new recording
         audio_value = audio_bytes.getvalue()
         
-        if "last_audio_hash" not in st.session_state or st.session_state["last_audio_hash"] != hash(audio_value):
-            # New recording detected
-            st.session_state["last_audio_hash"] = hash(audio_value)
+        audio_hash = hashlib.sha256(audio_value).hexdigest()
+        if st.session_state.get("last_audio_hash") != audio_hash:
+            # New recording detected (re-sent memos are answered from the transcript cache)
+            st.session_state["last_audio_hash"] = audio_hash
             
             with st.spinner("Transcribing with ElevenLabs..."):
                 transcription = transcribe_audio_with_elevenlabs(audio_value)
@@ -215,7 +303,36 @@ with st.sidebar:
             st.session_state.audio_key += 1
             st.session_state.pop("last_audio_hash", None)
             st.rerun()
-    
+
+    # Backlog of recorded memos (e.g. from a phone), transcribed concurrently
+    memo_files = st.file_uploader(
+        "Or upload several memos", type=["mp3", "wav", "m4a", "ogg", "webm"],
+        accept_multiple_files=True, key=f"memos_{st.session_state.audio_key}"
+    )
+    if memo_files and st.button(f"📝 Transcribe {len(memo_files)} memo(s)"):
+        with st.spinner(f"Transcribing {len(memo_files)} memos with ElevenLabs..."):
+            texts = transcribe_batch([(f.getvalue(), os.path.splitext(f.name)[1] or ".mp3") for f in memo_files])
+        failed = [(f.name, t) for f, t in zip(memo_files, texts) if t.startswith("Error:")]
+        for name, error in failed:
+            st.error(f"{name}: {error}")
+        memos = [f"Memo {i} ({f.name}): {t}" for i, (f, t) in enumerate(zip(memo_files, texts), 1) if not t.startswith("Error:")]
+        if memos:
+            st.session_state.messages.append({"role": "user", "content": "\n\n".join(memos)})
+            st.session_state.message_internal_flags.append(False)
+            st.session_state["trigger_response"] = True
+            st.session_state.audio_key += 1
+            st.rerun()
+
+    if dev_mode:
+        stats = transcript_cache.stats()
+        st.caption(f"Transcript cache: {stats['entries']} entries, {stats['hits']} hits / {stats['misses']} misses")
+        if upload_stats["recordings"]:
+            st.caption(f"Audio uploads: {upload_stats['bytes_in'] / 1024:.0f} KB recorded -> {upload_stats['bytes_out'] / 1024:.0f} KB sent")
+        st.caption(f"Email outbox: {outbox.get_outbox().counts() or 'empty'}")
+
+    for entry in outbox.get_outbox().failed(limit=5):
+        st.warning(f"Order email to {entry['to_email']} ({entry['subject']}) could not be delivered: {entry['last_error']}")
+
     if st.button("Clear Chat"):
         st.session_state.messages = []
         st.session_state.message_internal_flags = []
@@ -230,19 +347,35 @@ with st.sidebar:
     if uploaded_pdf:
         if st.button("extract info"):
             with st.spinner("Parsing contract and updating database..."):
-                contract_text = extract_contract_from_pdf(uploaded_pdf)
+                progress = st.progress(0.0, text="Reading PDF pages...")
+                contract_text = extract_contract_from_pdf(
+                    uploaded_pdf,
+                    on_progress=lambda done, total: progress.progress(done / total, text=f"Reading page {done}/{total}"),
+                )
+                progress.empty()
                 
                 if contract_text and len(contract_text) > 10:
                     api_key = st.secrets["ANTHROPIC_API_KEY"]
-                    df_new = parse_contract_to_df(contract_text, api_key)
+                    progress = st.progress(0.0, text="Extracting line items...")
+                    df_new = parse_contract_to_df(
+                        contract_text,
+                        api_key,
+                        on_progress=lambda done, total, rows: progress.progress(
+                            done / total, text=f"Parsed {done}/{total} sections ({rows} line items)"
+                        ),
+                    )
+                    progress.empty()
                     
                     if isinstance(df_new, pd.DataFrame):
                         if df_new.empty:
                             st.error("⚠️ Parsed data is empty. contracts.csv was NOT updated.")
                         else:
-                            # Save to contracts.csv
-                            df_new.to_csv("contracts.csv", index=False)
-                            st.success("✅ Database updated from Contract PDF!")
+                            # Merge into the existing contracts; other contracts and `used` are kept
+                            counts = upsert_contracts(df_new, use_sqlite=use_sqlite())
+                            st.success(
+                                f"✅ Database updated from Contract PDF! "
+                                f"{counts['inserted']} new, {counts['updated']} updated, {counts['unchanged']} unchanged line(s)."
+                            )
                         
                         # Optional: Clear chat to start fresh with new data
                         # st.session_state.messages = []
@@ -252,28 +385,28 @@ with st.sidebar:
                     st.error("⚠️ Failed to text from PDF.")
 
 # 4. Handle Image Upload
-if uploaded_file and st.session_state.get("last_uploaded_file") != uploaded_file.name:
-    st.session_state["last_uploaded_file"] = uploaded_file.name
+if uploaded_file:
+    # Dedupe by content, not file name: re-renders and re-uploads of the same photo are ignored
+    image_hash, base64_image, media_type = prepare_image(uploaded_file.getvalue(), uploaded_file.type)
+    if st.session_state.get("last_uploaded_file") != image_hash:
+        st.session_state["last_uploaded_file"] = image_hash
     
-    base64_image = get_base64_encoded_image(uploaded_file)
-    media_type = uploaded_file.type
-    
-    st.session_state.messages.append({
-        "role": "user",
-        "content": [
-            {
-                "type": "image", 
-                "source": {
-                    "type": "base64",
-                    "media_type": media_type,
-                    "data": base64_image,
+        st.session_state.messages.append({
+            "role": "user",
+            "content": [
+                {
+                    "type": "image", 
+                    "source": {
+                        "type": "base64",
+                        "media_type": media_type,
+                        "data": base64_image,
+                    },
                 },
-            },
-            {"type": "text", "text": "I have uploaded this image."} 
-        ],
-    })
-    st.session_state.message_internal_flags.append(False)
-    st.rerun()
+                {"type": "text", "text": "I have uploaded this image."} 
+            ],
+        })
+        st.session_state.message_internal_flags.append(False)
+        st.rerun()
 
 # 5. Display Chat History
 for message, is_internal in zip(st.session_state.messages, st.session_state.message_internal_flags):
@@ -305,6 +438,28 @@ for message, is_internal in zip(st.session_state.messages, st.session_state.mess
                     content = block.get("content") if isinstance(block, dict) else block.content
                     st.success(f"✅ Tool result: {content}")
 
+# Post finished background calls to the chat and let Claude summarize them
+for job in job_queue.undelivered(SESSION_ID):
+    st.session_state.messages.append({
+        "role": "user",
+        "content": f"[Background job finished] {jobs.describe(job)}\n\nSummarize the outcome of this local store call for me."
+    })
+    st.session_state.message_internal_flags.append(True)
+    job_queue.mark_delivered(job["id"])
+    st.session_state["trigger_response"] = True
+
+if hasattr(st, "fragment"):
+    @st.fragment(run_every=5)
+    def watch_background_jobs():
+        pending = job_queue.jobs_for(SESSION_ID, jobs.PENDING_STATUSES)
+        if pending:
+            st.caption(f"⏳ {len(pending)} local store call job(s) in progress")
+        if job_queue.undelivered(SESSION_ID):
+            st.rerun()
+
+    with st.sidebar:
+        watch_background_jobs()
+
 # 6. User Input & Model Response
 # Check if we need to trigger a response (from transcription)
 should_respond = st.session_state.pop("trigger_response", False)
@@ -315,7 +470,9 @@ if not st.session_state.precheck_done:
     st.session_state.precheck_in_progress = True
     st.session_state.messages.append({
         "role": "user",
-        "content": "Run startup inventory pre-check (dataset=inventory). List items under 5% storage and ask to place orders for them. Keep it concise."
+        "content": "Startup inventory pre-check. Reorder plan for items under 5% storage:\n\n"
+                   + plan_reorders()
+                   + "\n\nList these items and ask to place orders for them. Keep it concise."
     })
     st.session_state.message_internal_flags.append(True)
     st.session_state.precheck_done = True
@@ -341,13 +498,25 @@ if should_respond:
         
         while tool_use_count < max_tool_iterations:
             try:
+                request_messages = compact_messages(
+                    st.session_state.messages,
+                    max_messages=st.secrets.get("MAX_HISTORY_MESSAGES", MAX_HISTORY_MESSAGES),
+                    token_budget=st.secrets.get("HISTORY_TOKEN_BUDGET", HISTORY_TOKEN_BUDGET),
+                )
+                if dev_mode:
+                    st.caption(
+                        f"🧮 History: {len(request_messages)}/{len(st.session_state.messages)} messages, "
+                        f"~{estimate_tokens(request_messages)} tokens "
+                        f"(uncompacted ~{estimate_tokens(st.session_state.messages)})"
+                    )
+
                 with client.messages.stream(
                     model="claude-sonnet-4-5-20250929",
                     max_tokens=1024,
                     temperature=0,
-                    messages=st.session_state.messages,
-                    tools=tool_definitions,
-                    system=SYSTEM_PROMPT
+                    messages=with_cache_breakpoint(request_messages),
+                    tools=CACHED_TOOLS,
+                    system=CACHED_SYSTEM
                 ) as stream:
                     for text in stream.text_stream:
                         full_text += text
@@ -355,6 +524,8 @@ if should_respond:
                     final_message = stream.get_final_message()
 
                 message_placeholder.markdown(full_text)
+                if dev_mode:
+                    st.caption(f"📊 {usage_summary(final_message.usage)}")
 
                 st.session_state.messages.append({
                     "role": "assistant",
@@ -366,35 +537,21 @@ if should_respond:
                     tool_use_count += 1
                     tool_blocks = [b for b in final_message.content if b.type == "tool_use"]
                     
-                    for tool_block in tool_blocks:
+                    # Independent tools run concurrently; results keep block order
+                    results = execute_tool_blocks(tool_blocks, run_tool)
+                    
+                    for tool_block, result in zip(tool_blocks, results):
                         tool_id = tool_block.id
                         tool_name = tool_block.name
-                        tool_input = tool_block.input
                         
                         # Only show tool usage in developer mode
                         if dev_mode:
                             st.info(f"🔧 Using tool: **{tool_name}**")
-                        
-                        result = "Error: Unknown tool"
-                        if tool_name == "calculate":
-                            result = calculate(tool_input["expression"])
-                        elif tool_name == "read_csv":
-                            dataset = tool_input.get("dataset", "contracts") if tool_input else "contracts"
-                            result = read_csv(dataset)
-                        elif tool_name == "update_used":
-                            result = update_used(tool_input["product_id"], tool_input["used_quantity"])
-                        elif tool_name == "call_local_store":
-                            result = call_local_store(tool_input["item_name"], tool_input["quantity"])
-                            # Only show result in developer mode (no transcript display)
-                            if dev_mode:
+                            if tool_name == "call_local_store":
                                 # Show only the first line (summary) without the full transcript
                                 summary = result.split("\n\nTranscript:")[0] if "\n\nTranscript:" in result else result
                                 st.success(f"✅ Result: {summary}")
-                        elif tool_name == "send_order_email":
-                            result = order_product(tool_input["product_id"], tool_input["quantity"])
-                        else:
-                            # Only show result in developer mode
-                            if dev_mode:
+                            elif tool_name not in TOOL_NAMES:
                                 st.success(f"✅ Result: {result}")
                         
                         st.session_state.messages.append({
@@ -0,0 +1,144 @@
+"""
+Audio preprocessing for voice memos before they are uploaded for transcription.
+
+Browser recordings from st.audio_input arrive as uncompressed WAV, often in
+stereo at 44.1/48 kHz with a second or two of silence on either end. Speech
+recognition needs none of that, so WAV input is decoded, downmixed to mono,
+trimmed of leading/trailing silence, resampled to 16 kHz and re-encoded
+(FLAC when soundfile is installed, 16-bit WAV otherwise). Anything that is
+not WAV (mp3, m4a, ...) is already compressed and is passed through as-is.
+"""
+import io
+import wave
+
+import numpy as np
+
+try:
+    import soundfile
+except ImportError:  # optional: FLAC output
+    soundfile = None
+
+TARGET_RATE = 16000
+FRAME_SECS = 0.02
+SILENCE_DBFS = -45.0  # frames quieter than this (RMS) count as silence
+PAD_SECS = 0.25  # kept on both sides of the detected speech
+
+
+def decode_wav(data):
+    """
+    Decodes PCM WAV bytes.
+
+    Returns:
+        tuple: (float32 array of shape (frames, channels) in [-1, 1], sample rate),
+        or None if the data is not a PCM WAV file
+    """
+    if bytes(data[:4]) != b"RIFF" or bytes(data[8:12]) != b"WAVE":
+        return None
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+            raw = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+    elif width == 3:
+        # 24-bit: pad each little-endian sample to 4 bytes, then shift the sign back in
+        triples = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((len(triples), 4), dtype=np.uint8)
+        padded[:, 1:] = triples
+        samples = padded.view("<i4").ravel().astype(np.float32) / 2 ** 31
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2 ** 31
+    else:
+        return None
+    return samples.reshape(-1, channels), rate
+
+
+def to_mono(samples):
+    """Averages all channels into one."""
+    return samples.mean(axis=1) if samples.ndim == 2 else samples
+
+
+def trim_silence(samples, rate, threshold_dbfs=SILENCE_DBFS, pad_secs=PAD_SECS):
+    """Cuts leading and trailing frames whose RMS is below the threshold."""
+    frame = max(1, int(rate * FRAME_SECS))
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return samples
+    frames = samples[:n_frames * frame].reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    loud = np.flatnonzero(rms > 10 ** (threshold_dbfs / 20))
+    if len(loud) == 0:
+        return samples[:0]
+    pad = int(rate * pad_secs)
+    start = max(0, loud[0] * frame - pad)
+    end = min(len(samples), (loud[-1] + 1) * frame + pad)
+    return samples[start:end]
+
+
+def resample(samples, rate, target_rate=TARGET_RATE):
+    """Linear-interpolation resampling (adequate for speech recognition)."""
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    n_out = int(round(len(samples) * target_rate / rate))
+    positions = np.arange(n_out) * (rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def encode(samples, rate):
+    """
+    Encodes mono float samples as FLAC if soundfile is available, else 16-bit WAV.
+
+    Returns:
+        tuple: (bytes, file suffix)
+    """
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    if soundfile is not None:
+        soundfile.write(buffer, pcm, rate, format="FLAC", subtype="PCM_16")
+        return buffer.getvalue(), ".flac"
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue(), ".wav"
+
+
+def preprocess(data, suffix=".mp3"):
+    """
+    Shrinks a recording for upload.
+
+    Args:
+        data: Audio bytes (or any buffer)
+        suffix: File extension of the input, kept for pass-through audio
+
+    Returns:
+        tuple: (audio bytes, file suffix, stats dict with bytes_in/bytes_out and
+        secs_in/secs_out when the audio was decoded)
+    """
+    size_in = len(memoryview(data).cast("B"))
+    decoded = decode_wav(data)
+    if decoded is None:
+        return data, suffix, {"bytes_in": size_in, "bytes_out": size_in}
+
+    samples, rate = decoded
+    secs_in = len(samples) / rate
+    mono = trim_silence(to_mono(samples), rate)
+    if len(mono) == 0:
+        # All silence: send the original and let the API report it
+        return data, ".wav", {"bytes_in": size_in, "bytes_out": size_in, "secs_in": round(secs_in, 2)}
+
+    out, out_suffix = encode(resample(mono, rate), TARGET_RATE)
+    stats = {
+        "bytes_in": size_in,
+        "bytes_out": len(out),
+        "secs_in": round(secs_in, 2),
+        "secs_out": round(len(mono) / rate, 2),
+    }
+    print(f"[INFO] Audio preprocessed: {size_in} -> {len(out)} bytes, {stats['secs_in']}s -> {stats['secs_out']}s")
+    return out, out_suffix, stats
@@ -0,0 +1,279 @@
+"""
+Call monitoring for ElevenLabs conversational AI sessions.
+
+Replaces the fixed 1-second busy-polling loops with:
+- an optional local webhook receiver for ElevenLabs post-call webhooks, which
+  ends the wait the moment a finished call's transcript is pushed to us;
+- a short fixed poll interval while waiting for the call to start (a short
+  call could otherwise start and end between two backed-off polls);
+- adaptive polling while following a call (1s, backing off to 8s while
+  nothing changes, reset when new transcript messages arrive);
+- hard deadlines for the call to start and to finish, so a call that never
+  happens no longer blocks the Streamlit script forever.
+
+The conversations API only returns whole transcripts, so "incremental" here
+means new messages are detected by count and only those are processed.
+"""
+import hashlib
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DETECT_DEADLINE = 180  # seconds for the call to show up after the link was sent
+CALL_DEADLINE = 15 * 60  # seconds for a detected call to finish
+DETECT_POLL_INTERVAL = 1.0  # fixed while waiting for the call to start
+MIN_POLL_INTERVAL = 1.0
+MAX_POLL_INTERVAL = 8.0
+BACKOFF_FACTOR = 1.5
+LIST_PAGE_SIZE = 10
+MAX_WEBHOOK_BYTES = 2 * 1024 * 1024  # post-call payloads carry the whole transcript
+
+ACTIVE_STATUSES = {"initiated", "in-progress", "processing"}
+DONE_STATUSES = {"done", "success"}
+FAILED_STATUSES = {"failed"}
+
+
+class CallTimeout(Exception):
+    """Raised when a call does not start or finish before its deadline."""
+
+
+def format_transcript(messages):
+    """Renders transcript messages as 'Role: text' lines."""
+    lines = []
+    for msg in messages or []:
+        role = msg.get("role") if isinstance(msg, dict) else getattr(msg, "role", "")
+        text = msg.get("message") if isinstance(msg, dict) else getattr(msg, "message", "")
+        if text:
+            lines.append(f"{str(role).capitalize()}: {text}")
+    return "\n".join(lines)
+
+
+class WebhookReceiver:
+    """
+    Minimal HTTP server that accepts ElevenLabs post-call webhooks.
+
+    Listens on localhost only; point the agent's post-call webhook at it through
+    a tunnel. If a secret is configured, the ElevenLabs-Signature header is
+    verified before a payload is accepted.
+    """
+
+    def __init__(self, port, secret=None, host="127.0.0.1"):
+        self.port = port
+        self.secret = secret
+        self._results = {}
+        self._cond = threading.Condition()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= MAX_WEBHOOK_BYTES:
+                    self.send_response(413 if length > MAX_WEBHOOK_BYTES else 400)
+                    self.end_headers()
+                    return
+                body = self.rfile.read(length)
+                if not receiver._verify(body, self.headers.get("ElevenLabs-Signature", "")):
+                    self.send_response(401)
+                    self.end_headers()
+                    return
+                try:
+                    receiver._accept(json.loads(body))
+                    self.send_response(200)
+                except ValueError:
+                    self.send_response(400)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        print(f"[INFO] Call webhook receiver listening on {host}:{port}")
+        if not secret:
+            print("[WARN] ELEVENLABS_WEBHOOK_SECRET is not set; webhook payloads are not verified")
+
+    def _verify(self, body, signature_header):
+        if not self.secret:
+            return True
+        try:
+            parts = dict(part.split("=", 1) for part in signature_header.split(","))
+            timestamp, signature = parts["t"], parts["v0"]
+        except (ValueError, KeyError):
+            return False
+        expected = hmac.new(self.secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature)
+
+    def _accept(self, payload):
+        data = payload.get("data", payload)
+        conversation_id = data.get("conversation_id")
+        if not conversation_id:
+            return
+        with self._cond:
+            self._results[conversation_id] = data
+            self._cond.notify_all()
+
+    def wait(self, conversation_id, timeout):
+        """Blocks up to `timeout` seconds; returns the webhook payload if it arrived."""
+        with self._cond:
+            self._cond.wait_for(lambda: conversation_id in self._results, timeout=timeout)
+            return self._results.get(conversation_id)
+
+
+_receivers = {}
+_receivers_lock = threading.Lock()
+
+
+def get_webhook_receiver(port, secret=None):
+    """Returns the process-wide receiver for a port, starting it on first use."""
+    port = int(port)
+    with _receivers_lock:
+        if port not in _receivers:
+            _receivers[port] = WebhookReceiver(port, secret)
+        return _receivers[port]
+
+
+def dynamic_variables(details):
+    """Returns the dynamic variables a conversation was started with ({} if unknown)."""
+    data = details.get("conversation_initiation_client_data") if isinstance(details, dict) \
+        else getattr(details, "conversation_initiation_client_data", None)
+    if data is None:
+        return {}
+    variables = data.get("dynamic_variables") if isinstance(data, dict) else getattr(data, "dynamic_variables", None)
+    return dict(variables or {})
+
+
+# Conversations already picked up by a monitor in this process
+_claimed = set()
+_claimed_lock = threading.Lock()
+
+
+def _claim(conversation_id):
+    with _claimed_lock:
+        if conversation_id in _claimed:
+            return False
+        _claimed.add(conversation_id)
+        return True
+
+
+class CallMonitor:
+    """Detects and follows a single conversation for an agent."""
+
+    def __init__(self, client, agent_id, receiver=None):
+        self.client = client
+        self.agent_id = agent_id
+        self.receiver = receiver
+        self.api_calls = 0
+        self._variables = {}  # conversation_id -> dynamic variables (fixed for a conversation)
+
+    def _sleep(self, interval, conversation_id=None):
+        """Waits for the next poll; returns a webhook payload if one ends the wait early."""
+        if self.receiver and conversation_id:
+            return self.receiver.wait(conversation_id, interval)
+        time.sleep(interval)
+        return None
+
+    def _matches(self, conversation_id, match):
+        """True if the conversation was started with all `match` dynamic variables."""
+        if not match:
+            return True
+        if conversation_id not in self._variables:
+            self.api_calls += 1
+            details = self.client.conversational_ai.conversations.get(conversation_id)
+            self._variables[conversation_id] = dynamic_variables(details)
+        variables = self._variables[conversation_id]
+        return all(str(variables.get(key)) == str(value) for key, value in match.items())
+
+    def wait_for_call(self, started_after, deadline=DETECT_DEADLINE, match=None):
+        """
+        Polls for the agent's newest active conversation started after `started_after`.
+
+        Several calls can be waiting at once (one per vendor) on the same agent,
+        so a conversation is only taken if it was started with the `match`
+        dynamic variables (e.g. {"vendor_name": ...}), and each detected
+        conversation is claimed and never handed to a second monitor.
+
+        Args:
+            started_after: Unix time the call link was sent
+            deadline: Seconds for the call to show up
+            match: Dynamic variables the conversation must have been started with
+
+        Returns:
+            str: conversation_id
+
+        Raises:
+            CallTimeout: if no call shows up within `deadline` seconds
+        """
+        give_up_at = time.time() + deadline
+        while time.time() < give_up_at:
+            try:
+                self.api_calls += 1
+                resp = self.client.conversational_ai.conversations.list(agent_id=self.agent_id, page_size=LIST_PAGE_SIZE)
+                history = resp.conversations if hasattr(resp, "conversations") else resp
+                for conversation in history or []:
+                    start_time = getattr(conversation, "start_time_unix_secs", None)
+                    is_new = start_time is None or start_time >= started_after - 5
+                    if conversation.status not in ACTIVE_STATUSES or not is_new:
+                        continue
+                    if self._matches(conversation.conversation_id, match) and _claim(conversation.conversation_id):
+                        return conversation.conversation_id
+            except Exception as e:
+                print(f"[WARN] Listing conversations failed: {e}")
+            self._sleep(min(DETECT_POLL_INTERVAL, max(0.0, give_up_at - time.time())))
+        raise CallTimeout(f"No call started within {deadline}s")
+
+    def follow(self, conversation_id, on_message=None, deadline=CALL_DEADLINE):
+        """
+        Follows a conversation until it ends.
+
+        Args:
+            conversation_id: Conversation to follow
+            on_message: Optional callback for each new transcript message
+            deadline: Seconds before giving up
+
+        Returns:
+            tuple: (final status, list of transcript messages)
+
+        Raises:
+            CallTimeout: if the call is still running after `deadline` seconds
+        """
+        give_up_at = time.time() + deadline
+        interval = MIN_POLL_INTERVAL
+        transcript = []
+        while time.time() < give_up_at:
+            pushed = self._sleep(min(interval, max(0.0, give_up_at - time.time())), conversation_id)
+            if pushed is not None:
+                transcript = self._emit_new(pushed.get("transcript") or [], transcript, on_message)
+                return pushed.get("status", "done"), transcript
+
+            try:
+                self.api_calls += 1
+                details = self.client.conversational_ai.conversations.get(conversation_id)
+            except Exception as e:
+                # The API occasionally times out; back off and try again
+                print(f"[WARN] Fetching conversation failed: {e}")
+                interval = min(interval * BACKOFF_FACTOR, MAX_POLL_INTERVAL)
+                continue
+
+            current = details.transcript or []
+            if len(current) > len(transcript):
+                transcript = self._emit_new(current, transcript, on_message)
+                interval = MIN_POLL_INTERVAL
+            else:
+                interval = min(interval * BACKOFF_FACTOR, MAX_POLL_INTERVAL)
+
+            if details.status in DONE_STATUSES or details.status in FAILED_STATUSES:
+                return details.status, transcript
+        raise CallTimeout(f"Call {conversation_id} did not finish within {deadline}s")
+
+    @staticmethod
+    def _emit_new(current, seen, on_message):
+        if on_message:
+            for msg in current[len(seen):]:
+                on_message(msg)
+        return list(current)
@@ -0,0 +1,151 @@
+"""
+Shared in-process catalog for the CSV data files.
+
+Each table is parsed once and kept in memory together with hash indexes on its
+key columns. A table is only re-read when the file's mtime or size changes, so
+repeated tool calls within an agent turn cost a dict lookup instead of a full
+pd.read_csv.
+"""
+import os
+import threading
+
+import pandas as pd
+
+CATALOG_FILES = {
+    "contracts": "contracts.csv",
+    "inventory": "inventory.csv",
+    "suppliers": "suppliers.csv",
+    "sample": "sample.csv",
+    "local_stores": "local_stores.csv",
+}
+
+# Columns that get a hash index when the table is loaded
+INDEX_COLUMNS = {
+    "contracts": ["product_id", "supplier_id"],
+    "inventory": ["product_id"],
+    "suppliers": ["supplier_id"],
+    "sample": ["artikel_id"],
+    "local_stores": ["store_id"],
+}
+
+
+class CatalogTable:
+    """A cached CSV file with hash indexes on selected columns."""
+
+    def __init__(self, file_path, index_columns=()):
+        self.file_path = file_path
+        self.index_columns = list(index_columns)
+        self._lock = threading.Lock()
+        self._signature = None
+        self._state = None  # (DataFrame, indexes), swapped as one object
+
+    def _file_signature(self):
+        stat = os.stat(self.file_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self):
+        df = pd.read_csv(self.file_path)
+        df.columns = [c.strip() for c in df.columns]
+
+        indexes = {}
+        for column in self.index_columns:
+            if column not in df.columns:
+                continue
+            # Map key -> row positions; first position matches `.iloc[0]` lookups
+            index = {}
+            for pos, key in enumerate(df[column].tolist()):
+                index.setdefault(key, []).append(pos)
+            indexes[column] = index
+        return df, indexes
+
+    def refresh(self):
+        """Reloads the file if it changed on disk since the last load."""
+        signature = self._file_signature()
+        if signature == self._signature and self._state is not None:
+            return
+        with self._lock:
+            signature = self._file_signature()
+            if signature == self._signature and self._state is not None:
+                return
+            self._state = self._load()
+            self._signature = signature
+
+    def invalidate(self):
+        """Forces a reload on the next access."""
+        with self._lock:
+            self._signature = None
+
+    def _snapshot(self):
+        self.refresh()
+        return self._state
+
+    @property
+    def signature(self):
+        """(mtime_ns, size) of the currently loaded file; changes on every reload."""
+        self.refresh()
+        return self._signature
+
+    @property
+    def df(self):
+        """The full table. Treat as read-only; call .copy() before mutating."""
+        return self._snapshot()[0]
+
+    def _positions(self, indexes, column, key):
+        index = indexes.get(column)
+        if index is None:
+            raise KeyError(f"Column '{column}' is not indexed in {self.file_path}")
+        return index.get(key, [])
+
+    def positions(self, column, key):
+        """Returns the row positions where `column == key` (empty list if none)."""
+        _, indexes = self._snapshot()
+        return self._positions(indexes, column, key)
+
+    def lookup(self, column, key):
+        """Returns the first row where `column == key` as a dict, or None."""
+        df, indexes = self._snapshot()
+        positions = self._positions(indexes, column, key)
+        if not positions:
+            return None
+        return df.iloc[positions[0]].to_dict()
+
+    def lookup_all(self, column, key):
+        """Returns all rows where `column == key` as a DataFrame."""
+        df, indexes = self._snapshot()
+        return df.iloc[self._positions(indexes, column, key)]
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def get_table(name):
+    """Returns the shared CatalogTable for a dataset name (e.g. 'contracts')."""
+    if name not in CATALOG_FILES:
+        raise KeyError(f"Unknown dataset '{name}'")
+    table = _tables.get(name)
+    if table is None:
+        with _tables_lock:
+            table = _tables.get(name)
+            if table is None:
+                table = CatalogTable(CATALOG_FILES[name], INDEX_COLUMNS.get(name, ()))
+                _tables[name] = table
+    return table
+
+
+def load_df(name):
+    """Returns the cached DataFrame for a dataset name."""
+    return get_table(name).df
+
+
+def lookup(name, column, key):
+    """Returns the first row of dataset `name` where `column == key`, or None."""
+    return get_table(name).lookup(column, key)
+
+
+def invalidate(name=None):
+    """Drops the cached copy of one dataset, or of all datasets."""
+    names = [name] if name else list(_tables)
+    for n in names:
+        if n in _tables:
+            _tables[n].invalidate()
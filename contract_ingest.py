@@ -0,0 +1,152 @@
+"""
+Incremental ingestion of parsed contract PDFs.
+
+Uploading a contract used to overwrite contracts.csv, which dropped every other
+contract and reset all `used` counters. Parsed lines are now upserted, keyed on
+(contract_id, product_id):
+
+- new keys are inserted (appended to the end of contracts.csv);
+- existing keys get their terms (price, quantity, supplier, ...) updated while
+  `used` is kept;
+- unchanged lines are not written at all.
+
+When a contract only adds lines, the CSV is appended to and nothing else is
+rewritten; only updates to existing lines need an (atomic) rewrite of the file.
+On the SQLite backend the same diff is applied with INSERT ... ON CONFLICT.
+"""
+import os
+
+import pandas as pd
+
+import catalog
+import database
+import ledger
+
+KEY_COLUMNS = ["contract_id", "product_id"]
+CONTRACT_COLUMNS = [csv for csv, _, _ in database.TABLES["contracts"][1]]
+# Columns the PDF does not own: consumption is tracked by the ledger / orders
+PRESERVED_COLUMNS = ["used"]
+NUMERIC_COLUMNS = ["quantity", "unit_price_eur", "line_total_eur", "delivery_days"]
+
+
+def normalize(df):
+    """Brings parsed rows into the contracts.csv layout (one row per key, last wins)."""
+    df = df.copy()
+    df.columns = [str(c).strip() for c in df.columns]
+    missing_keys = [c for c in KEY_COLUMNS if c not in df.columns]
+    if missing_keys:
+        raise ValueError(f"Parsed contract is missing key column(s): {', '.join(missing_keys)}")
+    for column in CONTRACT_COLUMNS:
+        if column not in df.columns:
+            df[column] = 0 if column == "used" else None
+    for column in KEY_COLUMNS:
+        df[column] = df[column].astype(str).str.strip()
+    return df[CONTRACT_COLUMNS].drop_duplicates(KEY_COLUMNS, keep="last").reset_index(drop=True)
+
+
+def _comparable(df, columns):
+    """Canonical string form of the given columns, so 0.5 == '0.50' and True == 'True'."""
+    out = pd.DataFrame(index=df.index)
+    for column in columns:
+        if column in NUMERIC_COLUMNS:
+            out[column] = pd.to_numeric(df[column], errors="coerce").round(6).astype(str)
+        else:
+            out[column] = df[column].astype(str).str.strip()
+    return out
+
+
+def diff(current, incoming):
+    """
+    Splits incoming rows into inserts and updates against the current contracts.
+
+    Returns:
+        tuple: (rows to insert, rows to update with `used` taken from current)
+    """
+    compared = [c for c in CONTRACT_COLUMNS if c not in KEY_COLUMNS + PRESERVED_COLUMNS]
+    # Only the contracts being ingested can match
+    current = current[current["contract_id"].astype(str).str.strip().isin(set(incoming["contract_id"]))].copy()
+    for column in KEY_COLUMNS:
+        current[column] = current[column].astype(str).str.strip()
+
+    merged = incoming.merge(
+        current[KEY_COLUMNS + PRESERVED_COLUMNS + compared],
+        on=KEY_COLUMNS, how="left", suffixes=("", "_current"), indicator=True,
+    )
+    is_new = (merged["_merge"] == "left_only").to_numpy()
+    old = merged[[f"{c}_current" for c in compared]].set_axis(compared, axis=1)
+    changed = (_comparable(merged, compared) != _comparable(old, compared)).any(axis=1).to_numpy()
+
+    inserts = incoming[is_new]
+    updates = incoming[~is_new & changed].copy()
+    for column in PRESERVED_COLUMNS:
+        updates[column] = merged.loc[~is_new & changed, f"{column}_current"].to_numpy()
+    return inserts, updates
+
+
+def _upsert_csv(incoming):
+    table = catalog.get_table("contracts")
+    path = table.file_path
+    with ledger.file_lock():
+        if os.path.exists(path):
+            current = table.df
+        else:
+            current = pd.DataFrame(columns=CONTRACT_COLUMNS)
+        inserts, updates = diff(current, incoming)
+
+        if len(updates):
+            current = current.copy()
+            keys = pd.MultiIndex.from_frame(current[KEY_COLUMNS].astype(str).apply(lambda s: s.str.strip()))
+            positions = keys.get_indexer(pd.MultiIndex.from_frame(updates[KEY_COLUMNS]))
+            for column in CONTRACT_COLUMNS:
+                if column not in current.columns:
+                    current[column] = None
+                current[column] = current[column].astype(object)
+                current.iloc[positions, current.columns.get_loc(column)] = updates[column].to_numpy()
+            combined = pd.concat([current, inserts], ignore_index=True) if len(inserts) else current
+            tmp_path = f"{path}.tmp"
+            combined.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        elif len(inserts):
+            # Append only the new lines; the rest of the file is untouched
+            new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+            if not new_file:
+                with open(path, "rb+") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+            inserts.to_csv(path, mode="a", header=new_file, index=False)
+
+        if len(inserts) or len(updates):
+            catalog.invalidate("contracts")
+    return inserts, updates
+
+
+def upsert_contracts(df, use_sqlite=False):
+    """
+    Merges parsed contract lines into the contract store.
+
+    Args:
+        df: Parsed contract DataFrame (e.g., output of parse_contract_to_df)
+        use_sqlite: Write to the SQLite backend instead of contracts.csv
+
+    Returns:
+        dict: {"inserted": n, "updated": n, "unchanged": n}
+    """
+    incoming = normalize(df)
+    if use_sqlite:
+        conn = database.connect()
+        contract_ids = sorted(set(incoming["contract_id"]))
+        current = database.read_table(
+            "contracts", where=f"contract_id IN ({', '.join('?' for _ in contract_ids)})", params=contract_ids, conn=conn
+        )
+        inserts, updates = diff(current, incoming)
+        database.upsert_contracts(pd.concat([inserts, updates], ignore_index=True), conn=conn)
+    else:
+        inserts, updates = _upsert_csv(incoming)
+    counts = {
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "unchanged": len(incoming) - len(inserts) - len(updates),
+    }
+    print(f"[INFO] Contract upsert: {counts}")
+    return counts
@@ -0,0 +1,232 @@
+"""
+Chunked, concurrent extraction of contract line items with Claude.
+
+Long price lists no longer go into a single prompt with a small output budget.
+The contract text is split into chunks along line boundaries, and each chunk is
+sent with the document header (which usually holds the contract ID, supplier,
+payment and delivery terms). Requests run concurrently up to a cap. Claude must
+answer through a tool call, so the output is JSON matching a schema instead of
+free text.
+
+Tool input is streamed, and line items are decoded as soon as each JSON object
+closes. If a response hits max_tokens, the rows received so far are kept and
+the chunk is split and parsed again. Rows from all chunks are merged and
+de-duplicated by product_id.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import anthropic
+import pandas as pd
+
+MODEL = "claude-sonnet-4-5-20250929"
+MAX_TOKENS = 8192
+CHUNK_CHARS = 12000
+HEADER_CHARS = 2000
+MAX_CONCURRENT_REQUESTS = 4
+MAX_SPLITS = 3  # times a truncated chunk may be halved
+
+COLUMNS = [
+    "contract_id", "product_id", "product_name", "unit", "quantity", "unit_price_eur",
+    "line_total_eur", "is_c_item", "used", "supplier_id", "payment_terms", "delivery_days",
+]
+
+RECORD_TOOL = {
+    "name": "record_contract_lines",
+    "description": "Records the contract line items found in the text.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "lines": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "contract_id": {"type": "string", "description": "Extract from date or ID, e.g., ACME_2025"},
+                        "product_id": {"type": "string"},
+                        "product_name": {"type": "string"},
+                        "unit": {"type": "string"},
+                        "quantity": {"type": "number", "description": "Total contract quantity"},
+                        "unit_price_eur": {"type": "number"},
+                        "line_total_eur": {"type": "number"},
+                        "supplier_id": {"type": "string", "description": "Extract, or a generic ID like SUP_NEW if unknown"},
+                        "payment_terms": {"type": "string"},
+                        "delivery_days": {"type": "integer", "description": "Number of days"},
+                    },
+                    "required": ["contract_id", "product_id", "product_name", "quantity", "unit_price_eur"],
+                },
+            }
+        },
+        "required": ["lines"],
+    },
+}
+
+PROMPT = """Extract every contract line item from the contract excerpt below and record them with the record_contract_lines tool.
+The excerpt is part {part} of {parts} of the document. The document header is included for context (contract ID, supplier, payment and delivery terms); only record line items that appear in the excerpt itself. If the excerpt contains no line items, record an empty list.
+
+<header>
+{header}
+</header>
+
+<excerpt>
+{excerpt}
+</excerpt>"""
+
+
+class LineItemStream:
+    """
+    Incrementally decodes the objects of the "lines" array in streamed tool JSON.
+
+    feed() takes partial JSON text and returns the line items whose closing
+    brace arrived in it.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._in_array = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._start = None
+
+    def feed(self, partial_json):
+        self._buffer += partial_json
+        items = []
+        while self._pos < len(self._buffer):
+            char = self._buffer[self._pos]
+            if not self._in_array:
+                if char == "[":
+                    self._in_array = True
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                if self._depth == 0:
+                    self._start = self._pos
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0 and self._start is not None:
+                    items.append(json.loads(self._buffer[self._start:self._pos + 1]))
+                    self._start = None
+            self._pos += 1
+        return items
+
+
+def split_text(text, chunk_chars=CHUNK_CHARS):
+    """Splits text into chunks of about chunk_chars, only at line breaks."""
+    chunks, current, size = [], [], 0
+    for line in text.splitlines(keepends=True):
+        if current and size + len(line) > chunk_chars:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def _parse_chunk(client, header, excerpt, part, parts, on_row=None):
+    """
+    Streams one extraction request.
+
+    Returns:
+        tuple: (rows, truncated)
+    """
+    decoder = LineItemStream()
+    rows = []
+    with client.messages.stream(
+        model=MODEL,
+        max_tokens=MAX_TOKENS,
+        tools=[RECORD_TOOL],
+        tool_choice={"type": "tool", "name": RECORD_TOOL["name"]},
+        messages=[{"role": "user", "content": PROMPT.format(part=part, parts=parts, header=header, excerpt=excerpt)}],
+    ) as stream:
+        for event in stream:
+            if event.type == "content_block_delta" and getattr(event.delta, "type", None) == "input_json_delta":
+                for row in decoder.feed(event.delta.partial_json):
+                    rows.append(row)
+                    if on_row:
+                        on_row(row)
+        message = stream.get_final_message()
+
+    truncated = message.stop_reason == "max_tokens"
+    if not truncated:
+        for block in message.content:
+            if block.type == "tool_use":
+                # The final tool input is authoritative when the response is complete
+                rows = list(block.input.get("lines") or [])
+    return rows, truncated
+
+
+def _parse_with_splits(client, header, excerpt, part, parts, on_row=None, splits_left=MAX_SPLITS):
+    rows, truncated = _parse_chunk(client, header, excerpt, part, parts, on_row)
+    if not truncated:
+        return rows
+    halves = split_text(excerpt, max(1, len(excerpt) // 2))
+    if splits_left == 0 or len(halves) < 2:
+        print(f"[WARN] Contract chunk {part}/{parts} was truncated; keeping {len(rows)} rows")
+        return rows
+    print(f"[INFO] Contract chunk {part}/{parts} was truncated after {len(rows)} rows; splitting it")
+    for half in halves:
+        rows += _parse_with_splits(client, header, half, part, parts, on_row, splits_left - 1)
+    return rows
+
+
+def merge_rows(chunk_rows):
+    """Combines the rows of all chunks (in document order), one row per product_id."""
+    df = pd.DataFrame([row for rows in chunk_rows for row in rows])
+    for column in COLUMNS:
+        if column not in df.columns:
+            df[column] = None
+    df = df[COLUMNS]
+    df["product_id"] = df["product_id"].astype(str).str.strip()
+    df = df[df["product_id"].ne("") & df["product_id"].ne("None")]
+    df["is_c_item"] = True
+    df["used"] = 0
+    return df.drop_duplicates("product_id", keep="first").reset_index(drop=True)
+
+
+def parse_contract(text, api_key, max_concurrency=MAX_CONCURRENT_REQUESTS, on_progress=None):
+    """
+    Extracts all line items of a contract into the contracts.csv layout.
+
+    Args:
+        text: Contract text
+        api_key: Anthropic API key
+        max_concurrency: Maximum number of requests in flight
+        on_progress: Optional callback(chunks_done, total_chunks, rows_so_far)
+
+    Returns:
+        pd.DataFrame: One row per product_id
+    """
+    client = anthropic.Anthropic(api_key=api_key)
+    header = text[:HEADER_CHARS]
+    chunks = split_text(text)
+    results = [None] * len(chunks)
+    rows_seen = [0]
+    done = 0
+
+    def count_row(_row):
+        rows_seen[0] += 1
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(chunks)))) as pool:
+        futures = {
+            pool.submit(_parse_with_splits, client, header, chunk, i + 1, len(chunks), count_row): i
+            for i, chunk in enumerate(chunks)
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            done += 1
+            if on_progress:
+                on_progress(done, len(chunks), rows_seen[0])
+
+    return merge_rows(results)
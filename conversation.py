@@ -0,0 +1,182 @@
+"""
+Request building for the Claude chat loop.
+
+Adds prompt-cache breakpoints so the static prefix (tool definitions and the
+system prompt) and the conversation history up to the latest message are read
+from Anthropic's prompt cache on follow-up requests instead of being processed
+again on every tool iteration.
+
+Also compacts the history before each request: old tool results are truncated,
+old images are replaced by a placeholder, and the oldest turns are dropped once
+the message count or estimated token total exceeds its bound. Compaction works
+on a copy; st.session_state.messages keeps the full history for display.
+
+Both steps move in fixed blocks of COMPACT_BLOCK_MESSAGES messages rather than
+one message per turn, so the compacted prefix stays byte-identical for several
+requests in a row and the cache breakpoint keeps hitting in between.
+"""
+import json
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+MAX_HISTORY_MESSAGES = 40
+HISTORY_TOKEN_BUDGET = 40000
+# The most recent messages are always sent unchanged
+KEEP_RECENT_MESSAGES = 6
+# Compaction and trimming boundaries move in steps of this many messages
+COMPACT_BLOCK_MESSAGES = 10
+TOOL_RESULT_KEEP_CHARS = 400
+
+# Rough per-image cost for a ~1.1 megapixel upload
+IMAGE_TOKENS = 1600
+CHARS_PER_TOKEN = 4
+
+IMAGE_PLACEHOLDER = "[Image uploaded earlier; omitted to save context. See the assistant's description of it above.]"
+
+
+def cached_system(system_prompt):
+    """Returns the system prompt as a cacheable content block list."""
+    return [{"type": "text", "text": system_prompt, "cache_control": CACHE_CONTROL}]
+
+
+def cached_tools(tools):
+    """Returns a copy of the tool list with a cache breakpoint after the last tool."""
+    if not tools:
+        return tools
+    return tools[:-1] + [{**tools[-1], "cache_control": CACHE_CONTROL}]
+
+
+def _with_breakpoint(content):
+    """Returns a copy of message content with cache_control on its last block, or None."""
+    if isinstance(content, str):
+        return [{"type": "text", "text": content, "cache_control": CACHE_CONTROL}]
+    if isinstance(content, list) and content and isinstance(content[-1], dict):
+        return content[:-1] + [{**content[-1], "cache_control": CACHE_CONTROL}]
+    # SDK content blocks (assistant turns) are sent back as-is
+    return None
+
+
+def with_cache_breakpoint(messages):
+    """
+    Returns a shallow copy of the messages with a cache breakpoint on the last
+    message that can carry one. Session state is left untouched.
+    """
+    messages = list(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        content = _with_breakpoint(messages[i]["content"])
+        if content is not None:
+            messages[i] = {**messages[i], "content": content}
+            break
+    return messages
+
+
+def usage_summary(usage):
+    """Formats the token usage of a response, including prompt-cache hits and writes."""
+    cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    uncached = getattr(usage, "input_tokens", 0) or 0
+    total_input = uncached + cache_read + cache_write
+    hit_rate = cache_read / total_input if total_input else 0
+    return (
+        f"Input tokens: {total_input} (cache read: {cache_read}, cache write: {cache_write}, "
+        f"uncached: {uncached}, hit rate: {hit_rate:.0%}) · Output tokens: {getattr(usage, 'output_tokens', 0)}"
+    )
+
+
+def _field(block, key, default=None):
+    if isinstance(block, dict):
+        return block.get(key, default)
+    return getattr(block, key, default)
+
+
+def _block_tokens(block):
+    block_type = _field(block, "type")
+    if block_type == "image":
+        return IMAGE_TOKENS
+    if block_type == "text":
+        return len(_field(block, "text", "")) // CHARS_PER_TOKEN
+    if block_type == "tool_use":
+        return len(json.dumps(_field(block, "input", {}), default=str)) // CHARS_PER_TOKEN
+    if block_type == "tool_result":
+        return len(str(_field(block, "content", ""))) // CHARS_PER_TOKEN
+    return 0
+
+
+def estimate_tokens(messages):
+    """Returns a rough token estimate for a message list (4 characters per token)."""
+    total = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            total += len(content) // CHARS_PER_TOKEN
+        else:
+            total += sum(_block_tokens(block) for block in content)
+    return total
+
+
+def _compact_block(block):
+    block_type = _field(block, "type")
+    if not isinstance(block, dict):
+        return block
+    if block_type == "image":
+        return {"type": "text", "text": IMAGE_PLACEHOLDER}
+    if block_type == "tool_result":
+        content = str(block.get("content", ""))
+        if len(content) > TOOL_RESULT_KEEP_CHARS:
+            dropped = len(content) - TOOL_RESULT_KEEP_CHARS
+            content = f"{content[:TOOL_RESULT_KEEP_CHARS]}\n[... {dropped} characters of this old tool result omitted]"
+            return {**block, "content": content}
+    return block
+
+
+def _is_turn_start(message):
+    """A plain user message (not a tool_result) where the history can be cut."""
+    if message["role"] != "user":
+        return False
+    content = message["content"]
+    if isinstance(content, str):
+        return True
+    return not any(_field(block, "type") == "tool_result" for block in content)
+
+
+def compact_messages(messages, max_messages=MAX_HISTORY_MESSAGES, token_budget=HISTORY_TOKEN_BUDGET,
+                     keep_recent=KEEP_RECENT_MESSAGES, block=COMPACT_BLOCK_MESSAGES):
+    """
+    Returns a compacted copy of the conversation for the next request.
+
+    Messages are compacted, and old turns dropped, in whole blocks of `block`
+    messages, so the result only changes at block boundaries and not on every
+    turn (which would invalidate the prompt cache).
+
+    Args:
+        messages: Full message history
+        max_messages: Upper bound on the number of messages sent
+        token_budget: Upper bound on the estimated input tokens of the history
+        keep_recent: Minimum number of trailing messages that are never modified
+        block: Step size, in messages, of the compaction and trimming boundaries
+
+    Returns:
+        list: Compacted messages, starting with a plain user turn
+    """
+    block = max(1, block)
+    cutoff = (max(0, len(messages) - keep_recent) // block) * block
+    compacted = []
+    for i, message in enumerate(messages):
+        content = message["content"]
+        if i < cutoff and isinstance(content, list):
+            message = {**message, "content": [_compact_block(block) for block in content]}
+        compacted.append(message)
+
+    # Drop whole turns from the front so tool_use/tool_result pairs stay intact;
+    # the history starts at the first turn after a multiple of `block`
+    start, step = 0, 0
+    while len(compacted) - start > max_messages or estimate_tokens(compacted[start:]) > token_budget:
+        step += 1
+        cut = next(
+            (i for i in range(step * block, len(compacted) - keep_recent) if _is_turn_start(compacted[i])),
+            None,
+        )
+        if cut is None:
+            break
+        start = cut
+    return compacted[start:]
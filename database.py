@@ -0,0 +1,380 @@
+"""
+Optional SQLite storage engine for contracts, inventory, suppliers and the
+sample catalog.
+
+Enable it with STORAGE_BACKEND = "sqlite" in .streamlit/secrets.toml. Tables
+mirror the CSV columns and are indexed on product_id/supplier_id, so tool calls
+run parameterized queries instead of loading whole files. The CSV files remain
+the interchange format:
+
+    python database.py import   # load the CSVs into nailed_it.db
+    python database.py export   # write the tables back out as CSV
+"""
+import os
+import sqlite3
+import sys
+import threading
+
+import pandas as pd
+
+DB_PATH = "nailed_it.db"
+
+# Table name -> (source CSV, [(csv column, sql column, sql type)])
+TABLES = {
+    "contracts": ("contracts.csv", [
+        ("contract_id", "contract_id", "TEXT"),
+        ("product_id", "product_id", "TEXT"),
+        ("product_name", "product_name", "TEXT"),
+        ("unit", "unit", "TEXT"),
+        ("quantity", "quantity", "INTEGER"),
+        ("unit_price_eur", "unit_price_eur", "REAL"),
+        ("line_total_eur", "line_total_eur", "REAL"),
+        ("is_c_item", "is_c_item", "INTEGER"),
+        ("used", "used", "INTEGER"),
+        ("supplier_id", "supplier_id", "TEXT"),
+        ("payment_terms", "payment_terms", "TEXT"),
+        ("delivery_days", "delivery_days", "INTEGER"),
+    ]),
+    "inventory": ("inventory.csv", [
+        ("contract_id", "contract_id", "TEXT"),
+        ("product_id", "product_id", "TEXT"),
+        ("product_name", "product_name", "TEXT"),
+        ("unit", "unit", "TEXT"),
+        ("quantity", "quantity", "INTEGER"),
+        (" storage (% used)", "storage", "REAL"),
+    ]),
+    "suppliers": ("suppliers.csv", [
+        ("supplier_id", "supplier_id", "TEXT PRIMARY KEY"),
+        ("supplier_name", "supplier_name", "TEXT"),
+        ("contact_email", "contact_email", "TEXT"),
+        ("phone", "phone", "TEXT"),
+        ("address", "address", "TEXT"),
+        ("payment_terms", "payment_terms", "TEXT"),
+        ("delivery_days", "delivery_days", "INTEGER"),
+        ("specialization", "specialization", "TEXT"),
+    ]),
+    "sample": ("sample.csv", [
+        ("artikel_id", "artikel_id", "TEXT PRIMARY KEY"),
+        ("artikelname", "artikelname", "TEXT"),
+        ("kategorie", "kategorie", "TEXT"),
+        ("einheit", "einheit", "TEXT"),
+        ("preis_eur", "preis_eur", "REAL"),
+        ("lieferant", "lieferant", "TEXT"),
+        ("verbrauchsart", "verbrauchsart", "TEXT"),
+        ("gefahrgut", "gefahrgut", "INTEGER"),
+        ("lagerort", "lagerort", "TEXT"),
+        ("typische_baustelle", "typische_baustelle", "TEXT"),
+    ]),
+}
+
+INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_contracts_line ON contracts(contract_id, product_id)",
+    "CREATE INDEX IF NOT EXISTS idx_contracts_product ON contracts(product_id)",
+    "CREATE INDEX IF NOT EXISTS idx_contracts_supplier ON contracts(supplier_id)",
+    "CREATE INDEX IF NOT EXISTS idx_inventory_product ON inventory(product_id)",
+]
+
+# Columns the product index is built from; changing them bumps data_versions,
+# while frequent writes such as `used` do not
+VERSIONED_COLUMNS = {
+    "contracts": ["product_id", "product_name", "unit", "unit_price_eur", "supplier_id"],
+    "sample": ["artikel_id", "artikelname", "einheit", "preis_eur", "lieferant"],
+}
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = set()
+
+
+def _columns(table):
+    return TABLES[table][1]
+
+
+def connect(db_path=DB_PATH):
+    """Returns this thread's connection, creating the schema on first use."""
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conns[db_path] = conn
+    with _init_lock:
+        if db_path not in _initialized:
+            create_schema(conn)
+            # First run against an empty database: seed it from the CSVs
+            if conn.execute("SELECT COUNT(*) FROM contracts").fetchone()[0] == 0:
+                import_all(conn)
+            _initialized.add(db_path)
+    return conn
+
+
+def create_schema(conn):
+    """Creates all tables and indexes if they do not exist."""
+    for table in TABLES:
+        cols = ", ".join(f'"{sql}" {sql_type}' for _, sql, sql_type in _columns(table))
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({cols})")
+    for statement in INDEXES:
+        conn.execute(statement)
+    conn.execute("CREATE TABLE IF NOT EXISTS data_versions (table_name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+    for table, columns in VERSIONED_COLUMNS.items():
+        bump = (
+            f"INSERT INTO data_versions VALUES ('{table}', 1) "
+            "ON CONFLICT(table_name) DO UPDATE SET version = version + 1;"
+        )
+        events = {"insert": "INSERT", "delete": "DELETE", "update": f"UPDATE OF {', '.join(columns)}"}
+        for name, event in events.items():
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_{name}_version AFTER {event} ON {table} BEGIN {bump} END")
+    conn.commit()
+
+
+def import_df(conn, table, df, replace=True):
+    """
+    Writes a DataFrame with CSV column names into a table.
+
+    Args:
+        conn: SQLite connection
+        table: Table name (e.g., 'contracts')
+        df: DataFrame with the CSV columns (e.g., output of parse_contract_to_df)
+        replace: Delete existing rows first (mirrors overwriting the CSV)
+
+    Returns:
+        int: Number of rows written
+    """
+    df = df.copy()
+    df.columns = [str(c).strip() for c in df.columns]
+    mapping = [(csv, sql) for csv, sql, _ in _columns(table) if csv.strip() in df.columns]
+    sql_cols = ", ".join(f'"{sql}"' for _, sql in mapping)
+    placeholders = ", ".join("?" for _ in mapping)
+    rows = df[[csv.strip() for csv, _ in mapping]].astype(object)
+    rows = rows.where(rows.notna(), None)
+
+    with conn:
+        if replace:
+            conn.execute(f"DELETE FROM {table}")
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {table} ({sql_cols}) VALUES ({placeholders})",
+            rows.itertuples(index=False, name=None),
+        )
+    return len(rows)
+
+
+def upsert_contracts(df, conn=None):
+    """
+    Inserts new contract lines and updates existing ones, keyed on
+    (contract_id, product_id). The `used` counter of existing lines is kept.
+
+    Returns:
+        int: Number of rows written
+    """
+    conn = conn or connect()
+    if df.empty:
+        return 0
+    mapping = [(csv, sql) for csv, sql, _ in _columns("contracts") if csv in df.columns]
+    sql_cols = ", ".join(f'"{sql}"' for _, sql in mapping)
+    placeholders = ", ".join("?" for _ in mapping)
+    updates = ", ".join(
+        f'"{sql}" = excluded."{sql}"' for _, sql in mapping if sql not in ("contract_id", "product_id", "used")
+    )
+    rows = df[[csv for csv, _ in mapping]].astype(object)
+    rows = rows.where(rows.notna(), None)
+    with conn:
+        conn.executemany(
+            f"INSERT INTO contracts ({sql_cols}) VALUES ({placeholders}) "
+            f"ON CONFLICT(contract_id, product_id) DO UPDATE SET {updates}",
+            rows.itertuples(index=False, name=None),
+        )
+    return len(rows)
+
+
+def import_csv(conn, table, file_path=None):
+    """Loads one CSV file into its table, replacing existing rows."""
+    file_path = file_path or TABLES[table][0]
+    return import_df(conn, table, pd.read_csv(file_path), replace=True)
+
+
+def import_all(conn=None):
+    """Loads every CSV that exists on disk into the database."""
+    conn = conn or connect()
+    counts = {}
+    for table, (file_path, _) in TABLES.items():
+        if os.path.exists(file_path):
+            counts[table] = import_csv(conn, table, file_path)
+    return counts
+
+
+def read_table(table, where="", params=(), limit=None, conn=None):
+    """Runs a SELECT on a table and returns a DataFrame with CSV column names."""
+    conn = conn or connect()
+    query = f"SELECT * FROM {table}"
+    if where:
+        query += f" WHERE {where}"
+    if limit is not None:
+        query += f" LIMIT {int(limit)}"
+    df = pd.read_sql_query(query, conn, params=params)
+    return df.rename(columns={sql: csv.strip() for csv, sql, _ in _columns(table)})
+
+
+def data_version(tables, conn=None):
+    """Returns a tuple that changes whenever a VERSIONED_COLUMNS column of the tables changes."""
+    conn = conn or connect()
+    versions = dict(conn.execute("SELECT table_name, version FROM data_versions").fetchall())
+    return tuple(versions.get(table, 0) for table in tables)
+
+
+def count(table, where="", params=(), conn=None):
+    """Returns the number of rows in a table, optionally matching a WHERE clause."""
+    conn = conn or connect()
+    query = f"SELECT COUNT(*) FROM {table}"
+    if where:
+        query += f" WHERE {where}"
+    return conn.execute(query, params).fetchone()[0]
+
+
+def export_csv(table, file_path=None, conn=None):
+    """Writes a table back out in its original CSV layout."""
+    file_path = file_path or TABLES[table][0]
+    df = read_table(table, conn=conn)
+    df.columns = [csv for csv, _, _ in _columns(table)]
+    df.to_csv(file_path, index=False)
+    return file_path
+
+
+def get_supplier(supplier_id, conn=None):
+    """Returns a supplier row as a dict, or None."""
+    conn = conn or connect()
+    row = conn.execute("SELECT * FROM suppliers WHERE supplier_id = ?", (supplier_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def get_contract_with_supplier(product_id, conn=None):
+    """Returns the product's contract line with the most left, joined with its supplier, or None."""
+    conn = conn or connect()
+    row = conn.execute(
+        """
+        SELECT c.*, s.supplier_name, s.contact_email
+        FROM contracts c LEFT JOIN suppliers s ON s.supplier_id = c.supplier_id
+        WHERE c.product_id = ?
+        ORDER BY c.quantity - c.used DESC, c.rowid
+        LIMIT 1
+        """,
+        (product_id,),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def get_contracts_with_suppliers(product_ids, conn=None):
+    """Returns the contract lines for several products joined with their suppliers."""
+    conn = conn or connect()
+    if not product_ids:
+        return pd.DataFrame(columns=[sql for _, sql, _ in TABLES["contracts"][1]] + ["supplier_name", "contact_email"])
+    placeholders = ", ".join("?" for _ in product_ids)
+    return pd.read_sql_query(
+        f"""
+        SELECT c.*, s.supplier_name, s.contact_email
+        FROM contracts c LEFT JOIN suppliers s ON s.supplier_id = c.supplier_id
+        WHERE c.product_id IN ({placeholders})
+        """,
+        conn,
+        params=list(product_ids),
+    )
+
+
+def _consume(conn, product_id, quantity, contract_id=None):
+    line_filter = "product_id = ?" + (" AND contract_id = ?" if contract_id is not None else "")
+    line_params = (product_id,) + ((contract_id,) if contract_id is not None else ())
+    updated = conn.execute(
+        f"""
+        UPDATE contracts SET used = used + ?
+        WHERE rowid = (
+            SELECT rowid FROM contracts WHERE {line_filter}
+            ORDER BY quantity - used DESC, rowid LIMIT 1
+        ) AND used + ? <= quantity
+        RETURNING rowid
+        """,
+        (quantity, *line_params, quantity),
+    ).fetchone()
+    if updated is not None:
+        row = dict(conn.execute("SELECT * FROM contracts WHERE rowid = ?", (updated[0],)).fetchone())
+        return {"row": row, "used": row["used"], "total": row["quantity"]}
+
+    # Report the line with the most room left
+    row = conn.execute(
+        f"SELECT * FROM contracts WHERE {line_filter} ORDER BY quantity - used DESC, rowid LIMIT 1", line_params
+    ).fetchone()
+    if row is None:
+        where = f" on contract '{contract_id}'" if contract_id is not None else ""
+        return {"error": f"Error: Product ID '{product_id}' not found in database{where}"}
+    available = row["quantity"] - row["used"]
+    return {"error": f"Error: Cannot use {quantity} units. Only {available} units available (total: {row['quantity']}, already used: {row['used']})"}
+
+
+def consume(product_id, quantity, contract_id=None, conn=None):
+    """
+    Adds `quantity` to a contract line's used counter if the limit allows it.
+
+    Without a contract_id, the product's line with the most remaining quantity
+    is used (as in utils.resolve_basket). The check and the update are one conditional UPDATE, so
+    concurrent writers cannot overdraw a contract.
+
+    Returns:
+        dict with contract row and new totals, or {"error": ...}
+    """
+    conn = conn or connect()
+    with conn:
+        return _consume(conn, product_id, quantity, contract_id)
+
+
+class _Rollback(Exception):
+    pass
+
+
+def consume_many(lines, conn=None):
+    """
+    Adds usage for several lines in one transaction, all or nothing.
+
+    Args:
+        lines: List of (product_id, quantity, contract_id or None)
+
+    Returns:
+        dict: {"lines": [{"row", "used", "total"}, ...]} or {"error": ...}
+    """
+    conn = conn or connect()
+    outcomes = []
+    try:
+        with conn:
+            for product_id, quantity, contract_id in lines:
+                outcome = _consume(conn, product_id, quantity, contract_id)
+                if "error" in outcome:
+                    raise _Rollback(outcome["error"] if len(lines) == 1 else f"{product_id}: {outcome['error']}")
+                outcomes.append(outcome)
+    except _Rollback as e:
+        return {"error": str(e)}
+    return {"lines": outcomes}
+
+
+def release(lines, conn=None):
+    """Takes back usage booked with consume_many; lines are (product_id, quantity, contract_id)."""
+    conn = conn or connect()
+    with conn:
+        conn.executemany(
+            "UPDATE contracts SET used = used - ? WHERE product_id = ? AND contract_id = ?",
+            [(quantity, product_id, contract_id) for product_id, quantity, contract_id in lines],
+        )
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "import"
+    if command == "import":
+        conn = connect()
+        create_schema(conn)
+        for table, n in import_all(conn).items():
+            print(f"Imported {n} rows into {table}")
+    elif command == "export":
+        for table in TABLES:
+            print(f"Exported {table} to {export_csv(table)}")
+    else:
+        print("Usage: python database.py [import|export]")
@@ -0,0 +1,114 @@
+"""
+Small persistent key-value cache for expensive API results.
+
+Each entry is one JSON file named by its key, so entries survive restarts and
+can be shared by several processes on the same machine. The cache is bounded
+by total size on disk: when it grows past `max_bytes`, the least recently used
+entries are evicted. Hit and miss counts are kept per process.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+CACHE_ROOT = ".cache"
+
+
+def make_key(*parts):
+    """
+    Builds a cache key from byte or string parts (e.g. audio bytes + model id).
+
+    Returns:
+        str: SHA-256 hex digest
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        digest.update(part)
+        # Separator so ("ab", "c") and ("a", "bc") do not collide
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """Directory-backed LRU cache of JSON-serializable values."""
+
+    def __init__(self, name, max_bytes=50 * 1024 * 1024, root=CACHE_ROOT):
+        self.directory = os.path.join(root, name)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (size in bytes, last used); rebuilt from the directory on startup
+        self._entries = {}
+        os.makedirs(self.directory, exist_ok=True)
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".json"):
+                stat = os.stat(os.path.join(self.directory, filename))
+                self._entries[filename[:-5]] = (stat.st_size, stat.st_mtime)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key, default=None):
+        """Returns the cached value for `key`, or `default` on a miss."""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+                self._entries.pop(key, None)
+            return default
+
+        now = time.time()
+        with self._lock:
+            self.hits += 1
+            self._entries[key] = (self._entries.get(key, (os.path.getsize(path), now))[0], now)
+        try:
+            # The file mtime doubles as the LRU timestamp across restarts
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        """Stores a JSON-serializable value and evicts old entries if over budget."""
+        data = json.dumps(value)
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._entries[key] = (len(data.encode()), time.time())
+            self._evict()
+
+    def _evict(self):
+        total = sum(size for size, _ in self._entries.values())
+        if total <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self._entries.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            del self._entries[key]
+            total -= size
+
+    def stats(self):
+        """Returns hit/miss counters and the current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(size for size, _ in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
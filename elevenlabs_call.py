@@ -3,6 +3,7 @@ Lightweight wrappers delegating to elevenlabs_tools to avoid duplication.
 Provides a richer start_voice_conversation that returns transcript details.
 """
 
+from call_monitor import DONE_STATUSES
 from elevenlabs_tools import (
     init_elevenlabs,
     speech_to_text,
@@ -12,7 +13,7 @@ from elevenlabs_tools import (
 
 
 def start_voice_conversation(
-    order_list: str, target_price: str, site_address: str, vendor_name: str
+    order_list: str, target_price: str, site_address: str, vendor_name: str, call_deadline=None
 ):
     """
     Start an ElevenLabs conversational AI session.
@@ -22,34 +23,28 @@ def start_voice_conversation(
         target_price: Target price for items
         site_address: Delivery address
         vendor_name: Vendor name
+        call_deadline: Seconds the call may run before giving up
         
     Returns:
-        dict with conversation_id and transcript
+        dict with conversation_id, transcript and success (False if the call
+        failed or was interrupted)
     """
     client = get_client()
     if client is None:
         raise Exception("ElevenLabs client not initialized.")
 
-    # Delegate conversation to core implementation
-    conversation_id = start_voice_conversation_core(
+    # Delegate conversation to core implementation; the call monitor already
+    # collected the transcript, so no extra conversations.get is needed
+    conversation_id, transcript_text, status = start_voice_conversation_core(
         order_list=order_list,
         target_price=target_price,
         site_address=site_address,
         vendor_name=vendor_name,
+        call_deadline=call_deadline,
     )
 
-    # Attempt to fetch conversation details (duration + transcript)
-    transcript_text = ""
-    try:
-        full_conversation = client.conversational_ai.conversations.get(conversation_id)
-        print(f"Duration: {getattr(full_conversation, 'duration_secs', 'n/a')}")
-        print(f"Transcript: {getattr(full_conversation, 'transcript', '')}")
-        transcript_text = getattr(full_conversation, 'transcript', '')
-    except Exception as e:
-        print(f"[WARN] Failed to fetch full conversation details: {e}")
-
     return {
         "conversation_id": conversation_id,
         "transcript": transcript_text,
-        "success": bool(conversation_id)
+        "success": bool(conversation_id) and status in DONE_STATUSES
     }
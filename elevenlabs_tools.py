@@ -1,16 +1,27 @@
 from elevenlabs.client import ElevenLabs
+import io
+import os
+import tempfile
 import urllib.parse
+from call_monitor import CallMonitor, CALL_DEADLINE, get_webhook_receiver, format_transcript
 
 # Initialize client (you'll pass the API key when calling)
 client = None
+webhook_receiver = None
 AGENT_ID = "agent_7501kcc5xtwdejjrz72a4vhdywca"
+STT_MODEL_ID = "scribe_v1"
 BASE_LINK = "https://elevenlabs.io/app/talk-to?agent_id=agent_7501kcc5xtwdejjrz72a4vhdywca&branch_id=agtbrch_8801kcc5xwheew1veqz9gx2jdaxc"
 
 
-def init_elevenlabs(api_key: str):
-    """Initialize the ElevenLabs client with API key"""
-    global client
+def init_elevenlabs(api_key: str, webhook_port=None, webhook_secret=None):
+    """Initialize the ElevenLabs client with API key (and optionally the post-call webhook receiver)"""
+    global client, webhook_receiver
     client = ElevenLabs(api_key=api_key)
+    if webhook_port:
+        try:
+            webhook_receiver = get_webhook_receiver(webhook_port, webhook_secret)
+        except OSError as e:
+            print(f"[WARN] Could not start call webhook receiver on port {webhook_port}: {e}")
 
 
 def get_client():
@@ -65,9 +76,33 @@ call_local_store_tool_definition = {
 }
 
 
-def speech_to_text(file_path: str) -> str:
+def _as_upload(audio, filename):
+    """Wraps in-memory audio as a named file object; returns None for paths."""
+    if isinstance(audio, (bytes, bytearray, memoryview)):
+        upload = io.BytesIO(audio)
+        upload.name = filename
+        return upload
+    if hasattr(audio, "read"):
+        # File objects are re-sent on retries, so always start from the top
+        if hasattr(audio, "seek"):
+            audio.seek(0)
+        if not getattr(audio, "name", None):
+            try:
+                audio.name = filename
+            except AttributeError:
+                pass
+        return audio
+    return None
+
+
+def speech_to_text(audio, filename="recording.mp3") -> str:
     """
     Transcribe speech to text with the world's most accurate ASR model.
+
+    Args:
+        audio: File path, raw bytes / bytearray / memoryview, or a binary file
+            object (e.g. the BytesIO from save_audio_to_mp3)
+        filename: Name sent with in-memory audio so the format can be detected
     """
     global client
     if client is None:
@@ -75,13 +110,30 @@ def speech_to_text(file_path: str) -> str:
             "ElevenLabs client not initialized. Call init_elevenlabs() first."
         )
 
-    # Open the local file
-    with open(file_path, "rb") as audio_file:
-        # Call ElevenLabs API with correct parameter name
-        result = client.speech_to_text.convert(
-            file=audio_file,
-            model_id="scribe_v1",
-        )
+    upload = _as_upload(audio, filename)
+    if upload is None:
+        # Open the local file
+        with open(audio, "rb") as audio_file:
+            # Call ElevenLabs API with correct parameter name
+            result = client.speech_to_text.convert(
+                file=audio_file,
+                model_id=STT_MODEL_ID,
+            )
+        return result.text if hasattr(result, 'text') else str(result)
+
+    try:
+        result = client.speech_to_text.convert(file=upload, model_id=STT_MODEL_ID)
+    except TypeError:
+        # Older SDKs only accept real files; spill to a temp file as a fallback
+        upload.seek(0)
+        suffix = os.path.splitext(getattr(upload, "name", "") or filename)[1] or ".mp3"
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+            temp_file.write(upload.read())
+            temp_file_path = temp_file.name
+        try:
+            return speech_to_text(temp_file_path)
+        finally:
+            os.remove(temp_file_path)
 
     return result.text if hasattr(result, 'text') else str(result)
 
@@ -102,7 +154,7 @@ def call_local_store(item_name: str, quantity: int) -> str:
 
 
 def start_voice_conversation(
-    order_list: str, target_price: str, site_address: str, vendor_name: str
+    order_list: str, target_price: str, site_address: str, vendor_name: str, call_deadline=None
 ):
     """
     Start an ElevenLabs conversational AI session.
@@ -112,9 +164,10 @@ def start_voice_conversation(
         target_price: Target price for items
         site_address: Delivery address
         vendor_name: Vendor name
+        call_deadline: Seconds the call may run before giving up (default: CALL_DEADLINE)
         
     Returns:
-        conversation_id after session ends
+        tuple: (conversation_id, transcript text, final call status) after the call ends
     """
     global client
     if client is None:
@@ -178,6 +231,7 @@ def start_voice_conversation(
                 except Exception as e:
                     print(f"[WARN] Failed to end session on user end phrase: {e}")
 
+        link_sent_at = time.time()
         params = {f"var_{k}": v for k, v in dynamic_vars.items()}
         query_string = urllib.parse.urlencode(params)
         final_url = f"{BASE_LINK}&{query_string}"
@@ -190,65 +244,35 @@ def start_voice_conversation(
             print(f"[WARN] Failed to send demo call link via email: {e}")
             print(final_url)
 
-        # 1. Find the Active Call
-        active_call_id = None
-        while not active_call_id:
-            try:
-                # We look for the most recent conversation
-                # Note: Use .list() or .get_conversations() depending on SDK version
-                resp = client.conversational_ai.conversations.list(
-                    agent_id=AGENT_ID, page_size=1
-                )
-                history = resp.conversations if hasattr(resp, 'conversations') else resp
-                if history:
-                    latest = history[0]
-                    # If we find a call that is currently 'processing' (Active)
-                    if latest.status == "processing":
-                        active_call_id = latest.conversation_id
-                        print(f"\n🚀 Call Detected! (ID: {active_call_id})")
-                        print("Streaming transcript...\n")
-                        break
-                time.sleep(1)  # Check every second
-                print(".", end="", flush=True)
-            except Exception as e:
-                time.sleep(1)
-
-        # 2. Live Loop - Print new messages as they arrive
-        processed_message_count = 0
-        while True:
-            try:
-                # Fetch the FULL details of the active call
-                details = client.conversational_ai.conversations.get(active_call_id)
-                # Check if there are NEW messages we haven't printed yet
-                current_transcript = details.transcript
-                if len(current_transcript) > processed_message_count:
-                    # Only get the new ones
-                    new_messages = current_transcript[processed_message_count:]
-                    for msg in new_messages:
-                        # Print it nicely
-                        role = str(msg.role).capitalize()
-                        print(f"[{role}]: {msg.message}")
-                        # --- YOUR HACKATHON LOGIC HERE ---
-                        if role == "User" and "screws" in msg.message:
-                            print("   >>> ✅ DETECTED ORDER ITEM: SCREWS")
-                        # ---------------------------------
-                    # Update our counter
-                    processed_message_count = len(current_transcript)
-                # Check if call has ended
-                if details.status == "done" or details.status == "success":
-                    print("\n📞 Call Finished.")
-                    break
-                elif details.status == "failed":
-                    print("\n❌ Call Failed.")
-                    break
-                time.sleep(1)  # Poll every 1 second for updates
-            except KeyboardInterrupt:
-                break
-            except Exception as e:
-                # Sometimes the API might timeout, just ignore and try again
-                time.sleep(1)
-
-        return True, current_transcript
+        # 1. Find the Active Call (adaptive polling with a hard deadline)
+        monitor = CallMonitor(client, AGENT_ID, receiver=webhook_receiver)
+        # Several calls can run on this agent at once; only take the one for this vendor and order
+        active_call_id = monitor.wait_for_call(
+            started_after=link_sent_at,
+            match={"vendor_name": vendor_name, "order_list": order_list},
+        )
+        print(f"\n🚀 Call Detected! (ID: {active_call_id})")
+        print("Streaming transcript...\n")
+
+        # 2. Follow the call - print new messages as they arrive
+        def on_message(msg):
+            # Print it nicely
+            role = str(msg.role if hasattr(msg, "role") else msg.get("role")).capitalize()
+            text = msg.message if hasattr(msg, "message") else msg.get("message")
+            print(f"[{role}]: {text}")
+            # --- YOUR HACKATHON LOGIC HERE ---
+            if role == "User" and text and "screws" in text:
+                print("   >>> ✅ DETECTED ORDER ITEM: SCREWS")
+            # ---------------------------------
+
+        status, transcript = monitor.follow(active_call_id, on_message=on_message, deadline=call_deadline or CALL_DEADLINE)
+        if status in ("done", "success"):
+            print("\n📞 Call Finished.")
+        else:
+            print("\n❌ Call Failed.")
+        print(f"[INFO] Monitoring used {monitor.api_calls} API calls")
+
+        return active_call_id, format_transcript(transcript), status
 
     except Exception as e:
         # Get full error details
@@ -0,0 +1,175 @@
+"""
+Persistent background job queue for long-running tool calls.
+
+Local-store voice calls can take minutes, so instead of blocking the Streamlit
+script thread they are submitted here and run on worker threads. Every state
+change is appended to jobs.jsonl; on restart the file is replayed, queued jobs
+are picked up again and jobs that were mid-call are marked interrupted (a phone
+call cannot be resumed).
+"""
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+JOBS_PATH = "jobs.jsonl"
+NUM_WORKERS = 3
+# Delivered jobs older than this are dropped when the file is rewritten on startup
+RETENTION_SECS = 24 * 3600
+
+PENDING_STATUSES = ("queued", "running")
+FINISHED_STATUSES = ("done", "failed", "interrupted")
+
+
+class JobQueue:
+    """JSONL-backed job store with a pool of worker threads."""
+
+    def __init__(self, path=JOBS_PATH, num_workers=NUM_WORKERS):
+        self.path = path
+        self.num_workers = num_workers
+        self._handlers = {}
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._workers = []
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self._jobs[record["id"]] = record
+
+        cutoff = time.time() - RETENTION_SECS
+        for job_id, job in list(self._jobs.items()):
+            if job["status"] == "running":
+                job.update(status="interrupted", error="The app restarted while this job was running.", updated_at=time.time())
+            elif job["status"] == "queued":
+                self._queue.put(job_id)
+            elif job.get("delivered") and job["updated_at"] < cutoff:
+                del self._jobs[job_id]
+
+        # Rewrite with one line per job so the file does not grow without bound
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            for job in self._jobs.values():
+                f.write(json.dumps(job) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def _persist(self, job):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(job, default=str) + "\n")
+
+    def _update(self, job_id, **changes):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(changes, updated_at=time.time())
+            self._persist(job)
+            return dict(job)
+
+    def _ensure_workers(self):
+        with self._lock:
+            while len(self._workers) < self.num_workers:
+                worker = threading.Thread(target=self._work, daemon=True, name=f"job-worker-{len(self._workers)}")
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            job = self.get(job_id)
+            handler = self._handlers.get(job["kind"]) if job else None
+            if handler is None:
+                self._update(job_id, status="failed", error=f"No handler registered for job kind '{job and job['kind']}'")
+                continue
+            self._update(job_id, status="running")
+            try:
+                result = handler(**job["payload"])
+                self._update(job_id, status="done", result=result)
+            except Exception as e:
+                print(f"[WARN] Job {job_id} failed: {e}\n{traceback.format_exc()}")
+                self._update(job_id, status="failed", error=str(e)[:500])
+
+    def register(self, kind, handler):
+        """Registers the function that runs jobs of `kind`; starts the workers."""
+        self._handlers[kind] = handler
+        self._ensure_workers()
+
+    def submit(self, kind, payload, session_id=None):
+        """
+        Queues a job and returns immediately.
+
+        Args:
+            kind: Registered job kind (e.g., 'local_store_call')
+            payload: Keyword arguments for the handler (must be JSON-serializable)
+            session_id: Chat session that should be notified when the job finishes
+
+        Returns:
+            str: Job ID
+        """
+        job_id = uuid.uuid4().hex[:8]
+        now = time.time()
+        job = {
+            "id": job_id, "kind": kind, "payload": payload, "session_id": session_id,
+            "status": "queued", "result": None, "error": None,
+            "created_at": now, "updated_at": now, "delivered": False,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._persist(job)
+        # Workers start in register(); a process that only submits never runs jobs
+        self._queue.put(job_id)
+        return job_id
+
+    def get(self, job_id):
+        """Returns a copy of a job record, or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def jobs_for(self, session_id, statuses=None):
+        """Returns the session's jobs, optionally filtered by status, oldest first."""
+        with self._lock:
+            jobs = [dict(j) for j in self._jobs.values() if j["session_id"] == session_id]
+        if statuses:
+            jobs = [j for j in jobs if j["status"] in statuses]
+        return sorted(jobs, key=lambda j: j["created_at"])
+
+    def undelivered(self, session_id):
+        """Returns finished jobs whose result has not been posted to the chat yet."""
+        return [j for j in self.jobs_for(session_id, FINISHED_STATUSES) if not j["delivered"]]
+
+    def mark_delivered(self, job_id):
+        """Records that a job's result was posted to its chat session."""
+        return self._update(job_id, delivered=True)
+
+
+_queue_instance = None
+_instance_lock = threading.Lock()
+
+
+def get_queue():
+    """Returns the process-wide job queue."""
+    global _queue_instance
+    with _instance_lock:
+        if _queue_instance is None:
+            _queue_instance = JobQueue()
+        return _queue_instance
+
+
+def describe(job):
+    """One-line status text for a job, with the result or error when finished."""
+    text = f"Job {job['id']} ({job['kind']}): {job['status']}"
+    if job["status"] == "done" and job["result"]:
+        text += f"\n{job['result']}"
+    elif job["error"]:
+        text += f" - {job['error']}"
+    return text
@@ -0,0 +1,264 @@
+"""
+Append-only consumption ledger for contracts.csv.
+
+Orders no longer rewrite contracts.csv. Each consumption is appended as one JSON
+line (contract_id, product_id, delta, timestamp) to contracts_ledger.jsonl,
+which costs O(1) I/O per order. The effective `used` value of a contract line
+is the `used` column in contracts.csv plus all pending ledger deltas for that
+line. The same product can be on several contracts, so entries are keyed on
+(contract_id, product_id).
+
+Writers take an exclusive file lock, so the contract quantity limit is enforced
+even when several Streamlit sessions (or processes) order at the same time.
+Once the ledger grows past COMPACT_EVERY entries, it is folded back into the
+`used` column of contracts.csv and truncated.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+import catalog
+
+LEDGER_PATH = "contracts_ledger.jsonl"
+LOCK_PATH = "contracts.csv.lock"
+COMPACT_EVERY = 100
+
+
+@contextmanager
+def file_lock(path=LOCK_PATH, shared=False):
+    """Holds an flock on `path` for the duration of the block."""
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _apply_totals(contracts_df, totals):
+    df = contracts_df.copy()
+    if totals:
+        keys = zip(df["contract_id"].astype(str), df["product_id"].astype(str))
+        delta = [totals.get(key, 0) for key in keys]
+        df["used"] = df["used"] + pd.Series(delta, index=df.index).astype(df["used"].dtype)
+    return df
+
+
+class Ledger:
+    """Tails the ledger file and keeps per-contract-line running totals in memory."""
+
+    def __init__(self, ledger_path=LEDGER_PATH, contracts_path="contracts.csv"):
+        self.ledger_path = ledger_path
+        self.contracts_path = contracts_path
+        self._lock = threading.Lock()
+        self._inode = None
+        self._offset = 0
+        self._entries = 0
+        self._totals = {}
+
+    def _reset(self, inode=None):
+        self._inode = inode
+        self._offset = 0
+        self._entries = 0
+        self._totals = {}
+
+    def _sync(self):
+        """Reads ledger lines appended since the last sync."""
+        with self._lock:
+            try:
+                stat = os.stat(self.ledger_path)
+            except FileNotFoundError:
+                self._reset()
+                return
+            # Compaction replaces the file; start over when that happens
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                self._reset(stat.st_ino)
+            if stat.st_size == self._offset:
+                return
+
+            with open(self.ledger_path, "rb") as f:
+                f.seek(self._offset)
+                chunk = f.read()
+            # Only consume complete lines; a partial trailing line is read next time
+            end = chunk.rfind(b"\n") + 1
+            for line in chunk[:end].splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    print(f"[WARN] Skipping malformed ledger line: {line[:80]!r}")
+                    continue
+                key = (str(entry["contract_id"]), str(entry["product_id"]))
+                self._totals[key] = self._totals.get(key, 0) + entry["delta"]
+                self._entries += 1
+            self._offset += end
+
+    def pending(self, line=None):
+        """Returns the uncompacted delta for one (contract_id, product_id) line, or a dict for all."""
+        self._sync()
+        if line is not None:
+            return self._totals.get(line, 0)
+        return dict(self._totals)
+
+    def effective_contracts(self):
+        """Returns a copy of contracts with pending ledger deltas applied to `used`."""
+        with file_lock(shared=True):
+            return _apply_totals(catalog.load_df("contracts"), self.pending())
+
+    def _choose_line(self, product_id, delta, contract_id=None, booked=None):
+        """
+        Picks the contract line to book `delta` on; the caller holds the file lock.
+
+        Args:
+            booked: Deltas already planned per line in the same batch
+
+        Returns:
+            tuple: (row, line key, current used), or an error string
+        """
+        booked = booked or {}
+        rows = catalog.get_table("contracts").lookup_all("product_id", product_id)
+        if contract_id is not None:
+            rows = rows[rows["contract_id"].astype(str) == str(contract_id)]
+        if rows.empty:
+            where = f" on contract '{contract_id}'" if contract_id is not None else ""
+            return f"Error: Product ID '{product_id}' not found in database{where}"
+
+        candidates = []
+        for row in rows.to_dict("records"):
+            line = (str(row["contract_id"]), str(row["product_id"]))
+            current_used = row["used"] + self.pending(line) + booked.get(line, 0)
+            candidates.append((row, line, current_used))
+
+        # The line with the most left, as in utils.resolve_basket (first one on ties)
+        chosen = max(candidates, key=lambda c: c[0]["quantity"] - c[2])
+        row, _, current_used = chosen
+        if current_used + delta > row["quantity"]:
+            total_quantity = row["quantity"]
+            available = total_quantity - current_used
+            return f"Error: Cannot use {delta} units. Only {available} units available (total: {total_quantity}, already used: {current_used})"
+        return chosen
+
+    def _append(self, entries):
+        with open(self.ledger_path, "a") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+        self._sync()
+        return self._entries >= COMPACT_EVERY
+
+    def record_many(self, lines):
+        """
+        Appends consumption entries for several lines, all or nothing.
+
+        Every line is checked against its contract quantity under one lock; if
+        any line does not fit, nothing is written. Without a contract_id, the
+        product's contract line with the most remaining quantity is used.
+
+        Args:
+            lines: List of (product_id, delta, contract_id or None)
+
+        Returns:
+            dict: {"lines": [{"row", "used", "total"}, ...]} or {"error": ...}
+        """
+        with file_lock():
+            booked, entries, outcomes = {}, [], []
+            now = time.time()
+            for product_id, delta, contract_id in lines:
+                chosen = self._choose_line(product_id, delta, contract_id, booked)
+                if isinstance(chosen, str):
+                    return {"error": chosen if len(lines) == 1 else f"{product_id}: {chosen}"}
+                row, line, current_used = chosen
+                booked[line] = booked.get(line, 0) + delta
+                entries.append({"contract_id": line[0], "product_id": line[1], "delta": int(delta), "timestamp": now})
+                outcomes.append({"row": row, "used": current_used + delta, "total": row["quantity"]})
+            needs_compaction = self._append(entries)
+
+        if needs_compaction:
+            self.compact()
+        return {"lines": outcomes}
+
+    def record(self, product_id, delta, contract_id=None):
+        """
+        Appends a consumption entry if it stays within the contract quantity.
+
+        Without a contract_id, the product's contract line with the most
+        remaining quantity is used.
+
+        Args:
+            product_id: The product ID (e.g., 'C001')
+            delta: Quantity to add to the line's used counter
+            contract_id: Optional contract to book against
+
+        Returns:
+            dict with contract row and new totals, or {"error": ...}
+        """
+        outcome = self.record_many([(product_id, delta, contract_id)])
+        return outcome if "error" in outcome else outcome["lines"][0]
+
+    def release(self, lines):
+        """
+        Takes back consumption booked by record_many (compensating entries).
+
+        Args:
+            lines: List of (product_id, delta, contract_id) as booked
+        """
+        now = time.time()
+        entries = [
+            {"contract_id": str(contract_id), "product_id": str(product_id), "delta": -int(delta), "timestamp": now}
+            for product_id, delta, contract_id in lines
+        ]
+        with file_lock():
+            self._append(entries)
+
+    def compact(self):
+        """Folds pending ledger entries into the `used` column of contracts.csv."""
+        with file_lock():
+            totals = self.pending()
+            if not totals:
+                return 0
+            df = _apply_totals(catalog.load_df("contracts"), totals)
+            tmp_path = f"{self.contracts_path}.tmp"
+            df.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, self.contracts_path)
+            catalog.invalidate("contracts")
+            # Swap in an empty ledger; readers notice the new inode
+            open(f"{self.ledger_path}.tmp", "w").close()
+            os.replace(f"{self.ledger_path}.tmp", self.ledger_path)
+            compacted = self._entries
+            self._sync()
+        print(f"[INFO] Compacted {compacted} ledger entries into {self.contracts_path}")
+        return compacted
+
+
+_ledger = Ledger()
+
+
+def record_usage(product_id, delta, contract_id=None):
+    """Records consumption for a contract line in the shared ledger."""
+    return _ledger.record(product_id, delta, contract_id)
+
+
+def record_usage_many(lines):
+    """Records consumption for several lines at once, all or nothing."""
+    return _ledger.record_many(lines)
+
+
+def release_usage(lines):
+    """Takes back consumption recorded with record_usage_many."""
+    return _ledger.release(lines)
+
+
+def effective_contracts():
+    """Returns contracts with the ledger applied to the `used` column."""
+    return _ledger.effective_contracts()
+
+
+def compact():
+    """Compacts the shared ledger into contracts.csv."""
+    return _ledger.compact()
@@ -0,0 +1,139 @@
+"""
+Pooled SMTP connections for order emails.
+
+Opening a connection, running STARTTLS and logging in costs several round
+trips, so connections are kept open and reused. A connection that has been
+idle for a while is checked with NOOP before use and replaced if the server
+dropped it; a send that fails on a dead connection is retried once on a fresh
+one. STARTTLS and login are optional so a local test server (e.g. aiosmtpd or
+`python -m smtpd`) can stand in for the real provider.
+"""
+import smtplib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+POOL_SIZE = 2
+CONNECT_TIMEOUT = 30  # seconds
+NOOP_AFTER = 10  # seconds idle before a connection is health-checked
+MAX_IDLE = 240  # seconds idle before a connection is closed instead of reused
+
+# Errors that mean the connection is gone, not that the message was rejected
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+
+class SMTPPool:
+    """A small pool of logged-in SMTP connections to one server."""
+
+    def __init__(self, host, port, username=None, password=None, starttls=True, size=POOL_SIZE):
+        self.host = host
+        self.port = int(port)
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.connects = 0
+        self._idle = deque()  # (connection, last used)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        conn = smtplib.SMTP(self.host, self.port, timeout=CONNECT_TIMEOUT)
+        try:
+            if self.starttls:
+                conn.starttls()
+            if self.username and self.password:
+                conn.login(self.username, self.password)
+        except Exception:
+            self._close(conn)
+            raise
+        self.connects += 1
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
+    @staticmethod
+    def _alive(conn):
+        try:
+            return conn.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, last_used = self._idle.pop()
+            idle = time.monotonic() - last_used
+            if idle < NOOP_AFTER or (idle < MAX_IDLE and self._alive(conn)):
+                return conn
+            self._close(conn)
+        return self._connect()
+
+    @contextmanager
+    def connection(self):
+        """Yields a live connection and returns it to the pool afterwards."""
+        with self._slots:
+            conn = self._checkout()
+            try:
+                yield conn
+            except CONNECTION_ERRORS:
+                self._close(conn)
+                raise
+            except Exception:
+                # The server rejected a message; the connection itself is fine
+                self._release(conn)
+                raise
+            self._release(conn)
+
+    def _release(self, conn):
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+
+    def send(self, messages):
+        """
+        Sends one message or a list of messages over a single pooled connection.
+
+        A dropped connection is replaced and the unsent messages retried once.
+        """
+        if not isinstance(messages, (list, tuple)):
+            messages = [messages]
+        sent = 0
+        for attempt in range(2):
+            try:
+                with self.connection() as conn:
+                    for msg in messages[sent:]:
+                        conn.send_message(msg)
+                        sent += 1
+                return sent
+            except CONNECTION_ERRORS as e:
+                if attempt == 1:
+                    raise
+                print(f"[WARN] SMTP connection lost ({e}); reconnecting")
+        return sent
+
+    def close(self):
+        """Closes all idle connections."""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            self._close(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(host, port, username=None, password=None, starttls=True):
+    """Returns the process-wide pool for these settings, creating it on first use."""
+    key = (host, int(port), username, password, bool(starttls))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = SMTPPool(host, port, username, password, starttls)
+        return _pools[key]
@@ -0,0 +1,188 @@
+"""
+Concurrent price negotiation with several local vendors.
+
+One voice call per vendor is started in parallel (up to a concurrency cap), so
+the time to a set of quotes is the longest call instead of the sum of all calls.
+Each transcript is scanned for the quoted unit price and lead time, and the
+offers are ranked against the contract unit price.
+"""
+import math
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from call_monitor import DETECT_DEADLINE
+
+MAX_CONCURRENT_CALLS = 3
+CALL_DEADLINE = 10 * 60  # seconds per vendor call, once it has been picked up
+
+_NUMBER = r"(\d+(?:[.,]\d+)?)"
+PRICE_PATTERNS = [
+    re.compile(rf"(?:€|eur\b|euro\b)\s*{_NUMBER}", re.IGNORECASE),
+    re.compile(rf"{_NUMBER}\s*(?:€|eur\b|euros?\b)", re.IGNORECASE),
+]
+CENT_PATTERN = re.compile(rf"{_NUMBER}\s*(?:cents?|ct\b)", re.IGNORECASE)
+LEAD_DAYS_PATTERN = re.compile(r"(\d+)\s*(?:working\s+|business\s+)?(?:days?|werktagen?|tagen?)\b", re.IGNORECASE)
+LEAD_WORDS = {"today": 0, "heute": 0, "tomorrow": 1, "morgen": 1}
+UNIT_PATTERN = re.compile(
+    r"\b(?:per|pro|je|a|the)\s+(?:piece|pc|pcs|unit|item|stück|stk|einheit|meter|metre|m|box|pack)\b"
+    r"|\beach\b|\bapiece\b|\bdas\s+stück\b|/\s*(?:pc|pcs|stk|stück|unit)\b",
+    re.IGNORECASE,
+)
+TOTAL_PATTERN = re.compile(
+    r"\b(?:total|in\s+total|altogether|overall|all\s+together|for\s+(?:all|everything|the\s+lot)|"
+    r"insgesamt|gesamt\w*|zusammen|für\s+alles)\b",
+    re.IGNORECASE,
+)
+CONTEXT_CHARS = 30
+CLAUSE_END = re.compile(r"[,;!?\n]|\.(?:\s|$)")
+
+
+def _to_float(text):
+    return float(text.replace(",", "."))
+
+
+def _clause_around(text, start, end):
+    """Text of the clause around text[start:end], at most CONTEXT_CHARS on each side."""
+    before = text[max(0, start - CONTEXT_CHARS):start]
+    cuts = list(CLAUSE_END.finditer(before))
+    if cuts:
+        before = before[cuts[-1].end():]
+    after = text[end:end + CONTEXT_CHARS]
+    cut = CLAUSE_END.search(after)
+    if cut:
+        after = after[:cut.start()]
+    return before, after
+
+
+def extract_quote(transcript, quantity=None):
+    """
+    Pulls the quoted unit price and lead time out of a call transcript.
+
+    Amounts next to per-unit wording ("per piece", "each", "pro Stück") are
+    preferred, and amounts marked as totals ("40 euros total", "insgesamt")
+    are skipped; a total is only used, divided by `quantity`, when nothing
+    else was quoted. Among equally good mentions the last one wins, since
+    prices usually move during a negotiation.
+
+    Args:
+        transcript: Call transcript text
+        quantity: Ordered quantity, to turn a quoted total into a unit price
+
+    Returns:
+        dict: {"unit_price_eur": float or None, "lead_days": int or None}
+    """
+    text = transcript or ""
+    matches = []
+    for pattern in PRICE_PATTERNS:
+        matches += [(m, _to_float(m.group(1))) for m in pattern.finditer(text)]
+    matches += [(m, _to_float(m.group(1)) / 100) for m in CENT_PATTERN.finditer(text)]
+
+    per_unit, unmarked, totals = [], [], []
+    for m, amount in matches:
+        before, after = _clause_around(text, m.start(), m.end())
+        if UNIT_PATTERN.search(after) or UNIT_PATTERN.search(before):
+            per_unit.append((m.start(), amount))
+        elif TOTAL_PATTERN.search(after) or TOTAL_PATTERN.search(before):
+            totals.append((m.start(), amount))
+        else:
+            unmarked.append((m.start(), amount))
+
+    if per_unit or unmarked:
+        unit_price = max(per_unit or unmarked)[1]
+    elif totals and quantity:
+        unit_price = round(max(totals)[1] / quantity, 4)
+    else:
+        unit_price = None
+
+    leads = [(m.start(), int(m.group(1))) for m in LEAD_DAYS_PATTERN.finditer(text)]
+    lowered = text.lower()
+    for word, days in LEAD_WORDS.items():
+        pos = lowered.rfind(word)
+        if pos != -1:
+            leads.append((pos, days))
+
+    return {
+        "unit_price_eur": unit_price,
+        "lead_days": max(leads)[1] if leads else None,
+    }
+
+
+def rank_quotes(quotes, target_price=None):
+    """
+    Orders quotes best-first: priced offers by unit price, then lead time.
+
+    Adds `vs_target_pct` (positive = above the contract price) when a target is known.
+    """
+    for quote in quotes:
+        price = quote.get("unit_price_eur")
+        if target_price and price is not None:
+            quote["vs_target_pct"] = round((price - target_price) / target_price * 100, 1)
+
+    def key(quote):
+        price = quote.get("unit_price_eur")
+        lead = quote.get("lead_days")
+        return (price is None, price if price is not None else 0, lead if lead is not None else 999)
+
+    return sorted(quotes, key=key)
+
+
+def negotiate(vendors, call_vendor, max_concurrency=MAX_CONCURRENT_CALLS, deadline=CALL_DEADLINE, target_price=None,
+              quantity=None):
+    """
+    Calls all vendors concurrently and returns their ranked quotes.
+
+    Every call gets its own budget (DETECT_DEADLINE for the call to start plus
+    `deadline` for the call itself), counted from when it leaves the queue.
+    Calls beyond the concurrency cap run in later waves, so the overall wait is
+    one budget per wave.
+
+    Args:
+        vendors: List of vendor dicts (must contain 'store_name')
+        call_vendor: Callable(vendor) -> transcript text; runs one voice call
+        max_concurrency: Maximum number of simultaneous calls
+        deadline: Seconds a started call may take before it is reported as a straggler
+        target_price: Contract unit price to rank against (EUR)
+        quantity: Ordered quantity (turns quoted totals into unit prices)
+
+    Returns:
+        list: Quote dicts, best first
+    """
+    if not vendors:
+        return []
+
+    def run(vendor):
+        started = time.time()
+        transcript = call_vendor(vendor)
+        return {**extract_quote(transcript, quantity), "call_secs": round(time.time() - started)}
+
+    per_call = DETECT_DEADLINE + deadline
+    waves = math.ceil(len(vendors) / max_concurrency)
+    # Not a context manager: leaving it would block on calls that overran the deadline
+    pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="vendor-call")
+    futures = {pool.submit(run, vendor): vendor for vendor in vendors}
+    done, not_done = wait(futures, timeout=waves * per_call)
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    quotes = []
+    for future, vendor in futures.items():
+        quote = {"vendor": vendor["store_name"], "unit_price_eur": None, "lead_days": None}
+        if future in not_done:
+            quote["status"] = "no result before deadline"
+        elif future.exception() is not None:
+            quote["status"] = f"failed: {str(future.exception())[:100]}"
+        else:
+            quote.update(future.result(), status="quoted" if future.result()["unit_price_eur"] is not None else "no price found")
+        quotes.append(quote)
+    return rank_quotes(quotes, target_price)
+
+
+def format_quotes(quotes):
+    """Renders ranked quotes as a compact table for Claude."""
+    lines = ["rank | vendor | unit_price_eur | vs_contract | lead_days | status"]
+    for rank, q in enumerate(quotes, 1):
+        price = f"{q['unit_price_eur']:.2f}" if q.get("unit_price_eur") is not None else "-"
+        vs = f"{q['vs_target_pct']:+.1f}%" if "vs_target_pct" in q else "-"
+        lead = q["lead_days"] if q.get("lead_days") is not None else "-"
+        lines.append(f"{rank} | {q['vendor']} | {price} | {vs} | {lead} | {q.get('status', '')}")
+    return "\n".join(lines)
@@ -0,0 +1,231 @@
+"""
+Durable outbox for order emails.
+
+Tool calls no longer talk to the SMTP server. They write the rendered email to
+outbox.db and return at once; a background worker delivers queued emails and
+retries failures with exponential backoff. Every email carries an idempotency
+key (e.g. the Claude tool_use id plus the recipient), so a retried or replayed
+tool call cannot queue the same purchase order twice.
+
+A worker claims an email by setting it to 'sending' with a lease. Several
+processes (Streamlit servers, CLI scripts) can share outbox.db: claims are
+conditional updates, and an email that is 'sending' is only picked up again
+once its lease has expired. Delivery is at-least-once: an email whose sender
+died mid-send goes out again after LEASE_SECONDS.
+"""
+import email
+import sqlite3
+import threading
+import time
+
+OUTBOX_PATH = "outbox.db"
+MAX_ATTEMPTS = 8
+RETRY_BASE = 30  # seconds; doubles after every failed attempt
+RETRY_CAP = 60 * 60
+LEASE_SECONDS = 5 * 60  # a 'sending' email is reclaimed after this long
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT UNIQUE,
+    to_email TEXT NOT NULL,
+    subject TEXT,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at);
+"""
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next delivery attempt."""
+    return min(RETRY_CAP, RETRY_BASE * 2 ** (attempts - 1))
+
+
+class Outbox:
+    """SQLite-backed email queue with one delivery worker thread."""
+
+    def __init__(self, path=OUTBOX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._send = None
+        self._worker = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        if "lease_until" not in columns:
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN lease_until REAL")
+        # Emails whose sender stopped mid-send go out again; another process may
+        # still be sending the rest, so only expired leases are reset
+        self._conn.execute(
+            "UPDATE outbox SET status = 'queued' WHERE status = 'sending' AND (lease_until IS NULL OR lease_until < ?)",
+            (time.time(),),
+        )
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def start(self, send):
+        """
+        Starts the delivery worker.
+
+        Args:
+            send: Callable taking an email.message.Message; raises on failure
+        """
+        self._send = send
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work, daemon=True, name="outbox-worker")
+                self._worker.start()
+        self._wake.set()
+
+    def enqueue(self, message, idempotency_key=None):
+        """
+        Queues an email for delivery.
+
+        Args:
+            message: email.message.Message with a To header
+            idempotency_key: Optional key; a second enqueue with the same key is ignored
+
+        Returns:
+            dict: The outbox row, with 'duplicate' set if the key was already queued
+        """
+        return self.enqueue_many([(message, idempotency_key)])[0]
+
+    def enqueue_many(self, items):
+        """
+        Queues several emails in one transaction: either all are queued or none.
+
+        Args:
+            items: List of (message, idempotency_key or None)
+
+        Returns:
+            list: One outbox row per item, as returned by enqueue()
+        """
+        now = time.time()
+        rows = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for message, idempotency_key in items:
+                    cursor = self._conn.execute(
+                        "INSERT OR IGNORE INTO outbox (idempotency_key, to_email, subject, message, next_attempt_at, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (idempotency_key, message["To"], message["Subject"], message.as_string(), now, now),
+                    )
+                    if cursor.rowcount:
+                        row = self._conn.execute("SELECT * FROM outbox WHERE id = ?", (cursor.lastrowid,)).fetchone()
+                    else:
+                        row = self._conn.execute("SELECT * FROM outbox WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+                    rows.append({**self._public(row), "duplicate": not cursor.rowcount})
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._wake.set()
+        return rows
+
+    @staticmethod
+    def _public(row):
+        return {key: row[key] for key in row.keys() if key != "message"}
+
+    def get(self, outbox_id):
+        """Returns an outbox row (without the message body), or None."""
+        rows = self._execute("SELECT * FROM outbox WHERE id = ?", (outbox_id,))
+        return self._public(rows[0]) if rows else None
+
+    def counts(self):
+        """Returns the number of emails per status."""
+        return dict(self._execute("SELECT status, COUNT(*) FROM outbox GROUP BY status"))
+
+    def failed(self, limit=20):
+        """Returns emails that gave up after MAX_ATTEMPTS, newest first."""
+        rows = self._execute("SELECT * FROM outbox WHERE status = 'failed' ORDER BY id DESC LIMIT ?", (limit,))
+        return [self._public(row) for row in rows]
+
+    def _claim_due(self):
+        """Leases the next due email; a conditional update, so two processes never claim the same row."""
+        due = (
+            "(status = 'queued' AND next_attempt_at <= ?) OR (status = 'sending' AND lease_until < ?)"
+        )
+        with self._lock:
+            while True:
+                now = time.time()
+                row = self._conn.execute(
+                    f"SELECT * FROM outbox WHERE {due} ORDER BY id LIMIT 1", (now, now)
+                ).fetchone()
+                if row is None:
+                    return None
+                claimed = self._conn.execute(
+                    f"UPDATE outbox SET status = 'sending', lease_until = ? WHERE id = ? AND ({due})",
+                    (now + LEASE_SECONDS, row["id"], now, now),
+                ).rowcount
+                if claimed:
+                    return row
+
+    def _next_due_in(self):
+        rows = self._execute(
+            "SELECT MIN(CASE status WHEN 'queued' THEN next_attempt_at ELSE lease_until END) "
+            "FROM outbox WHERE status IN ('queued', 'sending')"
+        )
+        due = rows[0][0]
+        return None if due is None else max(0.0, due - time.time())
+
+    def _work(self):
+        while True:
+            # Cleared before looking, so an enqueue during the lookup still wakes us
+            self._wake.clear()
+            row = self._claim_due()
+            if row is None:
+                self._wake.wait(timeout=self._next_due_in())
+                continue
+            self._deliver(row)
+
+    def _deliver(self, row):
+        attempts = row["attempts"] + 1
+        try:
+            self._send(email.message_from_string(row["message"]))
+        except Exception as e:
+            error = str(e)[:500]
+            if attempts >= MAX_ATTEMPTS:
+                print(f"[WARN] Outbox email {row['id']} to {row['to_email']} failed permanently: {error}")
+                self._execute(
+                    "UPDATE outbox SET status = 'failed', attempts = ?, last_error = ?, lease_until = NULL WHERE id = ?",
+                    (attempts, error, row["id"]),
+                )
+            else:
+                delay = retry_delay(attempts)
+                print(f"[WARN] Outbox email {row['id']} failed (attempt {attempts}); retrying in {delay}s: {error}")
+                self._execute(
+                    "UPDATE outbox SET status = 'queued', attempts = ?, last_error = ?, next_attempt_at = ?, lease_until = NULL WHERE id = ?",
+                    (attempts, error, time.time() + delay, row["id"]),
+                )
+            return
+        self._execute(
+            "UPDATE outbox SET status = 'sent', attempts = ?, last_error = NULL, sent_at = ?, lease_until = NULL WHERE id = ?",
+            (attempts, time.time(), row["id"]),
+        )
+        print(f"[INFO] Outbox email {row['id']} sent to {row['to_email']}")
+
+
+_outbox_instance = None
+_instance_lock = threading.Lock()
+
+
+def get_outbox():
+    """Returns the process-wide outbox."""
+    global _outbox_instance
+    with _instance_lock:
+        if _outbox_instance is None:
+            _outbox_instance = Outbox()
+        return _outbox_instance
@@ -0,0 +1,84 @@
+"""
+Parallel, cached text extraction for contract PDFs.
+
+pypdf's text extraction is pure Python and CPU-bound, so long framework
+agreements are split into one contiguous page range per worker and extracted
+in a process pool; each worker parses the PDF once. The pool uses the "spawn"
+start method: the Streamlit process runs job, outbox and webhook threads, and
+forking a multithreaded process can deadlock the child. Page texts are joined
+once at the end. Results are cached on disk by the SHA-256 of the file, so
+re-uploading the same contract skips extraction entirely.
+"""
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pypdf
+
+from disk_cache import DiskCache, make_key
+
+PARALLEL_MIN_PAGES = 16  # smaller documents are not worth starting workers for
+MIN_CHUNK_PAGES = 8  # every chunk re-parses the PDF, so keep ranges large
+MAX_WORKERS = max(1, min(8, (os.cpu_count() or 1)))
+CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+cache = DiskCache("pdf_text", max_bytes=CACHE_MAX_BYTES)
+
+
+def _page_text(page):
+    return page.extract_text() or ""
+
+
+def _extract_range(pdf_bytes, start, end):
+    """Worker: extracts pages [start, end) and returns (start, texts)."""
+    reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
+    return start, [_page_text(reader.pages[i]) for i in range(start, end)]
+
+
+def extract_text(pdf_bytes, on_progress=None, max_workers=MAX_WORKERS):
+    """
+    Extracts the text of a PDF, one line break after each page.
+
+    Args:
+        pdf_bytes: The PDF file content
+        on_progress: Optional callback(pages_done, total_pages)
+        max_workers: Process pool size
+
+    Returns:
+        str: Extracted text
+    """
+    key = make_key(pdf_bytes, f"pypdf-{pypdf.__version__}")
+    text = cache.get(key)
+    if text is not None:
+        return text
+
+    reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
+    total = len(reader.pages)
+    pages = [""] * total
+
+    if total < PARALLEL_MIN_PAGES or max_workers <= 1:
+        for i, page in enumerate(reader.pages):
+            pages[i] = _page_text(page)
+            if on_progress:
+                on_progress(i + 1, total)
+    else:
+        done = 0
+        chunk_pages = max(MIN_CHUNK_PAGES, -(-total // max_workers))
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+            futures = [
+                pool.submit(_extract_range, pdf_bytes, start, min(start + chunk_pages, total))
+                for start in range(0, total, chunk_pages)
+            ]
+            for future in as_completed(futures):
+                start, texts = future.result()
+                pages[start:start + len(texts)] = texts
+                done += len(texts)
+                if on_progress:
+                    on_progress(done, total)
+
+    text = "".join(f"{page}\n" for page in pages)
+    cache.set(key, text)
+    print(f"[INFO] Extracted {total} PDF pages ({len(text)} chars)")
+    return text
@@ -0,0 +1,103 @@
+"""
+Reorder planning for the inventory pre-check.
+
+Instead of sending Claude the raw inventory table to scan, the pre-check runs
+this planner: inventory is joined with contracts on product_id and the reorder
+quantities are computed column-wise with pandas/NumPy, so the cost is a single
+merge even for very large catalogs. Claude receives only the rows that need
+reordering.
+
+Model per item (storage = share of the storage space in use):
+- capacity    = on_hand / storage (units the storage space holds)
+- target fill = TARGET_FILL, plus LEAD_FILL_PER_DAY per contract delivery day
+                (slow suppliers need more buffer), capped at MAX_FILL
+- suggested   = capacity * target fill - on_hand
+- contract    = min(suggested, contract headroom (quantity - used) of the
+                product's contract line with the most left)
+- local store = the rest
+"""
+import numpy as np
+import pandas as pd
+
+REORDER_THRESHOLD = 0.05  # reorder items whose storage share is below this
+TARGET_FILL = 0.6
+LEAD_FILL_PER_DAY = 0.02
+MAX_FILL = 0.9
+STORAGE_COLUMN = "storage (% used)"
+PLAN_MAX_ROWS = 50
+
+PLAN_COLUMNS = [
+    "product_id", "product_name", "unit", "on_hand", "storage", "suggested",
+    "contract_qty", "local_qty", "unit_price_eur", "delivery_days", "contract_cost_eur", "note",
+]
+
+
+def plan_reorders(inventory, contracts, threshold=REORDER_THRESHOLD, target_fill=TARGET_FILL):
+    """
+    Computes reorder quantities for items below the storage threshold.
+
+    Args:
+        inventory: Inventory DataFrame (product_id, product_name, unit, quantity, storage (% used))
+        contracts: Contracts DataFrame with `used` already up to date
+        threshold: Storage share below which an item is reordered
+        target_fill: Storage share to refill to (before the lead-time buffer)
+
+    Returns:
+        DataFrame: One row per item to reorder (PLAN_COLUMNS), lowest storage first
+    """
+    storage = pd.to_numeric(inventory[STORAGE_COLUMN], errors="coerce")
+    low = inventory.loc[storage < threshold, ["product_id", "product_name", "unit", "quantity"]]
+    low = low.assign(storage=storage[storage < threshold]).rename(columns={"quantity": "on_hand"})
+    if low.empty:
+        return pd.DataFrame(columns=PLAN_COLUMNS)
+
+    # A product can be on several contracts; plan with the line place_order
+    # would use (the one with the most left, as in utils.resolve_basket)
+    terms = (
+        contracts.assign(_left=contracts["quantity"] - contracts["used"])
+        .sort_values("_left", ascending=False, kind="stable")
+        .drop_duplicates("product_id")[["product_id", "quantity", "used", "unit_price_eur", "delivery_days"]]
+    )
+    plan = low.merge(terms, on="product_id", how="left")
+
+    on_hand = pd.to_numeric(plan["on_hand"], errors="coerce").fillna(0).to_numpy(dtype=float)
+    share = plan["storage"].to_numpy(dtype=float)
+    delivery_days = pd.to_numeric(plan["delivery_days"], errors="coerce").to_numpy(dtype=float)
+    headroom = np.clip((plan["quantity"] - plan["used"]).to_numpy(dtype=float), 0, None)
+    has_contract = ~np.isnan(headroom)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        capacity = np.where(share > 0, on_hand / share, np.nan)
+    fill = np.minimum(MAX_FILL, target_fill + LEAD_FILL_PER_DAY * np.nan_to_num(delivery_days))
+    suggested = np.ceil(np.clip(capacity * fill - on_hand, 0, None))
+    known = ~np.isnan(suggested)
+
+    contract_qty = np.where(has_contract & known, np.minimum(suggested, np.nan_to_num(headroom)), 0)
+    local_qty = np.where(known, np.nan_to_num(suggested) - contract_qty, 0)
+
+    plan["suggested"] = np.where(known, suggested, np.nan)
+    plan["contract_qty"] = contract_qty.astype(int)
+    plan["local_qty"] = local_qty.astype(int)
+    plan["contract_cost_eur"] = np.round(contract_qty * plan["unit_price_eur"].fillna(0).to_numpy(dtype=float), 2)
+    plan["note"] = np.select(
+        [~known, ~has_contract, (local_qty > 0) & (contract_qty == 0), local_qty > 0],
+        ["storage empty, capacity unknown", "no contract", "contract exhausted", "exceeds contract headroom"],
+        default="",
+    )
+    return plan.sort_values("storage", kind="stable")[PLAN_COLUMNS].reset_index(drop=True)
+
+
+def format_plan(plan, max_rows=PLAN_MAX_ROWS):
+    """Renders a reorder plan as a compact tab-separated table for Claude."""
+    if plan.empty:
+        return "No items need reordering."
+    head = plan.head(max_rows)
+    shown = head.assign(
+        storage=(head["storage"] * 100).round(1).astype(str) + "%",
+        suggested=head["suggested"].map(lambda v: "?" if pd.isna(v) else str(int(v))),
+        delivery_days=head["delivery_days"].map(lambda v: "-" if pd.isna(v) else str(int(v))),
+    ).drop(columns=["unit_price_eur"])
+    text = shown.to_csv(sep="\t", index=False).strip()
+    if len(plan) > max_rows:
+        text += f"\n... {len(plan) - max_rows} more items (lowest storage shown first)"
+    return text
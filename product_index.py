@@ -0,0 +1,190 @@
+"""
+Fuzzy product-name index over the contract lines and the sample.csv catalog.
+
+Names are normalized before indexing: lowercased, umlauts folded, German terms
+mapped to their English equivalent (Schraube -> screw, Dübel -> anchor), plurals
+stripped and tokens sorted. "TX20 screws 4x40", "Screws TX20 4x40" and
+"Schraube TX20 4x40" therefore all normalize to the same key.
+
+Lookups go through a trigram inverted index, so only names sharing at least one
+trigram with the query are scored, instead of scanning every row.
+"""
+import heapq
+import re
+import threading
+
+import catalog
+
+# German (umlaut-folded) and English variants -> canonical English tokens
+SYNONYMS = {
+    "schraube": "screw", "schrauben": "screw",
+    "duebel": "anchor", "dowel": "anchor",
+    "unterlegscheibe": "washer", "mutter": "nut",
+    "nagel": "nail", "naegel": "nail",
+    "kabelbinder": "cable tie",
+    "isolierband": "insulating tape",
+    "installationsdraht": "installation wire",
+    "arbeitshandschuhe": "work glove", "handschuh": "glove", "handschuhe": "glove",
+    "schutzbrille": "safety glasses",
+    "warnweste": "safety vest",
+    "malervlies": "painter fleece", "vlies": "fleece",
+    "abdeckfolie": "cover foil", "baufolie": "construction foil", "folie": "foil",
+    "panzertape": "duct tape", "gewebeband": "duct tape", "klebeband": "tape",
+    "markierspray": "marking spray",
+    "bohrer": "drill bit",
+    "schleifpapier": "sandpaper",
+    "pu-schaum": "pu foam", "schaum": "foam", "montageschaum": "pu foam",
+    "muellsack": "trash bag", "muellsaecke": "trash bag",
+    "baustellenlampe": "led site lamp", "lampe": "lamp",
+    "verlaengerungskabel": "extension cable",
+    "bauhelm": "hard hat", "helm": "hard hat",
+    "spanngurt": "ratchet strap",
+    "schwarz": "black", "rot": "red", "blau": "blue", "gruen": "green",
+    "gelb": "yellow", "weiss": "white", "grau": "grey", "klar": "clear",
+    "gross": "large", "klein": "small",
+}
+
+UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+
+# Size markers that carry no meaning once the number is its own token
+STOP_TOKENS = {"gr", "size", "x", "and", "und"}
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-x][a-z0-9]+)*")
+# "8 mm" -> "8mm", so sizes match however they were typed
+UNIT_RE = re.compile(r"(\d)\s+(mm|cm|m|l)\b")
+
+
+def _singular(token):
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss") and not token[-2].isdigit():
+        return token[:-1]
+    return token
+
+
+def normalize_tokens(name):
+    """Returns the canonical token list for a product name."""
+    text = UNIT_RE.sub(r"\1\2", str(name).lower().translate(UMLAUTS))
+    tokens = []
+    for raw in TOKEN_RE.findall(text):
+        mapped = SYNONYMS.get(raw) or SYNONYMS.get(_singular(raw))
+        for token in (mapped.split() if mapped else [raw]):
+            token = _singular(token)
+            if token not in STOP_TOKENS:
+                tokens.append(token)
+    return sorted(set(tokens))
+
+
+def _trigrams(tokens):
+    grams = set()
+    for token in tokens:
+        padded = f" {token} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+class ProductIndex:
+    """Trigram inverted index with ranked top-k lookup."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self._tokens = []
+        self._grams = []
+        self._postings = {}
+        for pos, entry in enumerate(entries):
+            tokens = normalize_tokens(entry["name"])
+            grams = _trigrams(tokens)
+            self._tokens.append(set(tokens))
+            self._grams.append(grams)
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(pos)
+
+    def search(self, query, top_k=5, source=None, min_score=0.0):
+        """
+        Finds the best-matching products for a free-text query.
+
+        Args:
+            query: Product name or description (German or English)
+            top_k: Number of results to return
+            source: Restrict to 'contracts' or 'catalog'; None searches both
+            min_score: Drop results scoring below this (0..1)
+
+        Returns:
+            list of (score, entry) tuples, best first
+        """
+        q_tokens = set(normalize_tokens(query))
+        q_grams = _trigrams(q_tokens)
+        if not q_grams:
+            return []
+
+        shared = {}
+        for gram in q_grams:
+            for pos in self._postings.get(gram, ()):
+                shared[pos] = shared.get(pos, 0) + 1
+
+        scored = []
+        for pos, n_shared in shared.items():
+            entry = self.entries[pos]
+            if source and entry["source"] != source:
+                continue
+            dice = 2 * n_shared / (len(q_grams) + len(self._grams[pos]))
+            # Fraction of query tokens found verbatim rewards exact sizes like 4x40
+            coverage = len(q_tokens & self._tokens[pos]) / len(q_tokens)
+            score = 0.5 * dice + 0.5 * coverage
+            if score >= min_score:
+                scored.append((score, pos))
+
+        best = heapq.nlargest(top_k, scored)
+        return [(round(score, 3), self.entries[pos]) for score, pos in best]
+
+
+def _build_entries(contracts_df, sample_df):
+    entries = []
+    if contracts_df is not None:
+        for row in contracts_df.to_dict("records"):
+            entries.append({
+                "source": "contracts",
+                "id": row.get("product_id"),
+                "name": row.get("product_name"),
+                "unit": row.get("unit"),
+                "unit_price_eur": row.get("unit_price_eur"),
+                "supplier": row.get("supplier_id"),
+            })
+    if sample_df is not None:
+        for row in sample_df.to_dict("records"):
+            entries.append({
+                "source": "catalog",
+                "id": row.get("artikel_id"),
+                "name": row.get("artikelname"),
+                "unit": row.get("einheit"),
+                "unit_price_eur": row.get("preis_eur"),
+                "supplier": row.get("lieferant"),
+            })
+    return entries
+
+
+_cache = {"key": None, "index": None}
+_cache_lock = threading.Lock()
+
+
+def get_index(use_sqlite=False):
+    """Returns the shared index, rebuilding it when the source data changed."""
+    if use_sqlite:
+        import database
+        # Bumped by triggers when product names, prices or suppliers change
+        key = ("sqlite", database.data_version(("contracts", "sample")))
+        load = lambda: (database.read_table("contracts"), database.read_table("sample"))
+    else:
+        contracts, sample = catalog.get_table("contracts"), catalog.get_table("sample")
+        key = ("csv", contracts.signature, sample.signature)
+        load = lambda: (contracts.df, sample.df)
+
+    with _cache_lock:
+        if _cache["key"] != key:
+            _cache["index"] = ProductIndex(_build_entries(*load()))
+            _cache["key"] = key
+        return _cache["index"]
+
+
+def search(query, top_k=5, source=None, min_score=0.0, use_sqlite=False):
+    """Module-level shortcut for get_index().search()."""
+    return get_index(use_sqlite).search(query, top_k=top_k, source=source, min_score=min_score)
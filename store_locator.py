@@ -0,0 +1,349 @@
+"""
+Nearest local vendor lookup.
+
+Stores come from local_stores.csv (the vendors we have phone numbers for), an
+optional local OSM extract (Overpass JSON saved to osm_stores.json) and
+Overpass responses cached on disk. Overpass is queried per rounded tile and
+radius, so repeated lookups around the same site never hit the public API
+again. Without network access the locator answers from the CSV, the extract
+and whatever tiles are cached.
+
+All stores are put into a fixed-size lat/lon grid. A k-nearest query scans
+rings of grid cells outward from the query point and stops once no unscanned
+cell can hold anything closer than the current k-th result.
+
+For many sites at once, nearest_for_sites() computes the full site x store
+haversine matrix with NumPy (in blocks of sites) and picks the top k per row.
+Optionally only those candidates are refined with the exact WGS-84 geodesic.
+"""
+import heapq
+import json
+import math
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import numpy as np
+
+import catalog
+from disk_cache import DiskCache
+
+DEFAULT_SITE = (48.12364444691372, 11.600215507421492)  # construction site in Munich
+OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+OVERPASS_TIMEOUT = 25  # seconds
+OSM_EXTRACT_PATH = "osm_stores.json"
+SHOP_TAGS = ["doityourself", "hardware", "trade", "building_materials"]
+TILE_DEG = 0.05  # Overpass cache tile (about 5.5 x 3.7 km in Munich)
+RADIUS_STEP_M = 1000
+TILE_TTL = 7 * 24 * 3600  # refetch tiles older than a week (stale tiles are still used offline)
+GRID_DEG = 0.02  # spatial index cell size
+EARTH_RADIUS_KM = 6371.0088
+MATRIX_BLOCK_CELLS = 4_000_000  # site x store distances held in memory at once (32 MB as float64)
+# Haversine on the mean sphere is within 0.6% of the WGS-84 geodesic, so any
+# store that can make the geodesic top k is within this factor of the k-th
+# haversine distance
+GEODESIC_SLACK = 1.012
+
+tile_cache = DiskCache("overpass", max_bytes=50 * 1024 * 1024)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlam = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlam / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def haversine_matrix(site_lats, site_lons, store_lats, store_lons):
+    """
+    Great-circle distances between every site and every store.
+
+    Returns:
+        np.ndarray: Distances in kilometres, shape (sites, stores)
+    """
+    phi1 = np.radians(np.asarray(site_lats, dtype=float))[:, None]
+    lam1 = np.radians(np.asarray(site_lons, dtype=float))[:, None]
+    phi2 = np.radians(np.asarray(store_lats, dtype=float))[None, :]
+    lam2 = np.radians(np.asarray(store_lons, dtype=float))[None, :]
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin((lam2 - lam1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def geodesic_km(lat1, lon1, lat2, lon2):
+    """Exact WGS-84 distance in kilometres (requires geopy)."""
+    from geopy.distance import geodesic  # optional dependency, only needed for refinement
+
+    return geodesic((lat1, lon1), (lat2, lon2)).km
+
+
+def tile_key(lat, lon, radius_m):
+    """Rounds a query to its cache tile: (tile centre lat, tile centre lon, radius)."""
+    tile_lat = (math.floor(lat / TILE_DEG) + 0.5) * TILE_DEG
+    tile_lon = (math.floor(lon / TILE_DEG) + 0.5) * TILE_DEG
+    radius = int(math.ceil(radius_m / RADIUS_STEP_M) * RADIUS_STEP_M)
+    return round(tile_lat, 4), round(tile_lon, 4), radius
+
+
+def _tile_cache_key(tile):
+    return "tile_{}_{}_{}".format(*tile).replace(".", "p").replace("-", "m")
+
+
+def fetch_overpass(lat, lon, radius_m, max_age=TILE_TTL):
+    """
+    Returns the OSM hardware stores of the tile around (lat, lon).
+
+    The tile is queried with its own centre and the radius enlarged by half
+    the tile diagonal, so every point in the tile is covered.
+
+    Returns:
+        list: Overpass elements ([] if the tile is neither cached nor reachable)
+    """
+    tile = tile_key(lat, lon, radius_m)
+    key = _tile_cache_key(tile)
+    cached = tile_cache.get(key)
+    if cached is not None and time.time() - cached["fetched_at"] < max_age:
+        return cached["elements"]
+
+    tile_lat, tile_lon, radius = tile
+    half_diagonal_m = haversine_km(tile_lat, tile_lon, tile_lat + TILE_DEG / 2, tile_lon + TILE_DEG / 2) * 1000
+    around = f"around:{int(radius + half_diagonal_m)},{tile_lat},{tile_lon}"
+    selectors = "".join(f'nwr["shop"="{tag}"]({around});' for tag in SHOP_TAGS)
+    query = f"[out:json][timeout:{OVERPASS_TIMEOUT}];({selectors});out center tags;"
+    try:
+        request = urllib.request.Request(
+            OVERPASS_URL, data=urllib.parse.urlencode({"data": query}).encode(),
+            headers={"User-Agent": "nailed-it-store-locator"},
+        )
+        with urllib.request.urlopen(request, timeout=OVERPASS_TIMEOUT + 5) as response:
+            elements = json.load(response).get("elements", [])
+    except Exception as e:
+        print(f"[WARN] Overpass query failed ({e}); using {'stale cache' if cached else 'offline data'}")
+        return cached["elements"] if cached else []
+
+    tile_cache.set(key, {"fetched_at": time.time(), "elements": elements})
+    print(f"[INFO] Cached {len(elements)} OSM stores for tile {tile}")
+    return elements
+
+
+def osm_to_store(element):
+    """Converts an Overpass element to a store record, or None if it has no position."""
+    lat = element.get("lat", element.get("center", {}).get("lat"))
+    lon = element.get("lon", element.get("center", {}).get("lon"))
+    if lat is None or lon is None:
+        return None
+    tags = element.get("tags", {})
+    street = " ".join(filter(None, [tags.get("addr:street"), tags.get("addr:housenumber")]))
+    city = " ".join(filter(None, [tags.get("addr:postcode"), tags.get("addr:city")]))
+    return {
+        "store_id": f"osm:{element.get('type', 'node')}/{element['id']}",
+        "store_name": tags.get("name", "Unnamed Store"),
+        "address": ", ".join(filter(None, [street, city])),
+        "phone": tags.get("phone") or tags.get("contact:phone") or "",
+        "lat": float(lat),
+        "lon": float(lon),
+        "specialization": tags.get("shop", ""),
+        "source": "osm",
+    }
+
+
+class StoreLocator:
+    """Grid-indexed set of stores answering k-nearest queries."""
+
+    def __init__(self, stores, cell_deg=GRID_DEG):
+        self.stores = list(stores)
+        self.cell_deg = cell_deg
+        self._grid = {}
+        for pos, store in enumerate(self.stores):
+            self._grid.setdefault(self._cell(store["lat"], store["lon"]), []).append(pos)
+        rows = [i for i, _ in self._grid] or [0]
+        cols = [j for _, j in self._grid] or [0]
+        self._bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    @staticmethod
+    def _ring(ci, cj, r):
+        if r == 0:
+            yield ci, cj
+            return
+        for dj in range(-r, r + 1):
+            yield ci - r, cj + dj
+            yield ci + r, cj + dj
+        for di in range(-r + 1, r):
+            yield ci + di, cj - r
+            yield ci + di, cj + r
+
+    def nearest(self, lat, lon, k=1, max_km=None):
+        """
+        Returns up to k stores closest to (lat, lon).
+
+        Returns:
+            list: (distance_km, store) pairs, nearest first
+        """
+        if not self.stores or k <= 0:
+            return []
+        ci, cj = self._cell(lat, lon)
+        row_min, row_max, col_min, col_max = self._bounds
+        max_ring = max(abs(ci - row_min), abs(ci - row_max), abs(cj - col_min), abs(cj - col_max))
+        found = []
+        for r in range(max_ring + 1):
+            for cell in self._ring(ci, cj, r):
+                for pos in self._grid.get(cell, ()):
+                    store = self.stores[pos]
+                    found.append((haversine_km(lat, lon, store["lat"], store["lon"]), pos))
+            # Stores outside rings 0..r are at least r cells away along one axis;
+            # a degree of longitude is shortest at the far edge of the scanned band
+            far_lat = min(89.0, abs(lat) + (r + 1) * self.cell_deg)
+            bound = r * self.cell_deg * 111.0 * math.cos(math.radians(far_lat))
+            if max_km is not None and bound > max_km:
+                break
+            if len(found) >= k and heapq.nsmallest(k, found)[-1][0] <= bound:
+                break
+        return [
+            (dist, self.stores[pos]) for dist, pos in heapq.nsmallest(k, found)
+            if max_km is None or dist <= max_km
+        ]
+
+
+def load_known_stores(extra_elements=()):
+    """Stores from local_stores.csv, the local OSM extract and the given Overpass elements."""
+    stores = []
+    try:
+        for store in catalog.load_df("local_stores").to_dict("records"):
+            stores.append({**store, "source": "local_stores"})
+    except FileNotFoundError:
+        pass
+
+    elements = list(extra_elements)
+    if os.path.exists(OSM_EXTRACT_PATH):
+        with open(OSM_EXTRACT_PATH) as f:
+            elements += json.load(f).get("elements", [])
+
+    # Vendors from the CSV win over OSM entries at (almost) the same spot
+    taken = {(round(s["lat"], 3), round(s["lon"], 3)) for s in stores}
+    seen = set()
+    for element in elements:
+        store = osm_to_store(element)
+        if store is None or store["store_id"] in seen or (round(store["lat"], 3), round(store["lon"], 3)) in taken:
+            continue
+        seen.add(store["store_id"])
+        stores.append(store)
+    return stores
+
+
+_locators = {}
+_locators_lock = threading.Lock()
+
+
+def get_locator(lat=None, lon=None, radius_m=None, online=False):
+    """
+    Returns a locator over all known stores.
+
+    With online=True, the Overpass tile around (lat, lon) is added, fetched
+    only if it is not cached yet. The index is rebuilt when local_stores.csv
+    changes.
+    """
+    tile = tile_key(lat, lon, radius_m) if online and lat is not None else None
+    signature = (catalog.get_table("local_stores").signature, tile,
+                 os.path.getmtime(OSM_EXTRACT_PATH) if os.path.exists(OSM_EXTRACT_PATH) else None)
+    with _locators_lock:
+        locator = _locators.get(tile)
+        if locator is not None and locator[0] == signature:
+            return locator[1]
+    elements = fetch_overpass(lat, lon, radius_m) if tile else ()
+    locator = StoreLocator(load_known_stores(elements))
+    with _locators_lock:
+        _locators[tile] = (signature, locator)
+    return locator
+
+
+def nearest_vendors(lat, lon, k=3, max_km=None, online=False, radius_m=5000, callable_only=True):
+    """
+    Returns the k nearest vendors as store dicts with a `distance_km` field.
+
+    Args:
+        lat, lon: Site position
+        k: Number of vendors
+        max_km: Optional distance limit
+        online: Also look up OSM stores around the site (cached per tile)
+        radius_m: Overpass search radius when online
+        callable_only: Skip stores without a phone number
+    """
+    locator = get_locator(lat, lon, radius_m, online)
+    # Widen the search until enough stores with a phone number are found
+    want = k
+    while True:
+        candidates = locator.nearest(lat, lon, k=want, max_km=max_km)
+        vendors = [
+            {**store, "distance_km": round(dist, 2)} for dist, store in candidates
+            if not callable_only or str(store.get("phone") or "").strip()
+        ]
+        if len(vendors) >= k or len(candidates) < want:
+            return vendors[:k]
+        want *= 2
+
+
+def nearest_for_sites(sites, stores=None, k=3, max_km=None, refine=False, online=False,
+                      radius_m=5000, callable_only=True):
+    """
+    Returns the k nearest vendors for each of many sites.
+
+    Args:
+        sites: Sequence of (lat, lon) pairs
+        stores: Store dicts to choose from (default: all known stores)
+        k: Number of vendors per site
+        max_km: Optional distance limit
+        refine: Re-rank the haversine candidates by exact geodesic distance (requires geopy)
+        online: Also look up OSM stores around each site's tile (cached per tile)
+        radius_m: Overpass search radius when online
+        callable_only: Skip stores without a phone number
+
+    Returns:
+        list: For each site, a list of store dicts with a `distance_km` field, nearest first
+    """
+    sites = np.asarray(sites, dtype=float).reshape(-1, 2)
+    if stores is None:
+        elements = []
+        if online:
+            for tile in sorted({tile_key(lat, lon, radius_m) for lat, lon in sites}):
+                elements += fetch_overpass(tile[0], tile[1], radius_m)
+        stores = load_known_stores(elements)
+    if callable_only:
+        stores = [s for s in stores if str(s.get("phone") or "").strip()]
+    if not len(sites) or not stores or k <= 0:
+        return [[] for _ in range(len(sites))]
+
+    store_lats = np.array([s["lat"] for s in stores], dtype=float)
+    store_lons = np.array([s["lon"] for s in stores], dtype=float)
+    k = min(k, len(stores))
+    block = max(1, MATRIX_BLOCK_CELLS // len(stores))
+    results = []
+    for start in range(0, len(sites), block):
+        chunk = sites[start:start + block]
+        dist = haversine_matrix(chunk[:, 0], chunk[:, 1], store_lats, store_lons)
+        kth = np.partition(dist, k - 1, axis=1)[:, k - 1]
+        if refine:
+            candidates = dist <= (kth * GEODESIC_SLACK)[:, None]
+        else:
+            top = np.argpartition(dist, k - 1, axis=1)[:, :k]
+            candidates = np.zeros(dist.shape, dtype=bool)
+            np.put_along_axis(candidates, top, True, axis=1)
+
+        for (lat, lon), row, mask in zip(chunk, dist, candidates):
+            positions = np.flatnonzero(mask)
+            if refine:
+                ranked = sorted(
+                    (geodesic_km(lat, lon, store_lats[pos], store_lons[pos]), pos) for pos in positions
+                )[:k]
+            else:
+                ranked = sorted((row[pos], pos) for pos in positions)
+            results.append([
+                {**stores[pos], "distance_km": round(float(d), 2)} for d, pos in ranked
+                if max_km is None or d <= max_km
+            ])
+    return results
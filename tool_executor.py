@@ -0,0 +1,118 @@
+"""
+Concurrent execution of the tool_use blocks from one Claude message.
+
+Read-only tools and independent calls run in parallel on a thread pool.
+Mutating calls that touch the same product are chained and run in the order
+Claude issued them. A call that touches several products (place_order) joins
+every chain it overlaps into one. Results always come back in the original block order, so
+the tool_result messages line up with the tool_use blocks.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+# Tools without side effects on our data
+READ_ONLY_TOOLS = {"calculate", "read_csv", "query_dataset", "find_product", "check_local_store_call", "plan_reorders"}
+
+# Mutating tools -> input field that identifies the record they change
+MUTATING_TOOLS = {
+    "update_used": "product_id",
+    "send_order_email": "product_id",
+}
+
+# Mutating tools that change several records -> (list field, field per item)
+MULTI_MUTATING_TOOLS = {
+    "place_order": ("lines", "product_id"),
+}
+
+# Local store calls only queue background jobs, so they are independent of each
+# other and run concurrently.
+SERIAL_KEY = "*"
+
+MAX_WORKERS = 4
+
+
+def mutation_keys(tool_name, tool_input):
+    """Returns the serialization keys for a call; an empty set means it can run freely."""
+    tool_input = tool_input or {}
+    if tool_name in READ_ONLY_TOOLS:
+        return set()
+    if tool_name in MUTATING_TOOLS:
+        field = MUTATING_TOOLS[tool_name]
+        return {f"{field}:{tool_input.get(field)}"}
+    if tool_name in MULTI_MUTATING_TOOLS:
+        list_field, field = MULTI_MUTATING_TOOLS[tool_name]
+        items = tool_input.get(list_field)
+        if not isinstance(items, list):
+            return {SERIAL_KEY}
+        return {f"{field}:{(item or {}).get(field)}" for item in items} or {SERIAL_KEY}
+    if tool_name in ("call_local_store", "call_local_stores"):
+        return set()
+    # Unknown tools are treated conservatively and run one after another
+    return {SERIAL_KEY}
+
+
+def _safe_call(run_tool, tool_block):
+    try:
+        return run_tool(tool_block)
+    except Exception as e:
+        return f"Error: {e}"
+
+
+def _run_chain(run_tool, blocks):
+    return [_safe_call(run_tool, block) for block in blocks]
+
+
+def execute_tool_blocks(tool_blocks, run_tool, max_workers=MAX_WORKERS):
+    """
+    Runs a message's tool_use blocks and returns their results in order.
+
+    Args:
+        tool_blocks: tool_use blocks (objects with .name and .input)
+        run_tool: Callable taking one block and returning its result
+        max_workers: Thread pool size
+
+    Returns:
+        list: One result per block, in the same order as tool_blocks
+    """
+    if len(tool_blocks) <= 1:
+        return [_safe_call(run_tool, block) for block in tool_blocks]
+
+    # Group calls: each free call is its own task; keyed calls that share any
+    # key end up in one chain (union-find over chains, kept in issue order)
+    tasks = []
+    chain_of_key = {}
+    parent = {}
+
+    def find(chain):
+        while parent[chain] != chain:
+            parent[chain] = parent[parent[chain]]
+            chain = parent[chain]
+        return chain
+
+    for pos, block in enumerate(tool_blocks):
+        keys = mutation_keys(block.name, block.input)
+        if not keys:
+            tasks.append([pos])
+            continue
+        roots = {find(chain_of_key[key]) for key in keys if key in chain_of_key}
+        chain = min(roots) if roots else pos
+        parent.setdefault(chain, chain)
+        for other in roots:
+            parent[other] = chain
+        for key in keys:
+            chain_of_key[key] = chain
+        parent[pos] = chain
+    chains = {}
+    for pos in parent:
+        chains.setdefault(find(pos), []).append(pos)
+    tasks += [sorted(positions) for positions in chains.values()]
+
+    results = [None] * len(tool_blocks)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as pool:
+        futures = [
+            (positions, pool.submit(_run_chain, run_tool, [tool_blocks[p] for p in positions]))
+            for positions in tasks
+        ]
+        for positions, future in futures:
+            for pos, result in zip(positions, future.result()):
+                results[pos] = result
+    return results
@@ -0,0 +1,96 @@
+"""
+Benchmark: nearest vendors for many sites, per-pair geodesic loop vs. NumPy matrix.
+
+The loop is what get_location.py used to do for one site (geopy's geodesic
+for every store, then sort), repeated for every site. It is compared with
+store_locator.nearest_for_sites(), with and without geodesic refinement of
+the top k. Sites and stores are random points around Munich.
+
+    python tools/bench_distances.py --sites 50 --stores 2000 -k 3
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import store_locator  # noqa: E402
+
+
+def random_points(rng, n, center=store_locator.DEFAULT_SITE, spread_deg=0.3):
+    return np.column_stack([
+        center[0] + rng.uniform(-spread_deg, spread_deg, n),
+        center[1] + rng.uniform(-spread_deg, spread_deg, n),
+    ])
+
+
+def per_pair_loop(sites, stores, k):
+    """Per-site, per-store geodesic distance, then sort (the original approach)."""
+    from geopy.distance import geodesic
+
+    results = []
+    for lat, lon in sites:
+        distances = sorted(
+            (geodesic((lat, lon), (store["lat"], store["lon"])).km, i) for i, store in enumerate(stores)
+        )
+        results.append([i for _, i in distances[:k]])
+    return results
+
+
+def timed(label, fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<32} {best * 1000:>10.1f} ms")
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sites", type=int, default=24)
+    parser.add_argument("--stores", type=int, default=2000)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per method (best is reported)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    sites = random_points(rng, args.sites)
+    stores = [
+        {"store_id": f"S{i}", "store_name": f"Store {i}", "phone": "+49 89 000000", "lat": lat, "lon": lon}
+        for i, (lat, lon) in enumerate(random_points(rng, args.stores))
+    ]
+    print(f"{args.sites} sites x {args.stores} stores, k={args.k}\n")
+
+    def ids(batch):
+        return [[int(v["store_id"][1:]) for v in vendors] for vendors in batch]
+
+    matrix, matrix_time = timed(
+        "NumPy haversine matrix", lambda: store_locator.nearest_for_sites(sites, stores, k=args.k), args.repeat
+    )
+    try:
+        import geopy  # noqa: F401
+    except ImportError:
+        print("\n[WARN] geopy is not installed; skipping the geodesic loop and refinement")
+        return
+
+    refined, refined_time = timed(
+        "NumPy + geodesic refinement",
+        lambda: store_locator.nearest_for_sites(sites, stores, k=args.k, refine=True),
+        args.repeat,
+    )
+    loop, loop_time = timed("Per-pair geodesic loop", lambda: per_pair_loop(sites, stores, args.k), 1)
+
+    print(f"\nSpeedup: {loop_time / matrix_time:.0f}x (haversine), {loop_time / refined_time:.0f}x (refined)")
+    same_nearest = sum(a[0] == b[0] for a, b in zip(ids(matrix), loop))
+    print(f"Haversine nearest store matches geodesic: {same_nearest}/{len(loop)} sites")
+    print(f"Refined top-{args.k} identical to geodesic loop: {ids(refined) == loop}")
+
+
+if __name__ == "__main__":
+    main()
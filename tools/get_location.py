@@ -1,70 +1,49 @@
-import requests
-from geopy.distance import geodesic
+"""
+Find the hardware stores nearest to a location.
 
-# 1. Your Location
-current_lat = 48.12364444691372
-current_lon = 11.600215507421492
-
-
-def find_nearest_store_osm(lat, lon):
-    # Overpass API URL (Public instance)
-    overpass_url = "http://overpass-api.de/api/interpreter"
-
-    # 2. Construct the Query
-    # We ask for nodes of type "shop=supermarket" or "shop=convenience"
-    # around 1000 meters of your location.
-    overpass_query = f"""
-    [out:json];
-    (
-      node["shop"="supermarket"](around:1000, {lat}, {lon});
-      node["shop"="convenience"](around:1000, {lat}, {lon});
-    );
-    out body;
-    """
-
-    print("Querying OpenStreetMap...")
-    try:
-        response = requests.get(overpass_url, params={'data': overpass_query})
-        data = response.json()
-
-        stores = []
+Uses the cached store locator (store_locator.py): local_stores.csv, an optional
+OSM extract and Overpass responses cached per tile. Pass --online to query
+OpenStreetMap for tiles that are not cached yet.
 
-        # 3. Parse and Calculate Distance
-        for element in data['elements']:
-            name = element.get('tags', {}).get('name', 'Unnamed Store')
-            store_lat = element['lat']
-            store_lon = element['lon']
+    python tools/get_location.py                      # default site, offline
+    python tools/get_location.py 48.137 11.575 -k 5 --online
+"""
+import argparse
+import os
+import sys
 
-            # Calculate exact distance in meters
-            dist = geodesic((lat, lon), (store_lat, store_lon)).meters
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-            stores.append(
-                {
-                    "name": name,
-                    "distance": dist,
-                    "lat": store_lat,
-                    "lon": store_lon
-                }
-            )
+import store_locator  # noqa: E402
 
-        # 4. Sort by nearest
-        if stores:
-            stores.sort(key=lambda x: x['distance'])
-            nearest = stores[0]
-
-            print(f"\n--- Nearest Store Found (Free!) ---")
-            print(f"Name:     {nearest['name']}")
-            print(f"Distance: {int(nearest['distance'])} meters")
-            print(f"Location: {nearest['lat']}, {nearest['lon']}")
-            print(
-                f"Link:     https://www.openstreetmap.org/node/{data['elements'][0]['id']}"
-            )
-        else:
-            print("No stores found within 1000m.")
-
-    except Exception as e:
-        print(f"Error: {e}")
-
-
-# Run it
-find_nearest_store_osm(current_lat, current_lon)
+# 1. Your Location
+current_lat, current_lon = store_locator.DEFAULT_SITE
+
+
+def find_nearest_store_osm(lat, lon, k=1, radius_m=1000, online=True):
+    """Prints and returns the k nearest stores around (lat, lon)."""
+    vendors = store_locator.nearest_vendors(lat, lon, k=k, online=online, radius_m=radius_m, callable_only=False)
+    if not vendors:
+        print(f"No stores found (radius {radius_m} m{'' if online else ', offline'}).")
+        return vendors
+
+    for vendor in vendors:
+        print(f"\n--- {vendor['store_name']} ---")
+        print(f"Distance: {int(vendor['distance_km'] * 1000)} meters")
+        print(f"Location: {vendor['lat']}, {vendor['lon']}")
+        if vendor.get("address"):
+            print(f"Address:  {vendor['address']}")
+        if vendor["source"] == "osm":
+            print(f"Link:     https://www.openstreetmap.org/{vendor['store_id'][len('osm:'):]}")
+    return vendors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("lat", type=float, nargs="?", default=current_lat)
+    parser.add_argument("lon", type=float, nargs="?", default=current_lon)
+    parser.add_argument("-k", type=int, default=3, help="number of stores")
+    parser.add_argument("--radius", type=int, default=5000, help="Overpass search radius in meters")
+    parser.add_argument("--online", action="store_true", help="query OpenStreetMap for uncached tiles")
+    args = parser.parse_args()
+    find_nearest_store_osm(args.lat, args.lon, k=args.k, radius_m=args.radius, online=args.online)
@@ -0,0 +1,157 @@
+"""
+Transcription service for voice memos.
+
+Single memos and batches (e.g. a foreman's backlog of recordings) go through
+the same path: requests share a token bucket so the batch as a whole stays
+under the ElevenLabs rate limit, rate-limited requests are retried with
+jittered exponential backoff, and batches run concurrently up to a limit with
+results returned in input order.
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_preprocess import preprocess
+from disk_cache import DiskCache, make_key
+from elevenlabs_tools import speech_to_text, STT_MODEL_ID
+
+MAX_CONCURRENCY = 4
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # seconds
+BACKOFF_CAP = 30.0  # seconds
+REQUESTS_PER_SECOND = 2.0
+BURST = 4
+CACHE_MAX_BYTES = 20 * 1024 * 1024
+
+
+class RateLimitError(Exception):
+    """Raised when the API is still rate limiting after all retries."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_bucket = TokenBucket(REQUESTS_PER_SECOND, BURST)
+
+# Transcripts keyed by SHA-256 of the audio and the model id, kept across restarts
+cache = DiskCache("transcripts", max_bytes=CACHE_MAX_BYTES)
+
+
+# Upload sizes before/after preprocessing, summed over this process
+upload_stats = {"recordings": 0, "bytes_in": 0, "bytes_out": 0}
+_stats_lock = threading.Lock()
+
+
+def _audio_data(audio):
+    """Returns the raw bytes (or a zero-copy buffer) of a recording."""
+    if hasattr(audio, "getbuffer"):
+        return audio.getbuffer()
+    if hasattr(audio, "read"):
+        audio.seek(0)
+        return audio.read()
+    return audio
+
+
+def audio_digest(audio):
+    """Returns the cache key for a recording (bytes, memoryview or binary file object)."""
+    return make_key(_audio_data(audio), STT_MODEL_ID)
+
+
+def _is_rate_limited(error):
+    text = str(error)
+    return "429" in text or "system_busy" in text or "rate limit" in text.lower()
+
+
+def transcribe(audio, suffix=".mp3", shrink=True):
+    """
+    Transcribes one recording, retrying rate-limit errors with backoff.
+
+    The audio is sent straight from memory, without a temp file, after WAV
+    recordings are trimmed and compressed (see audio_preprocess). Recordings
+    that were transcribed before are served from the cache.
+
+    Args:
+        audio: Raw audio bytes, a memoryview, or a binary file object
+        suffix: File extension hinting the audio format of raw bytes
+        shrink: Preprocess the audio before upload
+
+    Returns:
+        str: Transcribed text
+
+    Raises:
+        RateLimitError: if the API is still busy after MAX_RETRIES attempts
+    """
+    data = _audio_data(audio)
+    # Keyed on the original audio so re-sent memos hit before any preprocessing
+    key = make_key(data, STT_MODEL_ID)
+    text = cache.get(key)
+    if text is not None:
+        return text
+
+    if shrink:
+        data, suffix, stats = preprocess(data, suffix)
+        with _stats_lock:
+            upload_stats["recordings"] += 1
+            upload_stats["bytes_in"] += stats["bytes_in"]
+            upload_stats["bytes_out"] += stats["bytes_out"]
+
+    for attempt in range(MAX_RETRIES):
+        _bucket.acquire()
+        try:
+            text = speech_to_text(data, filename=f"recording{suffix}")
+            cache.set(key, text)
+            return text
+        except Exception as e:
+            if not _is_rate_limited(e):
+                raise
+            # Full jitter keeps concurrent workers from retrying in lockstep
+            delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            print(f"[WARN] Transcription rate limited (attempt {attempt + 1}/{MAX_RETRIES}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+    raise RateLimitError("ElevenLabs API is busy. Please try again in a moment.")
+
+
+def transcribe_batch(recordings, max_concurrency=MAX_CONCURRENCY):
+    """
+    Transcribes many recordings concurrently.
+
+    Args:
+        recordings: List of (audio, suffix) tuples or raw audio bytes / file objects
+        max_concurrency: Maximum number of requests in flight
+
+    Returns:
+        list: One entry per recording, in input order - the text, or a string
+        starting with "Error:" if that recording failed
+    """
+    def run(recording):
+        audio, suffix = recording if isinstance(recording, tuple) else (recording, ".mp3")
+        try:
+            return transcribe(audio, suffix)
+        except Exception as e:
+            return f"Error: {str(e)[:200]}"
+
+    if not recordings:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(recordings)))) as pool:
+        return list(pool.map(run, recordings))
@@ -4,19 +4,27 @@ Utility functions for the Claude Streamlit chatbot
 import base64
 import pandas as pd
 import io
-import anthropic
 import json
+import catalog
+import ledger
+import database
+import product_index
+import jobs
+import negotiation
+import planner
+import store_locator
+import contract_parser
+import pdf_extract
+import transcription
 from elevenlabs_call import start_voice_conversation
-from elevenlabs_tools import speech_to_text
-import tempfile
-import os
-import time
-import smtplib
+import hashlib
+from collections import OrderedDict
+import mailer
+import outbox
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
 import streamlit as st
-import pypdf
 
 tool_definitions = [
     {
@@ -43,6 +51,56 @@ tool_definitions = [
             "required": []
         }
     },
+    {
+        "name": "query_dataset",
+        "description": "Returns only the rows and columns you ask for from contracts, inventory, suppliers or the general catalog, as compact TSV or JSON. Prefer this over read_csv for lookups. Contract rows include a computed 'remaining' column (quantity - used). Inventory storage is a fraction (0.04 = 4%); filter it with column 'storage'.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "dataset": {
+                    "type": "string",
+                    "enum": ["contracts", "inventory", "suppliers", "catalog"]
+                },
+                "product_ids": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Only return these IDs (product_id, supplier_id or catalog artikel_id)"
+                },
+                "name": {
+                    "type": "string",
+                    "description": "Fuzzy name search (German or English)"
+                },
+                "columns": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Columns to return (default: all)"
+                },
+                "filters": {
+                    "type": "array",
+                    "description": "Row conditions, all must hold, e.g. {'column': 'storage', 'op': '<', 'value': 0.05}",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "column": {"type": "string"},
+                            "op": {"type": "string", "enum": ["<", "<=", ">", ">=", "==", "!=", "contains"]},
+                            "value": {"type": ["string", "number", "boolean"]}
+                        },
+                        "required": ["column", "op", "value"]
+                    }
+                },
+                "limit": {
+                    "type": "integer",
+                    "description": "Maximum rows to return (default 20, max 200)"
+                },
+                "format": {
+                    "type": "string",
+                    "enum": ["tsv", "json"],
+                    "description": "Output format (default tsv)"
+                }
+            },
+            "required": ["dataset"]
+        }
+    },
     {
         "name": "update_used",
         "description": "Updates the 'used' column for a product in contracts.csv. Validates that the requested quantity doesn't exceed available inventory. Use this when a user orders or consumes items.",
@@ -63,7 +121,7 @@ tool_definitions = [
     },
     {
         "name": "call_local_store",
-        "description": "Contacts the local store to request items that are not available through existing contracts. Use when contract limits are exceeded or items are not in the contract database.",
+        "description": "Contacts the local store to request items that are not available through existing contracts. Use when contract limits are exceeded or items are not in the contract database. The call runs in the background: this returns a job ID right away and the transcript is posted to the chat when the call ends.",
         "input_schema": {
             "type": "object",
             "properties": {
@@ -79,9 +137,68 @@ tool_definitions = [
             "required": ["item_name", "quantity"]
         }
     },
+    {
+        "name": "find_product",
+        "description": "Fuzzy search for products by name in the contracts and the general C-item catalog (German or English, word order and plurals don't matter). Returns the top matches with product_id, unit price and supplier. Use this to resolve an item name to a product_id instead of reading whole tables.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "Item name or description (e.g., 'TX20 screws 4x40', 'Dübel 8mm')"
+                },
+                "top_k": {
+                    "type": "integer",
+                    "description": "Number of matches to return (default 5)"
+                },
+                "source": {
+                    "type": "string",
+                    "description": "Restrict the search to contract lines or the general catalog",
+                    "enum": ["contracts", "catalog"]
+                }
+            },
+            "required": ["query"]
+        }
+    },
+    {
+        "name": "call_local_stores",
+        "description": "Calls several local vendors in parallel for the same item and returns their quotes ranked by unit price and lead time against the contract price. Use for larger shortfalls where comparing offers is worth it. Runs in the background and returns a job ID; the ranked quotes are posted to the chat when the calls end.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "item_name": {
+                    "type": "string",
+                    "description": "The name of the item to order"
+                },
+                "quantity": {
+                    "type": "integer",
+                    "description": "The quantity needed"
+                },
+                "max_vendors": {
+                    "type": "integer",
+                    "description": "How many vendors to call (default 3)"
+                }
+            },
+            "required": ["item_name", "quantity"]
+        }
+    },
+    {
+        "name": "check_local_store_call",
+        "description": "Checks on a local store call started with call_local_store. Returns its status and, once finished, the call transcript.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "job_id": {
+                    "type": "string",
+                    "description": "The job ID returned by call_local_store"
+                }
+            },
+            "required": ["job_id"]
+        }
+    },
     {
         "name": "send_order_email",
-        "description": "Sends an order email to the supplier after user confirmation. Retrieves supplier info from contracts.csv and sends formatted purchase order email.",
+        "description": "Sends an order email to the supplier after user confirmation. Retrieves supplier info from contracts.csv and queues a formatted purchase order email for delivery; the result is a queued status, delivery and retries happen in the background.",
         "input_schema": {
             "type": "object",
             "properties": {
@@ -96,10 +213,57 @@ tool_definitions = [
             },
             "required": ["product_id", "quantity"]
         }
+    },
+    {
+        "name": "plan_reorders",
+        "description": "Computes a reorder plan for items whose storage is below a threshold. The plan joins inventory with contracts: suggested quantity (refill to a target storage level, more buffer for long delivery times), how much the remaining contract headroom covers, and how much must come from a local store. Returns a compact table.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "threshold": {
+                    "type": "number",
+                    "description": "Storage share below which items are reordered (0.05 = 5%). Default: 0.05."
+                }
+            }
+        }
+    },
+    {
+        "name": "place_order",
+        "description": "Orders a basket of contract products in one call after user confirmation. All lines are checked against their remaining contract quantity together; if any line fails, nothing is ordered and the problems are listed. Otherwise one purchase-order email per supplier is queued. Prefer this over repeated send_order_email calls when ordering several products.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "lines": {
+                    "type": "array",
+                    "description": "Order lines",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "product_id": {"type": "string", "description": "Product ID from contracts (e.g., 'C001')"},
+                            "quantity": {"type": "integer", "description": "Quantity to order"}
+                        },
+                        "required": ["product_id", "quantity"]
+                    }
+                },
+                "record_usage": {
+                    "type": "boolean",
+                    "description": "Also book the quantities against the contracts (same as update_used for every line). Default: false."
+                }
+            },
+            "required": ["lines"]
+        }
     }
 ]
 
 
+def use_sqlite():
+    """True when STORAGE_BACKEND = "sqlite" is set in secrets.toml."""
+    try:
+        return st.secrets.get("STORAGE_BACKEND", "csv") == "sqlite"
+    except Exception:
+        return False
+
+
 def calculate(expression):
     """Safely evaluates a mathematical expression."""
     try:
@@ -122,11 +286,20 @@ def read_csv(dataset: str = "contracts"):
             return f"Error: Unknown dataset '{dataset}'. Use 'contracts' or 'inventory'."
 
         file_path = file_map[dataset]
-        df = pd.read_csv(file_path)
-        df.columns = [c.strip() for c in df.columns]
+        if use_sqlite():
+            # Only the preview rows are fetched; the row count comes from SQL
+            file_path = f"{database.DB_PATH} ({dataset})"
+            n_rows = database.count(dataset)
+            df = database.read_table(dataset, limit=None if dataset == "inventory" else 10)
+        elif dataset == "contracts":
+            df = ledger.effective_contracts()
+            n_rows = len(df)
+        else:
+            df = catalog.load_df(dataset).copy()
+            n_rows = len(df)
 
         result = [f"CSV File: {file_path}", ""]
-        result.append(f"Shape: {df.shape[0]} rows, {df.shape[1]} columns")
+        result.append(f"Shape: {n_rows} rows, {df.shape[1]} columns")
         result.append("")
         result.append(f"Columns: {', '.join(df.columns.tolist())}")
         result.append("")
@@ -161,37 +334,178 @@ def read_csv(dataset: str = "contracts"):
     except Exception as e:
         return f"Error reading CSV: {e}"
 
-def update_used(product_id, used_quantity):
-    """Updates the 'used' column for a specific product in contracts.csv."""
+QUERY_DATASETS = {
+    # tool dataset name -> (catalog/table name, id column, name column)
+    "contracts": ("contracts", "product_id", "product_name"),
+    "inventory": ("inventory", "product_id", "product_name"),
+    "suppliers": ("suppliers", "supplier_id", "supplier_name"),
+    "catalog": ("sample", "artikel_id", "artikelname"),
+}
+COLUMN_ALIASES = {"storage": "storage (% used)"}
+QUERY_MAX_ROWS = 200
+
+
+def _filter_mask(df, column, op, value):
+    series = df[column]
+    if op == "contains":
+        return series.astype(str).str.contains(str(value), case=False, na=False, regex=False)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        series = pd.to_numeric(series, errors="coerce")
+    ops = {
+        "<": series.lt, "<=": series.le, ">": series.gt,
+        ">=": series.ge, "==": series.eq, "!=": series.ne,
+    }
+    if op not in ops:
+        raise ValueError(f"Unsupported operator '{op}'")
+    return ops[op](value)
+
+
+SQL_OPERATORS = {"<": "<", "<=": "<=", ">": ">", ">=": ">=", "==": "=", "!=": "!="}
+
+
+def _sql_columns(dataset, table):
+    """Tool column name -> SQL expression for a table (incl. computed columns)."""
+    columns = {csv.strip(): f'"{sql}"' for csv, sql, _ in database.TABLES[table][1]}
+    if dataset == "contracts":
+        columns["remaining"] = '("quantity" - "used")'
+    return columns
+
+
+def _sql_condition(expression, op, value):
+    if op == "contains":
+        pattern = str(value).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return f"CAST({expression} AS TEXT) LIKE ? ESCAPE '\\'", f"%{pattern}%"
+    if op not in SQL_OPERATORS:
+        raise ValueError(f"Unsupported operator '{op}'")
+    return f"{expression} {SQL_OPERATORS[op]} ?", value
+
+
+def query_dataset(dataset, product_ids=None, name=None, columns=None, filters=None, limit=20, format="tsv"):
+    """
+    Returns a filtered, projected slice of a dataset.
+
+    Args:
+        dataset: 'contracts', 'inventory', 'suppliers' or 'catalog'
+        product_ids: Only keep rows with these IDs
+        name: Fuzzy name search, resolved through the product index
+        columns: Columns to return
+        filters: List of {column, op, value} conditions (AND-ed)
+        limit: Maximum number of rows
+        format: 'tsv' or 'json'
+
+    Returns:
+        str: Matching rows with a total count header
+    """
     try:
-        file_path = "contracts.csv"
-        df = pd.read_csv(file_path)
-        
-        # Find the product by product_id
-        if product_id not in df['product_id'].values:
-            return f"Error: Product ID '{product_id}' not found in database"
-        
-        # Get the row index
-        idx = df[df['product_id'] == product_id].index[0]
-        
-        # Get current values
-        current_used = df.loc[idx, 'used']
-        total_quantity = df.loc[idx, 'quantity']
-        new_used = current_used + used_quantity
-        
-        # Check if we're exceeding available quantity
-        if new_used > total_quantity:
-            available = total_quantity - current_used
-            return f"Error: Cannot use {used_quantity} units. Only {available} units available (total: {total_quantity}, already used: {current_used})"
-        
-        # Update the used column
-        df.loc[idx, 'used'] = new_used
-        
-        # Save back to CSV
-        df.to_csv(file_path, index=False)
+        if dataset not in QUERY_DATASETS:
+            return f"Error: Unknown dataset '{dataset}'. Use one of: {', '.join(QUERY_DATASETS)}."
+        table, id_col, name_col = QUERY_DATASETS[dataset]
+        limit = max(1, min(int(limit or 20), QUERY_MAX_ROWS))
+
+        if name and dataset != "suppliers":
+            source = "catalog" if dataset == "catalog" else "contracts"
+            matches = product_index.search(name, top_k=QUERY_MAX_ROWS, source=source, min_score=0.5, use_sqlite=use_sqlite())
+            name_ids = [entry["id"] for _, entry in matches]
+
+        if use_sqlite():
+            # Filters, count and limit all run in SQLite; only the returned rows are loaded
+            sql_columns = _sql_columns(dataset, table)
+            clauses, params = [], []
+            if product_ids:
+                clauses.append(f"{sql_columns[id_col]} IN ({', '.join('?' for _ in product_ids)})")
+                params += list(product_ids)
+            if name and dataset == "suppliers":
+                condition, param = _sql_condition(sql_columns[name_col], "contains", name)
+                clauses.append(condition)
+                params.append(param)
+            elif name:
+                clauses.append(f"{sql_columns[id_col]} IN ({', '.join('?' for _ in name_ids)})" if name_ids else "0")
+                params += name_ids
+            for condition in filters or []:
+                column = COLUMN_ALIASES.get(condition["column"], condition["column"])
+                if column not in sql_columns:
+                    return f"Error: Unknown column '{condition['column']}'. Available: {', '.join(sql_columns)}"
+                clause, param = _sql_condition(sql_columns[column], condition["op"], condition["value"])
+                clauses.append(clause)
+                params.append(param)
+            if columns:
+                columns = [COLUMN_ALIASES.get(c, c) for c in columns]
+                unknown = [c for c in columns if c not in sql_columns]
+                if unknown:
+                    return f"Error: Unknown column(s) {', '.join(unknown)}. Available: {', '.join(sql_columns)}"
+
+            where = " AND ".join(clauses)
+            total = database.count(table, where=where, params=params)
+            rows = database.read_table(table, where=where, params=params, limit=limit)
+            if dataset == "contracts":
+                rows = rows.assign(remaining=rows["quantity"] - rows["used"])
+            if columns:
+                rows = rows[columns]
+        else:
+            if dataset == "contracts":
+                df = ledger.effective_contracts()
+                df = df.assign(remaining=df["quantity"] - df["used"])
+            else:
+                df = catalog.load_df(table)
+
+            mask = pd.Series(True, index=df.index)
+            if product_ids:
+                mask &= df[id_col].isin(product_ids)
+            if name and dataset == "suppliers":
+                mask &= df[name_col].str.contains(name, case=False, na=False, regex=False)
+            elif name:
+                mask &= df[id_col].isin(name_ids)
+            for condition in filters or []:
+                column = COLUMN_ALIASES.get(condition["column"], condition["column"])
+                if column not in df.columns:
+                    return f"Error: Unknown column '{condition['column']}'. Available: {', '.join(df.columns)}"
+                mask &= _filter_mask(df, column, condition["op"], condition["value"])
+
+            matched = df[mask]
+            if columns:
+                columns = [COLUMN_ALIASES.get(c, c) for c in columns]
+                unknown = [c for c in columns if c not in df.columns]
+                if unknown:
+                    return f"Error: Unknown column(s) {', '.join(unknown)}. Available: {', '.join(df.columns)}"
+                matched = matched[columns]
+            total = len(matched)
+            rows = matched.head(limit)
+
+        if format == "json":
+            return json.dumps({"dataset": dataset, "total": total, "rows": rows.to_dict("records")}, default=str)
+        header = f"# {dataset}: {len(rows)} of {total} matching rows"
+        return header + "\n" + rows.to_csv(sep="\t", index=False).rstrip("\n")
+    except Exception as e:
+        return f"Error querying dataset: {e}"
+
+
+def find_product(query, top_k=5, source=None):
+    """Returns the best fuzzy matches for a product name as a compact table."""
+    try:
+        matches = product_index.search(query, top_k=top_k, source=source, min_score=0.3, use_sqlite=use_sqlite())
+        if not matches:
+            return f"No products found matching '{query}'"
+        lines = ["score | source | product_id | product_name | unit | unit_price_eur | supplier"]
+        for score, entry in matches:
+            lines.append(f"{score:.2f} | {entry['source']} | {entry['id']} | {entry['name']} | {entry['unit']} | {entry['unit_price_eur']} | {entry['supplier']}")
+        return "\n".join(lines)
+    except Exception as e:
+        return f"Error searching products: {e}"
+
+def update_used(product_id, used_quantity, contract_id=None):
+    """Records usage for a product in the contracts ledger (see ledger.py) or SQLite."""
+    try:
+        if use_sqlite():
+            outcome = database.consume(product_id, used_quantity, contract_id)
+        else:
+            outcome = ledger.record_usage(product_id, used_quantity, contract_id)
+        if "error" in outcome:
+            return outcome["error"]
         
         # Return success message with details
-        product_name = df.loc[idx, 'product_name']
+        product_name = outcome["row"]['product_name']
+        new_used = outcome["used"]
+        total_quantity = outcome["total"]
         remaining = total_quantity - new_used
         result = f"✅ Updated {product_name} (ID: {product_id})\n"
         result += f"Used: {used_quantity} units\n"
@@ -201,9 +515,243 @@ def update_used(product_id, used_quantity):
     except Exception as e:
         return f"Error updating CSV: {e}"
 
-def call_local_store(item_name: str, quantity: int) -> str:
+def reserve_usage(lines):
+    """
+    Books usage for several contract lines at once, all or nothing.
+
+    Args:
+        lines: List of (product_id, quantity, contract_id)
+
+    Returns:
+        dict: {"lines": [...]} or {"error": ...}
+    """
+    if use_sqlite():
+        return database.consume_many(lines)
+    return ledger.record_usage_many(lines)
+
+
+def release_usage(lines):
+    """Takes back usage booked with reserve_usage."""
+    if use_sqlite():
+        database.release(lines)
+    else:
+        ledger.release_usage(lines)
+
+
+def plan_reorders(threshold=planner.REORDER_THRESHOLD):
+    """
+    Builds the reorder plan for items below the storage threshold.
+
+    Args:
+        threshold: Storage share below which items are reordered
+
+    Returns:
+        str: Compact plan table or error message
+    """
+    try:
+        if use_sqlite():
+            inventory = database.read_table("inventory")
+            contracts = database.read_table("contracts")
+        else:
+            inventory = catalog.load_df("inventory")
+            contracts = ledger.effective_contracts()
+        plan = planner.plan_reorders(inventory, contracts, threshold=threshold)
+        return planner.format_plan(plan)
+    except Exception as e:
+        return f"Error planning reorders: {e}"
+
+
+def resolve_basket(lines):
+    """
+    Resolves order lines against contracts and suppliers in one pass.
+
+    Repeated product IDs are merged into one line.
+
+    Args:
+        lines: List of {"product_id", "quantity"} dicts
+
+    Returns:
+        DataFrame: One row per product with the contract, supplier and
+        remaining contract quantity (NaN where the product is unknown)
+    """
+    basket = pd.DataFrame(lines, columns=["product_id", "quantity"])
+    basket["product_id"] = basket["product_id"].astype(str).str.strip()
+    basket["quantity"] = pd.to_numeric(basket["quantity"], errors="coerce")
+    basket = basket.groupby("product_id", sort=False, as_index=False)["quantity"].sum(min_count=1)
+    product_ids = basket["product_id"].tolist()
+
+    if use_sqlite():
+        contracts = database.get_contracts_with_suppliers(product_ids)
+    else:
+        contracts = ledger.effective_contracts()
+        contracts = contracts[contracts["product_id"].isin(product_ids)]
+        suppliers = catalog.load_df("suppliers")[["supplier_id", "supplier_name", "contact_email"]]
+        contracts = contracts.merge(suppliers, on="supplier_id", how="left")
+    # A product can be on several contracts; order from the line with the most left
+    contracts = (
+        contracts.assign(_left=contracts["quantity"] - contracts["used"])
+        .sort_values("_left", ascending=False, kind="stable")
+        .drop_duplicates("product_id")
+        .drop(columns="_left")
+        .rename(columns={"quantity": "contract_quantity"})
+    )
+
+    merged = basket.merge(contracts, on="product_id", how="left")
+    merged["remaining"] = merged["contract_quantity"] - merged["used"]
+    return merged
+
+
+def place_order(lines, record_usage=False, idempotency_key=None):
+    """
+    Orders a basket of contract products: one purchase order per supplier.
+
+    The whole basket is validated first (unknown products, invalid quantities,
+    contract limits, missing supplier emails); if any line fails nothing is
+    ordered. With record_usage, all lines are booked in one step before the
+    emails are queued, and the booking is taken back if queuing fails.
+
+    Args:
+        lines: List of {"product_id", "quantity"} dicts
+        record_usage: Also book each line against its contract
+        idempotency_key: Key for this order (e.g. the tool_use id)
+
+    Returns:
+        str: Order summary or the list of problems
+    """
+    if not lines:
+        return "Error: The basket is empty"
+    try:
+        basket = resolve_basket(lines)
+    except Exception as e:
+        return f"Error resolving order lines: {e}"
+
+    problems = []
+    unknown = basket["product_name"].isna()
+    bad_quantity = ~unknown & ~(basket["quantity"] > 0)
+    over_limit = ~unknown & ~bad_quantity & (basket["quantity"] > basket["remaining"])
+    no_email = ~unknown & basket["contact_email"].isna()
+    for row in basket[unknown].itertuples():
+        problems.append(f"{row.product_id}: not found in contracts")
+    for row in basket[bad_quantity].itertuples():
+        problems.append(f"{row.product_id}: invalid quantity {row.quantity}")
+    for row in basket[over_limit].itertuples():
+        problems.append(f"{row.product_id} ({row.product_name}): {row.quantity:g} requested but only {row.remaining:g} left on the contract")
+    for row in basket[no_email].itertuples():
+        problems.append(f"{row.product_id}: no email address for supplier {row.supplier_id}")
+    if problems:
+        return "Error: Nothing was ordered. Fix these lines first:\n" + "\n".join(f"- {p}" for p in problems)
+
+    basket["quantity"] = basket["quantity"].astype(int)
+    basket["line_total"] = basket["quantity"] * basket["unit_price_eur"]
+    order_lines = [
+        {
+            "supplier_email": row.contact_email,
+            "supplier_name": row.supplier_name,
+            "product_name": row.product_name,
+            "quantity": row.quantity,
+            "unit_price": row.unit_price_eur,
+            "total_price": row.line_total,
+            "delivery_days": row.delivery_days,
+        }
+        for row in basket.itertuples()
+    ]
+
+    # Book usage before anything is queued, so a failed limit check orders nothing
+    booked = []
+    if record_usage:
+        booked = [(row.product_id, row.quantity, row.contract_id) for row in basket.itertuples()]
+        reserved = reserve_usage(booked)
+        if "error" in reserved:
+            return f"Error: Nothing was ordered. Fix these lines first:\n- {reserved['error']}"
+
+    try:
+        queued = enqueue_purchase_orders(order_lines, idempotency_key)
+    except Exception as e:
+        if booked:
+            release_usage(booked)
+        return f"Error: Nothing was ordered; the purchase orders could not be queued: {e}"
+    replayed = all(entry["duplicate"] for _, _, entry in queued)
+    if booked and replayed:
+        # Same order placed before (e.g. a retried tool call): its usage is already booked
+        release_usage(booked)
+
+    result = f"Order for {len(basket)} line(s) across {basket['supplier_id'].nunique()} supplier(s), total €{basket['line_total'].sum():.2f}\n"
+    for supplier_id, group in basket.groupby("supplier_id", sort=False):
+        result += f"{supplier_id} ({group['supplier_name'].iloc[0]}): " + ", ".join(
+            f"{r.quantity} x {r.product_name}" for r in group.itertuples()
+        ) + "\n"
+    result += "\n".join(describe_queued(*q) for q in queued)
+
+    if booked and replayed:
+        result += "\nUsage was already booked when this order was first placed."
+    elif booked:
+        for line in reserved["lines"]:
+            row = line["row"]
+            result += f"\n✅ Booked {row['product_name']} ({row['product_id']}, {row['contract_id']}): {line['used']}/{line['total']} used"
+    return result
+
+
+def call_local_store(item_name: str, quantity: int, session_id=None) -> str:
+    """
+    Queues a local store call as a background job and returns immediately.
+    
+    Args:
+        item_name: Name of the item to order
+        quantity: Quantity of items needed
+        session_id: Chat session to post the transcript to when the call ends
+        
+    Returns:
+        Confirmation message with the job ID
+    """
+    try:
+        job_id = jobs.get_queue().submit(
+            "local_store_call",
+            {"item_name": item_name, "quantity": quantity},
+            session_id=session_id,
+        )
+        return (
+            f"📞 Local store call queued for {quantity} units of '{item_name}'. Job ID: {job_id}. "
+            "The transcript will be posted to the chat when the call ends; use `check_local_store_call` to check on it."
+        )
+    except Exception as e:
+        return f"📞 Could not queue local store call for {quantity} units of '{item_name}'. (Error: {str(e)[:100]})"
+
+
+def check_local_store_call(job_id: str) -> str:
+    """Returns the status (and transcript, once finished) of a queued local store call."""
+    job = jobs.get_queue().get(job_id)
+    if job is None:
+        return f"Error: No job with ID '{job_id}'"
+    return jobs.describe(job)
+
+
+SITE_ADDRESS = "Main Street 12, Munich"  # Could be made dynamic
+
+
+def site_location():
+    """Returns the construction site's (lat, lon), configurable as SITE_LAT / SITE_LON in secrets."""
+    lat, lon = store_locator.DEFAULT_SITE
+    return float(st.secrets.get("SITE_LAT", lat)), float(st.secrets.get("SITE_LON", lon))
+
+
+def contract_unit_price(item_name):
+    """Returns the contract unit price of the best fuzzy match for item_name, or None."""
+    try:
+        # Try to find the item by name (fuzzy match against contract lines)
+        matches = product_index.search(item_name, top_k=1, source="contracts", min_score=0.6, use_sqlite=use_sqlite())
+        if matches:
+            unit_price = float(matches[0][1]['unit_price_eur'])
+            print(f"[INFO] Found contract price for '{item_name}': {unit_price:.2f} EUR per unit")
+            return unit_price
+    except Exception as e:
+        print(f"[WARN] Could not lookup contract price: {e}")
+    return None
+
+
+def run_local_store_call(item_name: str, quantity: int) -> str:
     """
     Contact local store via ElevenLabs conversational AI agent for items not available in contracts.
+    Runs on a job worker thread (see call_local_store).
     
     Args:
         item_name: Name of the item to order
@@ -211,60 +759,186 @@ def call_local_store(item_name: str, quantity: int) -> str:
         
     Returns:
         Confirmation message
+
+    Raises:
+        RuntimeError: if the call fails, so the job is marked failed
     """
     try:
-        # Use the wrapper that returns transcript details
-        
-        
         # Look up contract price for the item to use as target price
         target_price = "Best available price"  # default fallback
-        try:
-            file_path = "contracts.csv"
-            df = pd.read_csv(file_path)
-            # Try to find the item by name (case-insensitive partial match)
-            matching_rows = df[df['product_name'].str.contains(item_name, case=False, na=False)]
-            if not matching_rows.empty:
-                unit_price = matching_rows.iloc[0]['unit_price_eur']
-                target_price = f"{unit_price:.2f} EUR per unit"
-                print(f"[INFO] Found contract price for '{item_name}': {target_price}")
-        except Exception as e:
-            print(f"[WARN] Could not lookup contract price: {e}")
+        unit_price = contract_unit_price(item_name)
+        if unit_price is not None:
+            target_price = f"{unit_price:.2f} EUR per unit"
         
         # Prepare order details for the agent
         order_list = f"{quantity} x {item_name}"
-        site_address = "Main Street 12, Munich"  # Could be made dynamic
-        vendor_name = "Local Hardware Store"
+        site_address = SITE_ADDRESS
+        vendors = candidate_vendors(1)
+        vendor_name = vendors[0]["store_name"] if vendors else "Local Hardware Store"
+        if vendors and vendors[0].get("distance_km") is not None:
+            print(f"[INFO] Nearest vendor: {vendor_name} ({vendors[0]['distance_km']} km)")
         
         # Start the voice conversation with the agent
         print(f"🎤 Initiating voice call for {quantity} units of '{item_name}'...")
         
-        conversation_info = start_voice_conversation(
+        info = start_voice_conversation(
             order_list=order_list,
             target_price=target_price,
             site_address=site_address,
             vendor_name=vendor_name
         )
-        
-        conversation_id = conversation_info.get("conversation_id") if isinstance(conversation_info, dict) else conversation_info
-        transcript = conversation_info.get("transcript", "") if isinstance(conversation_info, dict) else ""
-        success = conversation_info.get("success", bool(conversation_id)) if isinstance(conversation_info, dict) else bool(conversation_id)
 
-        if success and conversation_id:
-            msg = f"📞 Voice call completed for {quantity} units of '{item_name}'. Conversation ID: {conversation_id}"
+        if info["success"]:
+            msg = f"📞 Voice call with {vendor_name} completed for {quantity} units of '{item_name}'. Conversation ID: {info['conversation_id']}"
             # Keep transcript in tool result for Claude to process, but don't display in UI
-            if transcript:
-                msg += f"\n\nTranscript: {transcript}"
+            if info["transcript"]:
+                msg += f"\n\nTranscript: {info['transcript']}"
             return msg
         else:
-            return f"📞 Voice call initiated for {quantity} units of '{item_name}' but was interrupted."
+            raise RuntimeError(
+                f"Voice call with {vendor_name} for {quantity} units of '{item_name}' failed or was interrupted"
+                f" (conversation ID: {info['conversation_id']})"
+            )
             
     except Exception as e:
-        # Fallback to placeholder if voice call fails
-        return f"📞 Local store contact attempted for {quantity} units of '{item_name}'. (Error: {str(e)[:100]})"
+        raise RuntimeError(f"Local store call for {quantity} units of '{item_name}' failed: {str(e)[:200]}") from e
     
-def get_base64_encoded_image(image_file):
-    """Converts an uploaded image file to base64 string."""
-    return base64.b64encode(image_file.getvalue()).decode('utf-8')
+def call_local_stores(item_name: str, quantity: int, max_vendors: int = 3, session_id=None) -> str:
+    """
+    Queues calls to several local vendors at once to collect competing quotes.
+    
+    Args:
+        item_name: Name of the item to order
+        quantity: Quantity of items needed
+        max_vendors: Number of vendors to call
+        session_id: Chat session to post the ranked quotes to
+        
+    Returns:
+        Confirmation message with the job ID
+    """
+    try:
+        job_id = jobs.get_queue().submit(
+            "multi_vendor_quote",
+            {"item_name": item_name, "quantity": quantity, "max_vendors": max_vendors},
+            session_id=session_id,
+        )
+        return (
+            f"📞 Calling up to {max_vendors} local vendors for {quantity} units of '{item_name}'. Job ID: {job_id}. "
+            "The ranked quotes will be posted to the chat when the calls end."
+        )
+    except Exception as e:
+        return f"📞 Could not queue vendor calls for {quantity} units of '{item_name}'. (Error: {str(e)[:100]})"
+
+
+def candidate_vendors(max_vendors):
+    """
+    Returns the local vendors nearest to the site, as store dicts with `distance_km`.
+
+    Uses local_stores.csv and cached OSM data; set STORE_LOCATOR_ONLINE = true in
+    secrets to also look up hardware stores around the site on OpenStreetMap.
+    """
+    lat, lon = site_location()
+    try:
+        return store_locator.nearest_vendors(
+            lat, lon, k=max_vendors, online=bool(st.secrets.get("STORE_LOCATOR_ONLINE", False))
+        )
+    except Exception as e:
+        print(f"[WARN] Store locator failed ({e}); using the first vendors in local_stores.csv")
+        return catalog.load_df("local_stores").head(max_vendors).to_dict("records")
+
+
+def run_multi_vendor_quote(item_name: str, quantity: int, max_vendors: int = 3) -> str:
+    """
+    Calls several local vendors concurrently and ranks their quotes (job handler).
+    
+    Args:
+        item_name: Name of the item to order
+        quantity: Quantity of items needed
+        max_vendors: Number of vendors to call
+        
+    Returns:
+        Ranked quote table
+    """
+    unit_price = contract_unit_price(item_name)
+    target_price = f"{unit_price:.2f} EUR per unit" if unit_price is not None else "Best available price"
+    vendors = candidate_vendors(max_vendors)
+    if not vendors:
+        raise RuntimeError("No local vendors configured in local_stores.csv")
+
+    def call_vendor(vendor):
+        print(f"🎤 Calling {vendor['store_name']} for {quantity} units of '{item_name}'...")
+        info = start_voice_conversation(
+            order_list=f"{quantity} x {item_name}",
+            target_price=target_price,
+            site_address=SITE_ADDRESS,
+            vendor_name=vendor["store_name"],
+            call_deadline=negotiation.CALL_DEADLINE,
+        )
+        if not info["success"]:
+            raise RuntimeError(f"call failed or was interrupted (conversation ID: {info['conversation_id']})")
+        return info.get("transcript", "")
+
+    quotes = negotiation.negotiate(vendors, call_vendor, target_price=unit_price, quantity=quantity)
+    header = f"📞 Quotes for {quantity} x '{item_name}' (contract price: {target_price})"
+    return header + "\n" + negotiation.format_quotes(quotes)
+
+
+
+# Claude downsamples anything with a longer edge than this, so larger uploads only cost bandwidth
+IMAGE_MAX_EDGE = 1568
+IMAGE_JPEG_QUALITY = 85
+IMAGE_CACHE_SIZE = 32
+_image_cache = OrderedDict()
+
+
+def prepare_image(image_bytes, media_type):
+    """
+    Downscales and re-encodes an uploaded image for the Claude API.
+
+    The image is rotated per its EXIF orientation, shrunk to IMAGE_MAX_EDGE and
+    saved as JPEG without metadata. Results are cached by content hash, so the
+    same photo uploaded again is not processed twice.
+
+    Args:
+        image_bytes: Raw uploaded file bytes
+        media_type: MIME type of the upload (e.g., 'image/png')
+
+    Returns:
+        tuple: (sha256 hex digest, base64 string, media type)
+    """
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    if digest in _image_cache:
+        _image_cache.move_to_end(digest)
+        return (digest, *_image_cache[digest])
+
+    data = image_bytes
+    try:
+        from PIL import Image, ImageOps
+
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+        image.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+        if image.mode in ("RGBA", "LA", "P"):
+            # JPEG has no alpha channel; flatten onto white
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+        data, media_type = out.getvalue(), "image/jpeg"
+        print(f"[INFO] Image preprocessed: {len(image_bytes)} -> {len(data)} bytes ({image.size[0]}x{image.size[1]})")
+    except ImportError:
+        print("[WARN] Pillow not installed; sending the original image. Run: pip install Pillow")
+    except Exception as e:
+        print(f"[WARN] Image preprocessing failed, sending the original: {e}")
+
+    encoded = base64.b64encode(data).decode('utf-8')
+    _image_cache[digest] = (encoded, media_type)
+    if len(_image_cache) > IMAGE_CACHE_SIZE:
+        _image_cache.popitem(last=False)
+    return digest, encoded, media_type
 
 
 def save_audio_to_mp3(audio_bytes):
@@ -287,38 +961,10 @@ def transcribe_audio_with_elevenlabs(audio_bytes):
         str: Transcribed text or error message
     """
     try:
-
-        
-        # Save audio bytes to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_file:
-            temp_file.write(audio_bytes)
-            temp_file_path = temp_file.name
-        
-        try:
-            # Retry logic for rate limiting
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    # Transcribe using ElevenLabs
-                    transcription = speech_to_text(temp_file_path)
-                    return transcription
-                except Exception as e:
-                    error_str = str(e)
-                    # Check if it's a rate limit error
-                    if "429" in error_str or "system_busy" in error_str:
-                        if attempt < max_retries - 1:
-                            wait_time = (attempt + 1) * 2  # 2, 4, 6 seconds
-                            time.sleep(wait_time)
-                            continue
-                        else:
-                            return "Error: ElevenLabs API is busy. Please try again in a moment."
-                    else:
-                        raise e
-        finally:
-            # Clean up temp file
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
-                
+        # In-memory upload: no temp file round trip on the voice memo path
+        return transcription.transcribe(save_audio_to_mp3(audio_bytes))
+    except transcription.RateLimitError as e:
+        return f"Error: {e}"
     except ImportError:
         return "Error: elevenlabs package not installed. Run: pip install elevenlabs"
     except Exception as e:
@@ -327,7 +973,7 @@ def transcribe_audio_with_elevenlabs(audio_bytes):
 
 def get_supplier_info(supplier_id):
     """
-    Retrieves supplier information from suppliers.csv.
+    Retrieves supplier information from suppliers.csv (or the SQLite backend).
     
     Args:
         supplier_id: The supplier ID (e.g., 'SUP001')
@@ -335,59 +981,82 @@ def get_supplier_info(supplier_id):
     Returns:
         dict: Supplier information or error message
     """
-    df = pd.read_csv("suppliers.csv")
-    supplier = df[df['supplier_id'] == supplier_id]
+    if use_sqlite():
+        supplier = database.get_supplier(supplier_id)
+    else:
+        supplier = catalog.lookup("suppliers", "supplier_id", supplier_id)
     
-    if supplier.empty:
+    if supplier is None:
         return {"error": f"Supplier {supplier_id} not found"}
     
-    return supplier.iloc[0].to_dict()
+    return supplier
 
 
-def send_order_email(to_email, supplier_name, product_name, quantity, unit_price, total_price, delivery_days):
+def smtp_pool():
     """
-    Sends an order email to the supplier.
-    
+    Returns the pooled SMTP connection for the configured server.
+
+    SMTP_STARTTLS = false and an empty SMTP_PASSWORD let a local test server
+    (e.g. `python -m aiosmtpd -n -l localhost:1025`) stand in for the provider.
+
+    Returns:
+        tuple: (SMTPPool, sender address), or (None, error message)
+    """
+    if "SMTP_EMAIL" not in st.secrets or "SMTP_PASSWORD" not in st.secrets:
+        return None, "Error: Email credentials not configured in secrets.toml"
+    pool = mailer.get_pool(
+        st.secrets.get("SMTP_SERVER", "smtp.gmail.com"),
+        st.secrets.get("SMTP_PORT", 587),
+        st.secrets["SMTP_EMAIL"],
+        st.secrets["SMTP_PASSWORD"],
+        starttls=st.secrets.get("SMTP_STARTTLS", True),
+    )
+    return pool, st.secrets["SMTP_EMAIL"]
+
+
+def purchase_order_message(sender_email, to_email, supplier_name, lines):
+    """
+    Builds one purchase-order email for all order lines going to a supplier.
+
     Args:
+        sender_email: From address
         to_email: Supplier email address
         supplier_name: Name of the supplier
-        product_name: Name of the product
-        quantity: Quantity to order
-        unit_price: Price per unit
-        total_price: Total order price
-        delivery_days: Expected delivery days
-        
+        lines: List of dicts with product_name, quantity, unit_price and delivery_days
+
     Returns:
-        str: Success or error message
+        MIMEMultipart: The message
     """
-
-    # Get email credentials from secrets
-    if "SMTP_EMAIL" not in st.secrets or "SMTP_PASSWORD" not in st.secrets:
-        return "Error: Email credentials not configured in secrets.toml"
-    
-    sender_email = st.secrets["SMTP_EMAIL"]
-    sender_password = st.secrets["SMTP_PASSWORD"]
-    smtp_server = st.secrets.get("SMTP_SERVER", "smtp.gmail.com")
-    smtp_port = st.secrets.get("SMTP_PORT", 587)
-    
-    # Create email
     msg = MIMEMultipart()
     msg['From'] = sender_email
     msg['To'] = to_email
-    msg['Subject'] = f"Purchase Order - {product_name}"
-    
+
+    if len(lines) == 1:
+        line = lines[0]
+        msg['Subject'] = f"Purchase Order - {line['product_name']}"
+        order_text = f"""Product: {line['product_name']}
+Quantity: {line['quantity']}
+Unit Price: €{line['unit_price']:.2f}
+Total Price: €{line.get('total_price', line['unit_price'] * line['quantity']):.2f}
+
+Expected Delivery: {line['delivery_days']} working days"""
+    else:
+        msg['Subject'] = f"Purchase Order - {len(lines)} items"
+        rows = [
+            f"- {line['product_name']}: {line['quantity']} x €{line['unit_price']:.2f} = "
+            f"€{line['unit_price'] * line['quantity']:.2f} (delivery: {line['delivery_days']} working days)"
+            for line in lines
+        ]
+        total = sum(line['unit_price'] * line['quantity'] for line in lines)
+        order_text = "\n".join(rows) + f"\n\nOrder Total: €{total:.2f}"
+
     # Email body
     body = f"""
 Dear {supplier_name},
 
 We would like to place the following order:
 
-Product: {product_name}
-Quantity: {quantity}
-Unit Price: €{unit_price:.2f}
-Total Price: €{total_price:.2f}
-
-Expected Delivery: {delivery_days} working days
+{order_text}
 
 Please confirm receipt of this order and provide an estimated delivery date.
 
@@ -398,16 +1067,88 @@ Procurement Department
 ---
 Order Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}
 """
-        
     msg.attach(MIMEText(body, 'plain'))
-    
-    # Send email
-    with smtplib.SMTP(smtp_server, smtp_port) as server:
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.send_message(msg)
-    
-    return f"✅ Order email sent successfully to {to_email} (from {sender_email})"
+    return msg
+
+
+def group_by_supplier(lines):
+    """
+    Groups order lines into one purchase order per supplier email, in first-seen order.
+
+    Returns:
+        dict: supplier email -> list of lines
+    """
+    by_supplier = {}
+    for line in lines:
+        by_supplier.setdefault(line['supplier_email'], []).append(line)
+    return by_supplier
+
+
+def deliver_email(msg):
+    """Outbox delivery callback: sends one message over the SMTP pool (raises on failure)."""
+    pool, sender_email = smtp_pool()
+    if pool is None:
+        raise RuntimeError(sender_email)
+    pool.send(msg)
+
+
+def enqueue_purchase_orders(lines, idempotency_key=None):
+    """
+    Queues one purchase-order email per supplier in the outbox, all or nothing.
+
+    Args:
+        lines: List of dicts with supplier_email, supplier_name, product_name,
+            quantity, unit_price and delivery_days
+        idempotency_key: Key for this order (e.g. the tool_use id); queuing the
+            same key again does not send a second email
+
+    Returns:
+        list: (supplier email, lines, outbox row) per supplier
+
+    Raises:
+        RuntimeError: if no sender address is configured
+    """
+    if "SMTP_EMAIL" not in st.secrets:
+        raise RuntimeError("Error: Email credentials not configured in secrets.toml")
+    sender_email = st.secrets["SMTP_EMAIL"]
+
+    by_supplier = group_by_supplier(lines)
+    items = [
+        (
+            purchase_order_message(sender_email, to_email, group[0]['supplier_name'], group),
+            f"{idempotency_key}:{to_email}" if idempotency_key else None,
+        )
+        for to_email, group in by_supplier.items()
+    ]
+    entries = outbox.get_outbox().enqueue_many(items)
+    return [(to_email, group, entry) for (to_email, group), entry in zip(by_supplier.items(), entries)]
+
+
+def queue_purchase_orders(lines, idempotency_key=None):
+    """
+    Queues one purchase-order email per supplier in the outbox and returns at once.
+
+    Args:
+        lines: List of dicts with supplier_email, supplier_name, product_name,
+            quantity, unit_price and delivery_days
+        idempotency_key: Key for this order (e.g. the tool_use id); queuing the
+            same key again does not send a second email
+
+    Returns:
+        list: One status string per supplier
+    """
+    try:
+        queued = enqueue_purchase_orders(lines, idempotency_key)
+    except RuntimeError as e:
+        return [str(e)]
+    return [describe_queued(to_email, group, entry) for to_email, group, entry in queued]
+
+
+def describe_queued(to_email, group, entry):
+    """Status line for one queued purchase-order email."""
+    if entry["duplicate"]:
+        return f"Order email to {to_email} was already queued (outbox #{entry['id']}, status: {entry['status']})"
+    return f"📨 Order email to {to_email} queued for delivery (outbox #{entry['id']}, {len(group)} line(s))"
 
 
 def send_demo_call_link(to_email: str, call_url: str) -> str:
@@ -421,13 +1162,9 @@ def send_demo_call_link(to_email: str, call_url: str) -> str:
     Returns:
         str: Success or error message
     """
-    if "SMTP_EMAIL" not in st.secrets or "SMTP_PASSWORD" not in st.secrets:
-        return "Error: Email credentials not configured in secrets.toml"
-
-    sender_email = st.secrets["SMTP_EMAIL"]
-    sender_password = st.secrets["SMTP_PASSWORD"]
-    smtp_server = st.secrets.get("SMTP_SERVER", "smtp.gmail.com")
-    smtp_port = st.secrets.get("SMTP_PORT", 587)
+    pool, sender_email = smtp_pool()
+    if pool is None:
+        return sender_email
 
     msg = MIMEMultipart()
     msg['From'] = sender_email
@@ -448,101 +1185,45 @@ NAIled It
 """
 
     msg.attach(MIMEText(body, 'plain'))
-
-    with smtplib.SMTP(smtp_server, smtp_port) as server:
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.send_message(msg)
+    pool.send(msg)
 
     return f"✅ Demo call link sent to {to_email}"
 
 
-def extract_contract_from_pdf(pdf_file):
+def extract_contract_from_pdf(pdf_file, on_progress=None):
     """
     Extracts text from a PDF file.
     
     Args:
         pdf_file: Uploaded file object
+        on_progress: Optional callback(pages_done, total_pages)
         
     Returns:
         str: Extracted text
     """
     try:
-
-        
-        pdf_reader = pypdf.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-            
-        return text
+        pdf_bytes = pdf_file.getvalue() if hasattr(pdf_file, "getvalue") else pdf_file.read()
+        return pdf_extract.extract_text(pdf_bytes, on_progress=on_progress)
     except Exception as e:
         return f"Error extracting PDF: {e}"
 
 
-def parse_contract_to_df(text, api_key):
+def parse_contract_to_df(text, api_key, on_progress=None):
     """
     Parses contract text into a DataFrame matching contracts.csv schema using Claude.
     
+    Long contracts are split into chunks that are parsed concurrently (see
+    contract_parser.py).
+    
     Args:
         text: Raw contract text
         api_key: Anthropic API key
+        on_progress: Optional callback(chunks_done, total_chunks, rows_so_far)
         
     Returns:
         pd.DataFrame: Parsed contract data
     """
     try:
-        
-        client = anthropic.Anthropic(api_key=api_key)
-        
-        prompt = f"""
-        Extract the contract data from the text below into a JSON format that matches this CSV schema:
-        
-        Columns: 
-        - contract_id (Extract from date or ID, e.g., ACME_2025)
-        - product_id
-        - product_name
-        - unit
-        - quantity (Total contract quantity)
-        - unit_price_eur
-        - line_total_eur
-        - is_c_item (Set to true)
-        - used (Set strictly to 0)
-        - supplier_id (Generate a generic ID like SUP_NEW if unknown, or extract)
-        - payment_terms
-        - delivery_days (Extract number of days)
-        
-        Return ONLY valid JSON list of objects. No other text.
-        
-        Contract Text:
-        {text}
-        """
-        
-        response = client.messages.create(
-            model="claude-sonnet-4-5-20250929",
-            max_tokens=2000,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        
-        json_str = response.content[0].text
-        
-        # Robust JSON extraction: Strip markdown code blocks
-        if "```json" in json_str:
-            json_str = json_str.split("```json")[1].split("```")[0].strip()
-        elif "```" in json_str:
-            json_str = json_str.split("```")[1].split("```")[0].strip()
-            
-        # Ensure we only try to parse the array
-        start_idx = json_str.find('[')
-        end_idx = json_str.rfind(']')
-        
-        if start_idx != -1 and end_idx != -1:
-            json_str = json_str[start_idx:end_idx+1]
-        
-        data = json.loads(json_str)
-        
-        df = pd.DataFrame(data)
-        return df
-        
+        return contract_parser.parse_contract(text, api_key, on_progress=on_progress)
     except Exception as e:
-        return f"Error parsing contract: {e}"
\ No newline at end of file
+        return f"Error parsing contract: {e}"